@@ -3,13 +3,117 @@ import tkinter as tk
 import socket
 import json
 import os
-import select
+import tempfile
 from queue import Queue, Empty
+from collections import deque
 import time
+import itertools
 import google.generativeai as genai
 import cv2
-import numpy as np
-from PIL import Image, ImageTk
+from reactor import Reactor
+from framing import encode_frame, FrameDecoder, FrameError
+from concurrent.futures import ThreadPoolExecutor
+from compression import available, looks_compressible, negotiate
+from logwriter import DEBUG, INFO, MAX_LOG_SIZE, open_log
+from video import (FrameReceiver, FrameView, QualityController, TileEncoder, UdpFrameReceiver, UdpVideoServer,
+                   VideoBroadcaster, VideoGrid)
+from transfer import (BufferPool, ChunkProgress, ContentStore, FanOutSender, Manifest, Swarm, FILE_ACCEPT_TIMEOUT,
+                      MAX_STREAMS, preallocate, range_indexes, receive_chunks, stripe)
+
+class PeerConnection:
+    def __init__(self, sock, address, port=None, on_error=None, limit=4 * 1024 * 1024, policy="disconnect"):
+        self.sock = sock
+        self.address = address
+        self.port = port  # port của peer nếu kết nối do mình mở, None với kết nối đến
+        self.decoder = FrameDecoder(on_error=on_error)
+        self.replies = {}  # số hiệu lần gửi file -> Queue chờ file_port của lần gửi đó trên kết nối này
+        self.compress = False  # peer đã báo hiểu frame nén zlib
+        # Hàng đợi gửi riêng của kết nối; chỉ thread reactor ghi ra socket
+        self.lock = Lock()
+        self.outbox = deque()
+        self.queued = 0
+        self.limit = limit
+        self.policy = policy  # "drop", "disconnect" hoặc "disk" khi peer nhận quá chậm
+        self.spill = None
+        self.spilled = 0
+        self.flush_scheduled = False
+        self.closed = False
+        self.last_seen = time.monotonic()
+        self.stats = {"sent": 0, "dropped": 0, "spilled": 0, "high_watermark": 0}
+
+    def enqueue(self, data):
+        # Trả về (kết quả, có cần lên lịch flush không)
+        with self.lock:
+            if self.closed:
+                return "closed", False
+            if self.spilled or self.queued + len(data) > self.limit:
+                if self.policy == "drop":
+                    self.stats["dropped"] += 1
+                    return "dropped", False
+                if self.policy == "disconnect":
+                    return "disconnect", False
+                if self.spill is None:
+                    self.spill = tempfile.TemporaryFile()
+                self.spill.seek(0, os.SEEK_END)
+                self.spill.write(data)
+                self.spilled += len(data)
+                self.stats["spilled"] += len(data)
+            else:
+                self.outbox.append(data)
+                self.queued += len(data)
+                self.stats["high_watermark"] = max(self.stats["high_watermark"], self.queued)
+            schedule = not self.flush_scheduled
+            self.flush_scheduled = True
+            return "queued", schedule
+
+    def next_chunk(self, max_bytes=65536):
+        with self.lock:
+            if not self.outbox and self.spilled:
+                # Đọc lại phần đã tràn ra đĩa theo đúng thứ tự
+                self.spill.seek(self.spill_offset())
+                data = self.spill.read(min(self.spilled, 256 * 1024))
+                self.spilled -= len(data)
+                if not self.spilled:
+                    self.spill.seek(0)
+                    self.spill.truncate()
+                self.outbox.append(data)
+                self.queued += len(data)
+            if not self.outbox:
+                self.flush_scheduled = False
+                return None
+            if len(self.outbox) == 1 or len(self.outbox[0]) >= max_bytes:
+                return self.outbox[0]
+            parts = []
+            size = 0
+            while self.outbox and size + len(self.outbox[0]) <= max_bytes:
+                part = self.outbox.popleft()
+                parts.append(part)
+                size += len(part)
+            data = b"".join(parts)
+            self.outbox.appendleft(data)
+            return data
+
+    def spill_offset(self):
+        self.spill.seek(0, os.SEEK_END)
+        return self.spill.tell() - self.spilled
+
+    def consumed(self, sent):
+        with self.lock:
+            head = self.outbox.popleft()
+            if sent < len(head):
+                self.outbox.appendleft(memoryview(head)[sent:])
+            self.queued -= sent
+            self.stats["sent"] += sent
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.outbox.clear()
+            self.queued = 0
+            if self.spill:
+                self.spill.close()
+                self.spill = None
+            self.spilled = 0
 
 class Peer:
     listSocket = {}
@@ -18,7 +122,28 @@ class Peer:
     endAllThread = False
     ports = []
     centralServerPort = 8000
-    listFriend = ""
+    heartbeatInterval = 5  # central server đánh dấu offline nếu không nhận heartbeat sau 15 giây
+    centralRetry = (1, 30)  # giây chờ trước lần kết nối lại central server đầu tiên và tối đa, gấp đôi mỗi lần lỗi
+    sendQueueLimit = 4 * 1024 * 1024  # byte tối đa chờ gửi trong bộ nhớ cho mỗi kết nối
+    slowConsumerPolicy = "disconnect"  # "drop", "disconnect" hoặc "disk"
+    pingInterval = 10  # gửi ping khi kết nối im lặng lâu hơn khoảng này
+    pingTimeout = 30  # đóng kết nối không nhận được gì sau khoảng này
+    fileStreams = 1  # số kết nối TCP song song cho mỗi file gửi đi, tăng lên khi đường truyền có độ trễ cao
+    # Sàn và trần cho bộ điều chỉnh chất lượng video theo tình trạng đường truyền
+    videoQuality = {"min_quality": 30, "max_quality": 90, "min_scale": 0.5, "min_fps": 5, "max_fps": 30}
+    # Cách nhận video: "tcp" hoặc "udp" (mất gói thì bỏ frame thay vì chờ gửi lại); bên phát luôn mở cả hai
+    videoTransport = "tcp"
+    # "tiles": chỉ gửi các ô thay đổi cộng frame đầy đủ định kỳ; "jpeg": mọi frame là JPEG đầy đủ
+    videoEncoding = "tiles"
+    # Lưới ghép các luồng video nhận về: kích thước ảnh ghép, số cột (0 là tự chọn), số luồng giải mã và tổng
+    # số frame/s được giải mã cho mọi người phát
+    videoGrid = {"width": 615, "height": 420, "columns": 0, "workers": 2, "budget": 90}
+    # Dòng log dưới mức này bị bỏ ngay tại chỗ gọi; log DEBUG trên đường nóng còn bị bỏ hẳn khi chạy python -O
+    logLevel = INFO
+    logFile = "log.txt"
+    logMaxSize = MAX_LOG_SIZE  # xoay vòng log khi file vượt kích thước này
+    friends = {}  # (name, port) -> status, cập nhật từ snapshot và delta của central server
+    presence_seq = 0
     socket_lock = Lock()
     ui_queue = Queue()
     file_queue = Queue()
@@ -29,12 +154,30 @@ class Peer:
     def __init__(self, name, port, text, video_label):
         self.port = port
         self.name = name
+        self.log_writer = open_log(self.logFile, self.logMaxSize)
         self.text = text
         self.video_label = video_label
+        self.video_view = FrameView(video_label)  # mọi chỗ vẽ video lên video_label đi qua đây
         self.filename_lock = Lock()
         self._filename = ""
         self.video_socket = None
-        self.cap = None
+        self.udp_video = None  # UdpVideoServer cạnh video_socket khi đang phát video
+        self.central_socket = None
+        self.friends_lock = Lock()
+        self.connections = {}  # socket -> PeerConnection, chỉ thread reactor ghi
+        self.reactor = Reactor(on_error=self.log_event)
+        self.buffer_pool = BufferPool()
+        self.transfers = {}  # filename -> FanOutSender đang gửi, để xem tiến độ từng peer
+        self.manifests = {}  # (đường dẫn, kích thước, mtime) -> Manifest, gửi lại file không phải hash lại
+        self.transfer_ids = itertools.count(1)  # số hiệu mỗi lời mời nhận file, bên nhận gửi lại trong file_port
+        self.partials = {}  # manifest key -> (ChunkProgress, đường dẫn .part), dùng chung cho mọi luồng nhận
+        self.swarms = {}  # manifest key -> Swarm đang tham gia
+        self.offers_lock = Lock()  # các luồng nhận lời mời gửi file cùng đọc/ghi partials và swarms
+        self.store = ContentStore(os.path.join(self.name, ".store"))
+        self.resync_pending = False
+        self.broadcaster = None  # VideoBroadcaster khi đang phát video
+        self.video_grid = VideoGrid(**self.videoGrid)  # các luồng video đang xem, luồng Tk lấy ảnh ghép từ đây
+        self.watching = {}  # tên người phát -> (cổng TCP, cổng UDP) đang xem, bỏ ra khi họ dừng phát
         self.receiving_video = False  # Thêm biến trạng thái nhận video
 
         if not isinstance(self.text, tk.Text):
@@ -65,7 +208,8 @@ class Peer:
 
         self.load_history()
         self.process_ui_updates()
-        Thread(target=self.receive_video_stream).start()
+        self.root.after(0, self.show_video_frame)
+        Thread(target=self.receive_video_stream, daemon=True).start()
 
     @property
     def filename(self):
@@ -92,27 +236,11 @@ class Peer:
     def log_to_ui(self, message, tag=None):
         self.ui_queue.put((message, tag))
 
-    def log_event(self, message):
-        log_line = f"[{self.name}:{self.port}] {message}"
-        print(log_line)
-        self.rotate_log_if_needed()
-        try:
-            with open("log.txt", "a", encoding="utf-8") as log_file:
-                log_file.write(log_line + '\n')
-        except Exception as e:
-            print(f"Failed to write to log: {str(e)}")
-
-    def rotate_log_if_needed(self):
-        log_file = "log.txt"
-        if os.path.exists(log_file) and os.path.getsize(log_file) > 10 * 1024 * 1024:
-            try:
-                timestamp = time.strftime("%Y%m%d_%H%M%S")
-                os.rename(log_file, f"log_{timestamp}.txt")
-                with open(log_file, "w", encoding="utf-8") as f:
-                    f.write(f"[{self.name}:{self.port}] Log rotated.\n")
-            except Exception as e:
-                self.log_to_ui(f"Error rotating log: {str(e)}\n", "message")
-                self.log_event(f"Error rotating log: {str(e)}")
+    def log_event(self, message, level=INFO):
+        # Chỉ đưa dòng vào hàng đợi; luồng nền của log_writer in ra, ghi file và xoay vòng theo lô
+        if level < self.logLevel:
+            return
+        self.log_writer.write(f"[{self.name}:{self.port}] {message}")
 
     def save_user_config(self):
         config = {"name": self.name, "port": self.port}
@@ -182,25 +310,6 @@ class Peer:
                 self.log_to_ui(f"Error loading history: {str(e)}\n", "message")
                 self.log_event(f"Error loading history: {str(e)}")
 
-    def resize_frame(self, frame, target_width, target_height):
-        height, width = frame.shape[:2]
-        target_ratio = target_width / target_height
-        frame_ratio = width / height
-
-        if frame_ratio > target_ratio:
-            new_height = target_height
-            new_width = int(new_height * frame_ratio)
-        else:
-            new_width = target_width
-            new_height = int(new_width / frame_ratio)
-
-        frame = cv2.resize(frame, (new_width, new_height), interpolation=cv2.INTER_AREA)
-
-        x_offset = (new_width - target_width) // 2
-        y_offset = (new_height - target_height) // 2
-        frame = frame[y_offset:y_offset + target_height, x_offset:x_offset + target_width]
-        return frame
-
     def startVideoStream(self):
         if self.video_stream_active:
             self.log_to_ui("Video stream already active\n", "message")
@@ -209,8 +318,8 @@ class Peer:
 
         max_retries = 3
         for attempt in range(max_retries):
-            self.cap = cv2.VideoCapture(0)
-            if self.cap.isOpened():
+            cap = cv2.VideoCapture(0)
+            if cap.isOpened():
                 self.log_event("Webcam opened successfully")
                 break
             self.log_to_ui(f"Attempt {attempt + 1}/{max_retries} failed to open webcam\n", "message")
@@ -222,12 +331,11 @@ class Peer:
             self.log_event("Error: Cannot open webcam after all retries")
             return
 
-        ret, frame = self.cap.read()
+        ret, frame = cap.read()
         if not ret:
             self.log_to_ui("Error: Cannot capture frame from webcam\n", "message")
             self.log_event("Error: Cannot capture frame from webcam")
-            self.cap.release()
-            self.cap = None
+            cap.release()
             return
 
         self.video_stream_active = True
@@ -249,47 +357,25 @@ class Peer:
                     self.log_to_ui("Failed to create video socket\n", "message")
                     self.log_event("Failed to create video socket")
                     video_socket.close()
-                    self.cap.release()
-                    self.cap = None
+                    cap.release()
                     self.video_stream_active = False
                     return
                 time.sleep(1)
 
+        # Một luồng đọc webcam và nén frame cho mọi người xem lẫn phần xem trước
+        controller = QualityController(on_event=self.log_event, **self.videoQuality)
+        encoder = TileEncoder() if self.videoEncoding == "tiles" else None
+        self.broadcaster = VideoBroadcaster(cap, on_event=self.log_event, controller=controller, encoder=encoder)
+        self.broadcaster.start()
+        udp_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            udp_socket.bind((self.address, self.video_port))
+            self.udp_video = UdpVideoServer(udp_socket, self.broadcaster, on_event=self.log_event)
+            self.log_event(f"Video UDP socket created on {self.address}:{self.video_port}")
+        except Exception as e:
+            udp_socket.close()
+            self.log_event(f"Failed to create video UDP socket, viewers will use TCP: {str(e)}")
         Thread(target=self.send_video_stream, args=(self.video_port,)).start()
-        Thread(target=self.test_local_video).start()
-
-    def test_local_video(self):
-        self.log_event("Starting local video display")
-        displayed_once = False
-        target_width, target_height = 615, 420
-        while self.video_stream_active and not self.endAllThread and not self.receiving_video:
-            if self.cap is None or not self.cap.isOpened():
-                self.log_event("Webcam closed or not opened, attempting to reopen")
-                self.cap = cv2.VideoCapture(0)
-                if not self.cap.isOpened():
-                    self.log_event("Failed to reopen webcam")
-                    time.sleep(1)
-                    continue
-            ret, frame = self.cap.read()
-            if ret:
-                frame = self.resize_frame(frame, target_width, target_height)
-                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                img = Image.fromarray(frame)
-                photo = ImageTk.PhotoImage(img)
-                self.video_label.configure(image=photo)
-                self.video_label.image = photo
-                if not displayed_once:
-                    self.log_event("Local video frame displayed")
-                    self.log_event(f"video_label size: {self.video_label.winfo_width()}x{self.video_label.winfo_height()}")
-                    displayed_once = True
-            else:
-                self.log_event("Failed to capture local video frame, retrying")
-                if self.cap:
-                    self.cap.release()
-                    self.cap = None
-                time.sleep(0.03)
-                continue
-            time.sleep(0.03)
 
     def stopVideoStream(self):
         if not self.video_stream_active:
@@ -299,486 +385,687 @@ class Peer:
 
         self.log_event("Stopping video stream")
         self.video_stream_active = False
-        self.receiving_video = False  # Dừng nhận video
+        self.stop_watching()  # Dừng nhận video
         self.video_port = None
-        if self.cap:
-            self.cap.release()
-            self.cap = None
+        if self.broadcaster:
+            self.broadcaster.stop()
+            self.broadcaster = None
         if self.video_socket:
             try:
                 self.video_socket.close()
             except:
                 pass
             self.video_socket = None
+        if self.udp_video:
+            self.udp_video.close()
+            self.udp_video = None
         # Thông báo cho các peer khác dừng nhận video
-        data = json.dumps({"name": self.name, "type": "video_stop"}) + "\n"
-        with self.socket_lock:
-            for port, client in list(self.listSocket.items()):
-                try:
-                    client.send(data.encode('utf-8'))
-                    self.log_event(f"Notified video stop to port {port}")
-                except:
-                    self.log_event(f"Failed to notify video stop to port {port}")
+        for port in self.broadcast({"name": self.name, "type": "video_stop"}):
+            self.log_event(f"Notified video stop to port {port}")
         self.log_to_ui("Video stream stopped\n", "message")
-        self.video_label.configure(image='')
+        self.video_view.clear()
 
     def send_video_stream(self, video_port):
+        # Chỉ nhận người xem mới; frame do broadcaster nén một lần rồi đẩy vào hàng đợi của từng người xem
         self.log_event(f"Starting video stream server on port {video_port}")
         self.log_event(f"Video socket listening on {self.video_socket.getsockname()}")
         notified_peers = set(self.listSocket.keys())
-        target_width, target_height = 615, 420
-        conn = None
+        broadcaster = self.broadcaster
+        video_socket = self.video_socket
+        video_socket.settimeout(1)
         while self.video_stream_active and not self.endAllThread:
-            data = json.dumps({"name": self.name, "type": "video", "port": video_port}) + "\n"
-            self.cleanup_sockets()
+            data = encode_frame(self.video_notice())
             with self.socket_lock:
                 current_peers = set(self.listSocket.keys())
                 new_peers = current_peers - notified_peers
-                self.log_event(f"Current listSocket: {list(self.listSocket.keys())}")
+            if new_peers:
                 self.log_event(f"New peers to notify: {list(new_peers)}")
-                for port in new_peers:
-                    try:
-                        client = self.listSocket[port]
-                        client.send(data.encode('utf-8'))
-                        self.log_event(f"Notified video port {video_port} to port {port}")
-                        notified_peers.add(port)
-                    except Exception as e:
-                        self.log_to_ui(f"Error notifying video port to {port}: {str(e)}\n", "message")
-                        self.log_event(f"Error notifying video port to {port}: {str(e)}")
-                        client.close()
-                        del self.listSocket[port]
-                        if port in self.ports:
-                            self.ports.remove(port)
+            for port in new_peers:
+                if self.send_to_port(port, data):
+                    self.log_event(f"Notified video port {video_port} to port {port}")
+                    notified_peers.add(port)
+                else:
+                    self.log_event(f"Error notifying video port to {port}")
 
             try:
-                if not conn:
-                    self.video_socket.settimeout(15)
-                    conn, addr = self.video_socket.accept()
-                    self.log_event(f"Video stream connection from {addr}")
-                    conn.setblocking(True)
-                if self.cap is None or not self.cap.isOpened():
-                    self.log_event("Webcam closed in send_video_stream, attempting to reopen")
-                    self.cap = cv2.VideoCapture(0)
-                    if not self.cap.isOpened():
-                        self.log_event("Failed to reopen webcam in send_video_stream")
-                        time.sleep(1)
-                        continue
-                ret, frame = self.cap.read()
-                if not ret:
-                    self.log_event("Failed to capture video frame, retrying")
-                    if self.cap:
-                        self.cap.release()
-                        self.cap = None
-                    time.sleep(0.03)
-                    continue
-                frame = self.resize_frame(frame, target_width, target_height)
-                self.log_event(f"Captured frame with shape: {frame.shape}")
-                _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
-                data = buffer.tobytes()
-                size = len(data)
-                try:
-                    conn.send(size.to_bytes(4, byteorder='big'))
-                    conn.send(data)
-                    self.log_event("Video frame sent")
-                except (BrokenPipeError, ConnectionResetError):
-                    self.log_event("Connection to peer lost, retrying connection")
-                    if conn:
-                        conn.close()
-                        conn = None
-                    continue
-                except Exception as e:
-                    self.log_event(f"Error sending video frame: {str(e)}, retrying")
-                    if conn:
-                        conn.close()
-                        conn = None
-                    continue
-                time.sleep(0.03)
+                conn, addr = video_socket.accept()
+                self.log_event(f"Video stream connection from {addr}")
+                conn.setblocking(True)
+                broadcaster.subscribe(conn, addr)
             except socket.timeout:
-                self.log_event("No peer connected to video stream, waiting")
                 continue
             except Exception as e:
-                self.log_event(f"Error in send_video_stream: {str(e)}, retrying")
-                if conn:
-                    conn.close()
-                    conn = None
+                if self.video_stream_active and not self.endAllThread:
+                    self.log_event(f"Error in send_video_stream: {str(e)}, retrying")
+                    time.sleep(0.1)
                 continue
-        if conn:
-            try:
-                conn.close()
-            except:
-                pass
-        if self.video_socket:
-            try:
-                self.video_socket.close()
-            except:
-                pass
-        if self.cap:
-            self.cap.release()
-            self.cap = None
+        broadcaster.stop()
+        try:
+            video_socket.close()
+        except:
+            pass
+        if self.udp_video and self.udp_video.broadcaster is broadcaster:
+            self.udp_video.close()
+            self.udp_video = None
         self.log_event("send_video_stream stopped")
 
     def receive_video_stream(self):
+        # Nhận thông báo video và mở một luồng theo dõi riêng cho mỗi người phát, nhiều người được xem cùng lúc
         self.log_event("Starting video stream receiver")
-        client_socket = None
-        last_port = None
-        last_sender = None
-        target_width, target_height = 615, 420
-        displayed_once = False
-
-        def receive_frame():
-            nonlocal client_socket, last_port, last_sender, displayed_once
-            if self.endAllThread:
-                if client_socket:
-                    try:
-                        client_socket.close()
-                    except:
-                        pass
-                self.log_event("receive_video_stream stopped due to endAllThread")
-                self.receiving_video = False
-                return
-
-            if not self.receiving_video and client_socket:
-                self.log_event("Stopping receive_video_stream as stream is inactive")
-                client_socket.close()
-                client_socket = None
-                last_port = None
-                last_sender = None
-                displayed_once = False
-                self.video_label.configure(image='')
-                self.root.after(100, receive_frame)
-                return
-
-            # Thử lấy port video từ queue nếu chưa có
-            if not client_socket and not last_port:
-                max_retries = 5
-                for attempt in range(max_retries):
-                    try:
-                        port, sender = self.video_queue.get_nowait()
-                        self.log_event(f"Attempting to connect to video stream at port {port} from {sender} (Attempt {attempt + 1}/{max_retries})")
-                        client_socket = socket.socket()
-                        client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                        client_socket.settimeout(60)
-                        resolved_address = socket.gethostbyname(self.address)
-                        self.log_event(f"Resolved {self.address} to {resolved_address} for video stream")
-                        client_socket.connect((resolved_address, port))
-                        self.log_event(f"Connected to video stream at port {port} from {sender}")
-                        last_port = port
-                        last_sender = sender
-                        self.receiving_video = True
-                        break
-                    except Empty:
-                        self.root.after(100, receive_frame)
-                        return
-                    except socket.timeout:
-                        self.log_event(f"Timeout connecting to video stream at port {last_port or 'unknown'} (Attempt {attempt + 1}/{max_retries})")
-                        if client_socket:
-                            client_socket.close()
-                            client_socket = None
-                        if attempt == max_retries - 1:
-                            self.log_event("Failed to connect to video stream after all retries")
-                            self.log_to_ui("Error: Failed to connect to video stream after all retries\n", "message")
-                        self.root.after(2000, receive_frame)
-                        return
-                    except Exception as e:
-                        self.log_event(f"Error connecting to video stream: {str(e)} (Attempt {attempt + 1}/{max_retries})")
-                        if client_socket:
-                            client_socket.close()
-                            client_socket = None
-                        if attempt == max_retries - 1:
-                            self.log_event("Failed to connect to video stream after all retries")
-                            self.log_to_ui(f"Error: Failed to connect to video stream: {str(e)}\n", "message")
-                        self.root.after(2000, receive_frame)
-                        return
-
-            # Nếu đã có last_port, thử kết nối lại
-            if not client_socket and last_port:
-                max_retries = 5
-                for attempt in range(max_retries):
-                    try:
-                        self.log_event(f"Reattempting connection to video stream at port {last_port} from {last_sender} (Attempt {attempt + 1}/{max_retries})")
-                        client_socket = socket.socket()
-                        client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                        client_socket.settimeout(60)
-                        resolved_address = socket.gethostbyname(self.address)
-                        self.log_event(f"Resolved {self.address} to {resolved_address} for video stream")
-                        client_socket.connect((resolved_address, last_port))
-                        self.log_event(f"Reconnected to video stream at port {last_port} from {last_sender}")
-                        self.receiving_video = True
-                        break
-                    except socket.timeout:
-                        self.log_event(f"Timeout reconnecting to video stream at port {last_port} (Attempt {attempt + 1}/{max_retries})")
-                        if client_socket:
-                            client_socket.close()
-                            client_socket = None
-                        if attempt == max_retries - 1:
-                            self.log_event("Failed to reconnect to video stream after all retries")
-                            self.log_to_ui("Error: Failed to reconnect to video stream after all retries\n", "message")
-                            self.receiving_video = False
-                            last_port = None
-                            last_sender = None
-                            displayed_once = False
-                        self.root.after(2000, receive_frame)
-                        return
-                    except Exception as e:
-                        self.log_event(f"Error reconnecting to video stream: {str(e)} (Attempt {attempt + 1}/{max_retries})")
-                        if client_socket:
-                            client_socket.close()
-                            client_socket = None
-                        if attempt == max_retries - 1:
-                            self.log_event("Failed to reconnect to video stream after all retries")
-                            self.log_to_ui(f"Error: Failed to reconnect to video stream: {str(e)}\n", "message")
-                            self.receiving_video = False
-                            last_port = None
-                            last_sender = None
-                            displayed_once = False
-                        self.root.after(2000, receive_frame)
-                        return
-
-            if not client_socket:
-                self.root.after(100, receive_frame)
-                return
-
+        self.log_event("receive_video_stream initialized")
+        while not self.endAllThread:
             try:
-                size_data = client_socket.recv(4)
-                if not size_data:
-                    self.log_event("Video stream closed by sender")
-                    self.log_to_ui("Video stream closed by sender\n", "message")
-                    client_socket.close()
-                    client_socket = None
-                    # Không đặt lại last_port và last_sender, để thử kết nối lại
-                    self.root.after(100, receive_frame)
-                    return
+                port, sender, udp = self.video_queue.get(timeout=0.5)
+            except Empty:
+                continue
+            watching = sender in self.watching
+            self.watching[sender] = (port, udp)
+            if not watching:
+                Thread(target=self.watch_video, args=(sender,), daemon=True).start()
+        self.receiving_video = False
+        self.log_event("receive_video_stream stopped due to endAllThread")
 
-                size = int.from_bytes(size_data, byteorder='big')
-                data = b""
-                while len(data) < size:
-                    packet = client_socket.recv(size - len(data))
-                    if not packet:
-                        self.log_event("Incomplete video frame received")
-                        self.log_to_ui("Error: Incomplete video frame received\n", "message")
-                        client_socket.close()
-                        client_socket = None
-                        self.root.after(100, receive_frame)
-                        return
-                    data += packet
-
-                if len(data) == size:
-                    frame = np.frombuffer(data, dtype=np.uint8)
-                    frame = cv2.imdecode(frame, cv2.IMREAD_COLOR)
-                    if frame is None:
-                        self.log_event("Failed to decode video frame, possibly corrupted data")
-                        self.log_to_ui("Error: Failed to decode video frame\n", "message")
-                        self.root.after(33, receive_frame)
-                        return
+    def watch_video(self, sender):
+        # Chạy trên luồng riêng cho một người phát: kết nối, nhận frame và kết nối lại khi luồng bị đứt; việc giải
+        # mã chạy trên pool của video_grid, luồng Tk chỉ hiển thị ảnh ghép
+        while not self.endAllThread:
+            target = self.watching.get(sender)
+            if target is None:
+                break
+            port, udp = target
+            if self.videoTransport == "udp" and udp:
+                client_socket = self.connect_video_udp(udp, sender)
+                receiver_class = UdpFrameReceiver
+            else:
+                client_socket = self.connect_video(port, sender)
+                receiver_class = FrameReceiver
+            if client_socket is None:
+                self.watching.pop(sender, None)
+                break
+            receiver = receiver_class(client_socket, on_event=self.log_event, executor=self.video_grid.executor)
+            self.video_grid.add(sender, receiver)
+            self.receiving_video = True
+            if sender not in self.watching:
+                receiver.close()  # video_stop tới trong lúc đang kết nối
+            receiver.run()
+            self.video_grid.remove(sender, receiver)
+            self.receiving_video = bool(self.video_grid.streams)
+            self.log_event(f"Video stream from {sender} ended after {receiver.received} frames "
+                           f"({receiver.dropped} replaced before display, {receiver.skipped} skipped over budget)")
+            if self.endAllThread:
+                break
+            if sender not in self.watching:
+                self.log_event(f"Stopped watching video from {sender}")
+                break
+            elif receiver.error is None:
+                # Vẫn giữ sender trong watching, để thử kết nối lại
+                self.log_event("Video stream closed by sender")
+                self.log_to_ui("Video stream closed by sender\n", "message")
+            else:
+                self.log_event(f"Error receiving video frame: {str(receiver.error)}")
+                self.log_to_ui(f"Error: Failed to receive video frame: {str(receiver.error)}\n", "message")
+            time.sleep(0.5)
+        if not self.video_grid.streams:
+            self.root.after(0, self.video_view.clear)
 
-                    frame = self.resize_frame(frame, target_width, target_height)
-                    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    img = Image.fromarray(frame)
-                    photo = ImageTk.PhotoImage(img)
-                    self.root.after(0, lambda: self.video_label.configure(image=photo))
-                    self.video_label.image = photo
-                    if not displayed_once:
-                        self.log_event(f"Received frame with shape: {frame.shape}")
-                        self.log_event("Video frame displayed")
-                        self.log_event(f"video_label size: {self.video_label.winfo_width()}x{self.video_label.winfo_height()}")
-                        displayed_once = True
-                else:
-                    self.log_event("Incomplete frame data")
-                    self.log_to_ui("Error: Incomplete frame data received\n", "message")
-                    client_socket.close()
-                    client_socket = None
+    def stop_watching(self, sender=None):
+        # Dừng xem một người phát, hoặc tất cả nếu sender là None
+        for name in [sender] if sender is not None else list(self.watching):
+            self.watching.pop(name, None)
+            self.video_grid.close_stream(name)
+        self.receiving_video = bool(self.watching)
 
-                self.root.after(30, receive_frame)  # Giảm độ trễ để tăng FPS
-            except socket.timeout:
-                self.log_event("Receive timeout")
-                self.log_to_ui("Error: Receive timeout for video stream\n", "message")
-                client_socket.close()
-                client_socket = None
-                self.root.after(100, receive_frame)
-                return
-            except (BrokenPipeError, ConnectionResetError):
-                self.log_event("Connection to sender lost")
-                self.log_to_ui("Error: Connection to video sender lost\n", "message")
-                client_socket.close()
-                client_socket = None
-                self.root.after(100, receive_frame)
-                return
+    def connect_video(self, port, sender):
+        max_retries = 5
+        for attempt in range(max_retries):
+            if self.endAllThread:
+                return None
+            client_socket = socket.socket()
+            try:
+                self.log_event(f"Attempting to connect to video stream at port {port} from {sender} "
+                               f"(Attempt {attempt + 1}/{max_retries})")
+                client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                client_socket.settimeout(60)
+                resolved_address = socket.gethostbyname(self.address)
+                client_socket.connect((resolved_address, port))
+                self.log_event(f"Connected to video stream at port {port} from {sender}")
+                return client_socket
             except Exception as e:
-                self.log_event(f"Error receiving video frame: {str(e)}")
-                self.log_to_ui(f"Error: Failed to receive video frame: {str(e)}\n", "message")
+                self.log_event(f"Error connecting to video stream at port {port}: {str(e)} "
+                               f"(Attempt {attempt + 1}/{max_retries})")
                 client_socket.close()
-                client_socket = None
-                self.root.after(100, receive_frame)
-                return
+                if attempt == max_retries - 1:
+                    self.log_event("Failed to connect to video stream after all retries")
+                    self.log_to_ui(f"Error: Failed to connect to video stream: {str(e)}\n", "message")
+                    return None
+                time.sleep(2)
+        return None
 
-        self.root.after(0, receive_frame)
-        self.log_event("receive_video_stream initialized")
+    def connect_video_udp(self, port, sender):
+        # UDP không có bắt tay: socket connect tới bên phát chỉ để lọc gói, UdpFrameReceiver gửi gói chào để đăng ký
+        client_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024)
+            client_socket.connect((socket.gethostbyname(self.address), port))
+            self.log_event(f"Receiving video over UDP from {sender} at port {port}")
+            return client_socket
+        except Exception as e:
+            self.log_event(f"Error opening UDP video socket for port {port}: {str(e)}")
+            self.log_to_ui(f"Error: Failed to connect to video stream: {str(e)}\n", "message")
+            client_socket.close()
+            return None
+
+    def video_notice(self):
+        notice = {"name": self.name, "type": "video", "port": self.video_port}
+        if self.udp_video:
+            notice["udp"] = self.video_port
+        return notice
+
+    def show_video_frame(self):
+        # Luồng Tk: lấy ảnh ghép mới nhất của các luồng đang xem (nếu có) và hiển thị, không bao giờ chờ socket
+        if self.endAllThread:
+            return
+        frame = self.video_grid.take()
+        if frame is not None:
+            self.video_view.show(frame)
+        self.root.after(33, self.show_video_frame)
 
     def notify_video_port(self, port):
         if not self.video_stream_active or self.video_port is None:
             return
-        data = json.dumps({"name": self.name, "type": "video", "port": self.video_port}) + "\n"
-        with self.socket_lock:
-            if port in self.listSocket:
-                try:
-                    client = self.listSocket[port]
-                    client.send(data.encode('utf-8'))
-                    self.log_event(f"Notified video port {self.video_port} to port {port} (on connect)")
-                except Exception as e:
-                    self.log_event(f"Error notifying video port to {port} (on connect): {str(e)}")
-
-    def recv_input_stream(self, connection, address):
-        self.log_event(f"Starting recv_input_stream for {address}")
-        buffer = ""
-        connection.setblocking(False)
-        while not self.endAllThread:
+        if self.send_to_port(port, self.video_notice()):
+            self.log_event(f"Notified video port {self.video_port} to port {port} (on connect)")
+        else:
+            self.log_event(f"Error notifying video port to {port} (on connect)")
+
+    def on_readable(self, connection):
+        conn = self.connections.get(connection)
+        if conn is None:
+            self.reactor.remove_reader(connection)
+            return
+        try:
+            received = conn.decoder.recv_from(connection)
+            messages = list(conn.decoder.frames())
+        except (BlockingIOError, InterruptedError):
+            return
+        except FrameError as e:
+            self.log_event(f"Protocol error from {conn.address}: {str(e)}")
+            self.close_connection(conn)
+            return
+        except OSError:
+            self.log_event(f"Connection to {conn.address} closed by peer")
+            self.close_connection(conn)
+            return
+        conn.last_seen = time.monotonic()
+        for jsonMessage in messages:
+            if __debug__ and self.logLevel <= DEBUG:
+                self.log_event(f"Parsed JSON from {conn.address}: {jsonMessage}", DEBUG)
             try:
-                readable, _, _ = select.select([connection], [], [], 5)
-                if not readable:
-                    continue
-                data = connection.recv(2048)
-                if not data:
-                    self.log_event(f"Connection closed from {address}")
-                    break
-                try:
-                    buffer += data.decode("utf-8")
-                    self.log_event(f"Raw data received from {address}: {buffer}")
-                    while buffer:
-                        try:
-                            jsonMessage, index = json.JSONDecoder().raw_decode(buffer)
-                            self.log_event(f"Parsed JSON from {address}: {jsonMessage}")
-                            buffer = buffer[index:].lstrip()
-                            if jsonMessage["type"] == "connect":
-                                self.log_to_ui(
-                                    f"🕭{jsonMessage['name']} wants to connect to your channel\n",
-                                    "connect"
-                                )
-                                self.log_event(f"Peer {jsonMessage['name']} requested connection")
-                            elif jsonMessage["type"] == "chat":
-                                username_part = f"{jsonMessage['name']}"
-                                message_part = f" : {jsonMessage['message']}\n"
-                                self.log_to_ui(username_part, "username")
-                                self.log_to_ui(message_part, "message")
-                                self.save_history(jsonMessage["name"], jsonMessage["message"])
-                                self.log_event(f"Received chat from {jsonMessage['name']}: {jsonMessage['message']}")
-                            elif jsonMessage["type"] == "file":
-                                file_socket = socket.socket()
-                                file_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                                file_socket.bind((self.address, 0))
-                                file_socket.listen(1)
-                                file_port = file_socket.getsockname()[1]
-                                self.file_queue.put((jsonMessage["filename"], jsonMessage["name"], file_socket))
-                                connection.send(json.dumps({"type": "file_port", "port": file_port}).encode('utf-8'))
-                                file_thread = Thread(
-                                    target=self.handleReceiveFile,
-                                    args=(file_socket, jsonMessage["filename"], jsonMessage["name"])
-                                )
-                                file_thread.start()
-                                self.allThreads.append(file_thread)
-                                self.log_event(f"Queued file: {jsonMessage['filename']} from {jsonMessage['name']} on port {file_port}")
-                            elif jsonMessage["type"] == "central":
-                                self.listFriend = jsonMessage["listFriend"]
-                                self.log_event(f"Received friend list: {self.listFriend}")
-                            elif jsonMessage["type"] == "fetch":
-                                filename = os.path.join(self.name, f"history_{self.name}_{self.port}.txt")
-                                if os.path.exists(filename):
-                                    with open(filename, "r", encoding="utf-8") as f:
-                                        lines = f.readlines()
-                                        if lines:
-                                            last_line = lines[-1].strip()
-                                            fetch_response = json.dumps({
-                                                "type": "chat",
-                                                "name": self.name,
-                                                "message": f"[Repeat] {last_line}"
-                                            }) + "\n"
-                                            connection.send(fetch_response.encode('utf-8'))
-                                            self.log_event(f"Responded to fetch request from {jsonMessage['name']}")
-                            elif jsonMessage["type"] == "video":
-                                self.video_queue.put((jsonMessage["port"], jsonMessage["name"]))
-                                self.log_to_ui(f"{jsonMessage['name']} started video stream\n", "message")
-                                self.log_event(f"Received video stream port {jsonMessage['port']} from {jsonMessage['name']}")
-                            elif jsonMessage["type"] == "video_stop":
-                                self.receiving_video = False
-                                self.log_to_ui(f"{jsonMessage['name']} stopped video stream\n", "message")
-                                self.log_event(f"Video stream stopped by {jsonMessage['name']}")
-                        except json.JSONDecodeError:
-                            if buffer.count("{") > buffer.count("}"):
-                                break
-                            buffer = buffer[buffer.find("{"):] if "{" in buffer else ""
-                            continue
-                        except Exception as e:
-                            self.log_to_ui(f"Error processing JSON from {address}: {str(e)}\n", "message")
-                            self.log_event(f"Error processing JSON from {address}: {str(e)}")
-                            break
-                except UnicodeDecodeError:
-                    self.log_event(f"Ignoring non-text data from {address}, likely file data")
-                    continue
-            except (ConnectionResetError, BrokenPipeError):
-                self.log_event(f"Connection to {address} closed by peer")
-                break
+                self.handle_message(conn, jsonMessage)
             except Exception as e:
-                self.log_to_ui(f"Error processing data from {address}: {str(e)}\n", "message")
-                self.log_event(f"Error processing data from {address}: {str(e)}")
-                break
+                self.log_to_ui(f"Error processing JSON from {conn.address}: {str(e)}\n", "message")
+                self.log_event(f"Error processing JSON from {conn.address}: {str(e)}")
+        if not received:
+            self.log_event(f"Connection closed from {conn.address}")
+            self.close_connection(conn)
+
+    def handle_message(self, conn, jsonMessage):
+        if jsonMessage["type"] == "connect":
+            if "zlib" in jsonMessage.get("codecs", []) and not conn.compress:
+                conn.compress = True
+                self.send_frame(conn, {"type": "codecs", "codecs": ["zlib"]})
+            self.log_to_ui(
+                f"🕭{jsonMessage['name']} wants to connect to your channel\n",
+                "connect"
+            )
+            self.log_event(f"Peer {jsonMessage['name']} requested connection")
+        elif jsonMessage["type"] == "chat":
+            username_part = f"{jsonMessage['name']}"
+            message_part = f" : {jsonMessage['message']}\n"
+            self.log_to_ui(username_part, "username")
+            self.log_to_ui(message_part, "message")
+            self.save_history(jsonMessage["name"], jsonMessage["message"])
+            self.log_event(f"Received chat from {jsonMessage['name']}: {jsonMessage['message']}")
+        elif jsonMessage["type"] == "file":
+            # Kiểm tra store có thể phải băm lại cả file, không làm trên thread reactor
+            self.start_thread(self.handle_file_offer, conn, jsonMessage)
+        elif jsonMessage["type"] == "central":
+            self.apply_friend_snapshot(jsonMessage["listFriend"], jsonMessage.get("seq", 0))
+            self.log_event(f"Received friend list: {jsonMessage['listFriend']}")
+        elif jsonMessage["type"] == "presence":
+            self.apply_presence_delta(jsonMessage)
+        elif jsonMessage["type"] == "webrtc_signal":
+            self.log_event(f"Received WebRTC signal from {jsonMessage['name']}")
+        elif jsonMessage["type"] == "fetch":
+            filename = os.path.join(self.name, f"history_{self.name}_{self.port}.txt")
+            if os.path.exists(filename):
+                with open(filename, "r", encoding="utf-8") as f:
+                    lines = f.readlines()
+                    if lines:
+                        last_line = lines[-1].strip()
+                        self.send_frame(conn, {
+                            "type": "chat",
+                            "name": self.name,
+                            "message": f"[Repeat] {last_line}"
+                        })
+                        self.log_event(f"Responded to fetch request from {jsonMessage['name']}")
+        elif jsonMessage["type"] == "video":
+            self.video_queue.put((jsonMessage["port"], jsonMessage["name"], jsonMessage.get("udp")))
+            self.log_to_ui(f"{jsonMessage['name']} started video stream\n", "message")
+            self.log_event(f"Received video stream port {jsonMessage['port']} from {jsonMessage['name']}")
+        elif jsonMessage["type"] == "file_port":
+            replies = conn.replies.get(jsonMessage.get("transfer"))
+            if replies is not None:
+                replies.put(jsonMessage)
+            else:
+                # Bên gửi đã thôi chờ lần gửi này; bên nhận tự đóng cổng khi hết hạn accept
+                self.log_event(f"Ignored late file_port for transfer {jsonMessage.get('transfer')}")
+        elif jsonMessage["type"] == "codecs":
+            conn.compress = "zlib" in jsonMessage.get("codecs", [])
+        elif jsonMessage["type"] == "have":
+            swarm = self.swarms.get(jsonMessage["swarm"])
+            if swarm is not None:
+                port = str(jsonMessage["port"])
+                swarm.links[port] = conn
+                swarm.update_have(port, bytearray.fromhex(jsonMessage["bitmap"]))
+                self.serve_swarm(swarm, port)
+        elif jsonMessage["type"] == "ping":
+            self.send_frame(conn, {"type": "pong"})
+        elif jsonMessage["type"] == "pong":
+            pass
+        elif jsonMessage["type"] == "video_stop":
+            self.stop_watching(jsonMessage["name"])
+            self.log_to_ui(f"{jsonMessage['name']} stopped video stream\n", "message")
+            self.log_event(f"Video stream stopped by {jsonMessage['name']}")
+
+    def close_connection(self, conn):
+        self.reactor.remove_reader(conn.sock)
+        self.reactor.remove_writer(conn.sock)
+        self.connections.pop(conn.sock, None)
+        conn.close()
+        if conn.port is not None:
+            with self.socket_lock:
+                if self.listSocket.get(conn.port) is conn.sock:
+                    del self.listSocket[conn.port]
+                    if conn.port in self.ports:
+                        self.ports.remove(conn.port)
+                    self.log_event(f"Cleaned up disconnected socket for {conn.port}")
+        if conn.sock is self.central_socket:
+            self.central_socket = None
+            if not self.endAllThread:
+                self.log_to_ui("Lost connection to central server\n", "message")
+                self.reactor.call_later(self.centralRetry[0], self.reconnect_central, self.centralRetry[0])
         try:
-            connection.close()
+            conn.sock.close()
         except:
             pass
 
-    def handleReceiveFile(self, file_socket, filename, sender):
+    def apply_friend_snapshot(self, listFriend, seq):
+        friends = {}
+        for friend_str in listFriend.split(";"):
+            friend = friend_str.split(":")
+            if len(friend) >= 2:
+                friends[(friend[0], friend[1])] = friend[2] if len(friend) >= 3 else "offline"
+        with self.friends_lock:
+            self.friends = friends
+            self.presence_seq = seq
+            self.resync_pending = False
+
+    def apply_presence_delta(self, jsonMessage):
+        seq = jsonMessage["seq"]
+        with self.friends_lock:
+            if seq <= self.presence_seq or self.resync_pending:
+                return
+            if seq == self.presence_seq + 1:
+                for change in jsonMessage["changes"]:
+                    self.friends[(change["name"], str(change["port"]))] = change["status"]
+                self.presence_seq = seq
+                self.log_event(f"Applied presence update {seq}: {jsonMessage['changes']}")
+                return
+            self.resync_pending = True
+        # Mất một hoặc nhiều delta, yêu cầu central server gửi lại danh sách đầy đủ
+        self.log_event(f"Presence gap detected (have {self.presence_seq}, got {seq}), requesting resync")
+        self.send_to_central({"type": "resync", "name": self.name})
+
+    def get_friends(self):
+        with self.friends_lock:
+            return list(self.friends.items())
+
+    def handleReceiveFile(self, file_socket, filename, sender, progress, part_path, swarm=None, notify=True,
+                          streams=1, codec=None):
         base_dir = self.name
         file_path = os.path.join(base_dir, filename)
-        self.log_to_ui(f"{sender} : Sent you {filename}\n", "message")
+        manifest = progress.manifest
+        if notify:
+            self.log_to_ui(f"{sender} : Sent you {filename}\n", "message")
         self.log_event(f"Start receiving file: {filename} to {file_path}")
+        if progress.done:
+            self.log_event(f"Resuming {filename}: {progress.done}/{len(manifest)} chunks already received")
+        conns = []
         try:
-            conn, addr = file_socket.accept()
-            conn.setblocking(False)
-            conn.send("ACK".encode('utf-8'))
-            with open(file_path, 'wb') as f:
-                while not self.endAllThread:
-                    readable, _, _ = select.select([conn], [], [], 5)
-                    if not readable:
-                        continue
-                    try:
-                        chunk = conn.recv(4096)
-                        if not chunk:
-                            break
-                        f.write(chunk)
-                    except socket.error as e:
-                        if e.errno == 10035:
-                            self.log_event(f"Non-blocking receive not ready for {filename}, retrying")
-                            continue
-                        raise
+            # Bên gửi có thể đã thôi chờ file_port, không giữ cổng nhận mãi
+            file_socket.settimeout(FILE_ACCEPT_TIMEOUT)
+            for _ in range(streams):
+                conn, addr = file_socket.accept()
+                conn.settimeout(5)
+                conn.sendall("ACK".encode('utf-8'))
+                conns.append(conn)
+            start = time.monotonic()
+            # Các kết nối ghi chung một fd vào đúng offset của chunk: pwrite không cần khoá, còn lseek + write trên
+            # Windows được _pwrite_all khoá lại
+            fd = os.open(part_path, os.O_RDWR | os.O_CREAT | getattr(os, "O_BINARY", 0), 0o644)
+            try:
+                preallocate(fd, manifest.size)
+                with ThreadPoolExecutor(max_workers=len(conns)) as executor:
+                    received = sum(executor.map(
+                        lambda c: receive_chunks(c, fd, progress, self.buffer_pool, stop=lambda: self.endAllThread,
+                                                 on_error=self.log_event, codec=codec), conns))
+            finally:
+                os.close(fd)
+                progress.save()
+            elapsed = max(time.monotonic() - start, 1e-6)
+            self.log_event(f"Received {received} bytes of {filename} from {sender} at {received / elapsed / 1e6:.1f} MB/s")
+            if swarm is not None:
+                # Báo cho cả swarm những piece mình vừa có, rồi phát tiếp phần mình chịu trách nhiệm
+                self.announce_have(swarm)
+                for port in swarm.peers():
+                    self.serve_swarm(swarm, port)
+            if not progress.complete():
+                if swarm is None:
+                    self.log_to_ui(f"File {filename} from {sender} is incomplete "
+                                   f"({progress.done}/{len(manifest)} chunks), it will resume when sent again\n", "message")
+                self.log_event(f"File {filename} incomplete: {progress.done} of {len(manifest)} chunks")
+                return
+            with progress.lock:
+                # Nhiều luồng nhận có thể cùng thấy đủ chunk, chỉ luồng đầu tiên chuyển file vào store
+                if not os.path.exists(part_path):
+                    return
+                # Bitmap chỉ nói chunk đã được ghi; kiểm lại nội dung trước khi store nhận file theo hash này
+                bad = manifest.bad_chunks(part_path)
+                if not bad:
+                    stored = self.store.add(part_path, manifest)
+                    self.store.link(manifest.key(), file_path)
+            if bad:
+                for index in bad:
+                    progress.unmark(index)
+                progress.save()
+                self.log_to_ui(f"File {filename} from {sender} has {len(bad)} damaged chunks, "
+                               f"they will be fetched again when sent again\n", "message")
+                self.log_event(f"File {filename} failed verification: {len(bad)} of {len(manifest)} chunks damaged")
+                return
+            progress.remove()
+            self.partials.pop(manifest.key(), None)
+            if swarm is not None:
+                swarm.path = stored
             self.log_event(f"File received successfully: {filename} to {file_path}")
-            with self.filename_lock:
-                self.filename = ""
+            self.filename = ""
         except Exception as e:
             self.log_to_ui(f"Error receiving file {filename}: {str(e)}\n", "message")
             self.log_event(f"Error receiving file {filename}: {str(e)}")
         finally:
-            try:
-                conn.close()
-            except:
-                pass
+            for conn in conns:
+                try:
+                    conn.close()
+                except:
+                    pass
             try:
                 file_socket.close()
             except:
                 pass
 
-    def accept_connection(self, connection, address):
-        self.log_event(f"New connection from {address}")
+    def handle_file_offer(self, conn, jsonMessage):
+        filename = os.path.basename(jsonMessage["filename"])
+        file_socket = None
         try:
-            connection.setblocking(False)
-            time.sleep(0.3)
-            self.log_event(f"Connection stabilized for {address}")
+            manifest = Manifest.from_dict(jsonMessage["manifest"])
+            if self.store.has(manifest):
+                self.reuse_stored_file(conn, filename, manifest, jsonMessage)
+                return
+            swarm = None
+            notify = True
+            # Nhiều thành viên swarm có thể cùng mời nhận một nội dung: dùng chung một .part và một Swarm
+            with self.offers_lock:
+                progress, part_path = self.get_partial(manifest)
+                if "swarm" in jsonMessage:
+                    swarm = self.join_swarm(filename, manifest, progress, part_path, jsonMessage["swarm"], conn,
+                                            jsonMessage.get("codecs", []))
+                    # Piece từ các thành viên khác không cần báo lại lên giao diện
+                    notify = str(jsonMessage["swarm"]["from"]) == swarm.seeder
+            file_socket = socket.socket()
+            file_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            file_socket.bind((self.address, 0))
+            streams = max(1, min(int(jsonMessage.get("streams", 1)), MAX_STREAMS))
+            file_socket.listen(streams)
+            file_port = file_socket.getsockname()[1]
+            self.file_queue.put((filename, jsonMessage["name"], file_socket))
+            codec = negotiate(jsonMessage.get("codecs", []))
+            self.send_frame(conn, {"type": "file_port", "transfer": jsonMessage.get("transfer"), "port": file_port,
+                                   "streams": streams, "codec": codec, "missing": progress.missing_ranges()})
+            self.log_event(f"Queued file: {filename} from {jsonMessage['name']} on port {file_port}")
         except Exception as e:
-            self.log_to_ui(f"Error setting up connection from {address}: {str(e)}\n", "message")
-            self.log_event(f"Error setting up connection from {address}: {str(e)}")
-            connection.close()
+            self.log_event(f"Error accepting file {filename} from {jsonMessage.get('name')}: {str(e)}")
+            if file_socket is not None:
+                file_socket.close()
+            self.send_frame(conn, {"type": "file_port", "transfer": jsonMessage.get("transfer"), "port": None})
             return
-        input_stream = Thread(target=self.recv_input_stream, args=(connection, address))
-        input_stream.start()
-        self.allThreads.append(input_stream)
+        self.handleReceiveFile(file_socket, filename, jsonMessage["name"], progress, part_path, swarm, notify,
+                               streams, codec)
+
+    def reuse_stored_file(self, conn, filename, manifest, jsonMessage):
+        # Đã có nội dung này trong store: chỉ cần đặt tên file, báo bên gửi khỏi truyền
+        file_path = os.path.join(self.name, filename)
+        try:
+            self.store.link(manifest.key(), file_path)
+        except OSError as e:
+            self.log_event(f"Could not link {filename} from store: {str(e)}")
+            self.send_frame(conn, {"type": "file_port", "transfer": jsonMessage.get("transfer"), "port": None})
+            return
+        self.send_frame(conn, {"type": "file_port", "transfer": jsonMessage.get("transfer"), "have": True,
+                               "missing": []})
+        info = jsonMessage.get("swarm")
+        with self.offers_lock:
+            if info is not None and manifest.key() not in self.swarms:
+                # Vào swarm như thành viên đã đủ piece, vẫn phát phần của mình cho các thành viên khác
+                self.join_swarm(filename, manifest, ChunkProgress.full(file_path + ".progress", manifest),
+                                self.store.path(manifest.key()), info, conn, jsonMessage.get("codecs", []))
+        if info is None or str(info["from"]) == str(info["seeder"]):
+            self.log_to_ui(f"{jsonMessage['name']} : Sent you {filename}\n", "message")
+        self.log_event(f"Already have {filename} from {jsonMessage['name']}, linked it from the store")
+
+    def get_partial(self, manifest):
+        # Lần nhận dở trước của cùng nội dung cho biết chỉ cần xin lại các chunk còn thiếu. File .part đặt theo
+        # hash nội dung, không theo tên file: hai nội dung khác nhau cùng tên không ghi lẫn vào nhau
+        key = manifest.key()
+        cached = self.partials.get(key)
+        if cached is None or not os.path.exists(cached[1]):
+            part_path = os.path.join(self.name, ".partial", key + ".part")
+            os.makedirs(os.path.dirname(part_path), exist_ok=True)
+            progress = ChunkProgress.load(part_path + ".progress", manifest)
+            if not os.path.exists(part_path):
+                progress = ChunkProgress(part_path + ".progress", manifest)
+            cached = self.partials[key] = (progress, part_path)
+        return cached
+
+    def join_swarm(self, filename, manifest, progress, part_path, info, conn, codecs):
+        swarm = self.swarms.get(manifest.key())
+        if swarm is None:
+            swarm = Swarm(manifest, filename, part_path, info["members"], info["seeder"], self.port, progress, codecs)
+            self.swarms[manifest.key()] = swarm
+            self.log_event(f"Joined swarm for {filename} with {len(swarm.members)} members")
+            self.start_thread(self.announce_have, swarm)
+        swarm.links.setdefault(str(info["from"]), conn)
+        return swarm
+
+    def swarm_link(self, swarm, port):
+        conn = swarm.links.get(port)
+        if conn is not None and self.connections.get(conn.sock) is conn:
+            return conn
+        # Kết nối riêng cho trao đổi piece, không đưa vào listSocket nên không nhận chat của kênh
+        sock = socket.create_connection((self.address, int(port)), timeout=5)
+        conn = swarm.links[port] = self.add_connection(sock, (self.address, port))
+        return conn
+
+    def announce_have(self, swarm):
+        data = encode_frame({"type": "have", "name": self.name, "port": swarm.me,
+                             "swarm": swarm.manifest.key(), "bitmap": swarm.progress.bits.hex()})
+        for port in swarm.peers():
+            try:
+                self.send_frame(self.swarm_link(swarm, port), data)
+            except OSError as e:
+                self.log_event(f"Could not announce pieces of {swarm.filename} to port {port}: {str(e)}")
+
+    def serve_swarm(self, swarm, port):
+        if swarm.finished():
+            if self.swarms.pop(swarm.manifest.key(), None) is not None:
+                self.log_event(f"Swarm for {swarm.filename} finished")
+            return
+        if swarm.progress is None:
+            # Bên gốc phát lại phần của thành viên đã mất kết nối
+            for member, conn in list(swarm.links.items()):
+                if self.connections.get(conn.sock) is not conn:
+                    swarm.gone.add(member)
+        indexes = swarm.claim(port)
+        if indexes:
+            self.start_thread(self.swarm_upload, swarm, port, indexes)
+
+    def swarm_upload(self, swarm, port, indexes):
+        delivered = []
+        failed = False
+        try:
+            conn = self.swarm_link(swarm, port)
+            transfer = next(self.transfer_ids)
+            offer = {"name": self.name, "type": "file", "transfer": transfer, "filename": swarm.filename,
+                     "manifest": swarm.manifest.to_dict(), "codecs": swarm.codecs, "swarm": swarm.info()}
+            conn.replies[transfer] = Queue()
+            if not self.send_frame(conn, offer):
+                conn.replies.pop(transfer, None)
+                raise ConnectionResetError(f"Connection to port {port} is closed")
+            file_sockets, response = self.open_file_sockets(port, conn, swarm.filename, transfer)
+            if response.get("have"):
+                # Thành viên đó đã có trọn file trong store
+                delivered = indexes
+            else:
+                if not file_sockets:
+                    raise ConnectionResetError(f"Port {port} did not accept pieces of {swarm.filename}")
+                file_socket = file_sockets[0]
+                wanted = set(range_indexes(response.get("missing", []))).intersection(indexes)
+                fanout = FanOutSender(swarm.path, {port: file_socket}, self.buffer_pool, swarm.manifest,
+                                      {port: wanted}, codecs={port: response.get("codec")})
+                try:
+                    fanout.run()
+                finally:
+                    try:
+                        file_socket.shutdown(socket.SHUT_WR)
+                    except OSError:
+                        pass
+                    file_socket.close()
+                if port in fanout.errors:
+                    raise fanout.errors[port]
+                delivered = wanted
+                self.log_event(f"Served {len(wanted)} pieces of {swarm.filename} to port {port}")
+        except FileNotFoundError:
+            # .part vừa được chuyển vào store, lần gọi serve_swarm dưới đây đọc từ đường dẫn mới
+            pass
+        except Exception as e:
+            failed = True
+            self.log_event(f"Error serving pieces of {swarm.filename} to port {port}: {str(e)}")
+        finally:
+            swarm.release(port, delivered, failed)
+        self.serve_swarm(swarm, port)
+
+    def accept_connection(self, serverSocket):
+        while True:
+            try:
+                connection, address = serverSocket.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            except Exception as e:
+                self.log_to_ui(f"Error accepting connection: {str(e)}\n", "message")
+                self.log_event(f"Error accepting connection: {str(e)}")
+                return
+            self.log_event(f"New connection from {address}")
+            self.add_connection(connection, address)
+
+    def add_connection(self, connection, address, port=None):
+        connection.setblocking(False)
+        # TCP keepalive phát hiện peer mất hẳn (mất mạng, tắt máy) mà không cần gửi thử dữ liệu
+        connection.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        for option, value in (("TCP_KEEPIDLE", self.pingTimeout), ("TCP_KEEPINTVL", self.pingInterval), ("TCP_KEEPCNT", 3)):
+            if hasattr(socket, option):
+                try:
+                    connection.setsockopt(socket.IPPROTO_TCP, getattr(socket, option), max(1, int(value)))
+                except OSError:
+                    pass
+        conn = PeerConnection(connection, address, port, on_error=self.log_event,
+                              limit=self.sendQueueLimit, policy=self.slowConsumerPolicy)
+        self.connections[connection] = conn
+        self.reactor.add_reader(connection, self.on_readable)
+        return conn
+
+    def send_frame(self, conn, message):
+        # Chỉ đưa vào hàng đợi của kết nối rồi trả về ngay, reactor sẽ ghi ra socket
+        data = message if isinstance(message, bytes) else encode_frame(message, conn.compress)
+        result, schedule = conn.enqueue(data)
+        if result == "disconnect":
+            self.log_event(f"Send queue to {conn.address} is full, disconnecting slow peer")
+            self.reactor.call_soon(self.close_connection, conn)
+            return False
+        if result == "dropped":
+            self.log_event(f"Send queue to {conn.address} is full, dropped {len(data)} bytes")
+            return False
+        if result == "closed":
+            return False
+        if schedule:
+            self.reactor.call_soon(self.flush_connection, conn)
+        return True
+
+    def send_to_port(self, port, message):
+        conn = self.connections.get(self.listSocket.get(port))
+        if conn is None:
+            return False
+        return self.send_frame(conn, message)
+
+    def broadcast(self, message):
+        # Mã hoá mỗi kiểu (nén / không nén) đúng một lần cho cả kênh
+        encoded = {}
+        sent = []
+        for port, client in list(self.listSocket.items()):
+            conn = self.connections.get(client)
+            if conn is None:
+                continue
+            if conn.compress not in encoded:
+                encoded[conn.compress] = encode_frame(message, conn.compress)
+            if self.send_frame(conn, encoded[conn.compress]):
+                sent.append(port)
+        return sent
+
+    def flush_connection(self, conn):
+        while True:
+            data = conn.next_chunk()
+            if data is None:
+                self.reactor.remove_writer(conn.sock)
+                return
+            try:
+                sent = conn.sock.send(data)
+            except (BlockingIOError, InterruptedError):
+                sent = 0
+            except OSError as e:
+                self.log_event(f"Error sending to {conn.address}: {str(e)}")
+                self.close_connection(conn)
+                return
+            if sent:
+                conn.consumed(sent)
+            if sent < len(data):
+                # Socket đầy, chờ reactor báo có thể ghi tiếp
+                self.reactor.add_writer(conn.sock, lambda sock, conn=conn: self.flush_connection(conn))
+                return
+
+    def send_queue_stats(self):
+        stats = {}
+        for conn in list(self.connections.values()):
+            with conn.lock:
+                stats[conn.port or conn.address] = dict(conn.stats, queued=conn.queued, spilled_pending=conn.spilled)
+        return stats
 
     def registerPort(self, address, port):
         serverSocket = socket.socket()
@@ -787,14 +1074,12 @@ class Peer:
         for attempt in range(max_retries):
             try:
                 serverSocket.bind((address, port))
-                serverSocket.listen(5)
+                serverSocket.listen(128)
+                serverSocket.setblocking(False)
+                self.reactor.add_reader(serverSocket, self.accept_connection)
                 for retry in range(3):
                     try:
-                        centralSocket = socket.socket()
-                        centralSocket.connect((self.address, self.centralServerPort))
-                        data = json.dumps({"name": self.name, "port": str(self.port)})
-                        centralSocket.send(data.encode('utf-8'))
-                        centralSocket.close()
+                        self.attach_central(self.connect_central())
                         self.log_event(f"Peer registered with central server on port {port}")
                         break
                     except Exception as e:
@@ -813,44 +1098,93 @@ class Peer:
                     self.log_event(f"Failed to start server on port {port} after {max_retries} attempts")
                     return
                 time.sleep(1)
-        while not self.endAllThread:
-            try:
-                serverSocket.settimeout(10)
-                conn, addr = serverSocket.accept()
-                acceptThread = Thread(target=self.accept_connection, args=(conn, addr))
-                acceptThread.start()
-                self.allThreads.append(acceptThread)
-            except socket.timeout:
-                continue
-            except Exception as e:
-                self.log_to_ui(f"Error accepting connection: {str(e)}\n", "message")
-                self.log_event(f"Error accepting connection: {str(e)}")
-                continue
+        # Thread này trở thành vòng lặp I/O duy nhất của peer cho mọi socket chat, điều khiển và central
+        self.reactor.call_later(self.pingInterval, self.check_connections)
+        if not self.endAllThread:
+            self.reactor.run()
+        self.reactor.close()
+        self.connections.clear()
+
+    def connect_central(self):
+        centralSocket = socket.create_connection((self.address, self.centralServerPort), timeout=5)
         try:
-            serverSocket.close()
-        except:
-            pass
+            centralSocket.sendall(encode_frame({"name": self.name, "port": str(self.port)}))
+        except OSError:
+            centralSocket.close()
+            raise
+        return centralSocket
 
-    def cleanup_sockets(self):
-        with self.socket_lock:
-            for port, sock in list(self.listSocket.items()):
-                try:
-                    sock.send(b"")
-                except:
-                    sock.close()
-                    del self.listSocket[port]
-                    if port in self.ports:
-                        self.ports.remove(port)
-                        self.log_event(f"Cleaned up disconnected socket for {port}")
+    def attach_central(self, centralSocket):
+        # Giữ phiên với central server để nhận danh sách bạn bè và tín hiệu
+        self.central_socket = centralSocket
+        self.add_connection(centralSocket, "central server")
+        self.reactor.call_later(self.heartbeatInterval, self.send_heartbeat, centralSocket)
+
+    def reconnect_central(self, delay):
+        # Chạy trên reactor; kết nối có thể chờ tới timeout nên làm trên thread riêng
+        if self.endAllThread or self.central_socket is not None:
+            return
+        self.start_thread(self.rejoin_central, delay)
+
+    def rejoin_central(self, delay):
+        try:
+            centralSocket = self.connect_central()
+        except OSError as e:
+            delay = min(delay * 2, self.centralRetry[1])
+            self.log_event(f"Reconnecting to central server failed: {str(e)}, retrying in {delay}s")
+            self.reactor.call_later(delay, self.reconnect_central, delay)
+            return
+        self.reactor.call_soon(self.rejoined_central, centralSocket)
+
+    def rejoined_central(self, centralSocket):
+        if self.endAllThread or self.central_socket is not None:
+            centralSocket.close()
+            return
+        # Central server gửi lại danh sách bạn bè đầy đủ cho phiên mới
+        self.attach_central(centralSocket)
+        self.log_to_ui("Reconnected to central server\n", "message")
+        self.log_event("Registered again with central server")
+
+    def send_to_central(self, message):
+        conn = self.connections.get(self.central_socket)
+        if conn is None:
+            return False
+        return self.send_frame(conn, message)
+
+    def send_heartbeat(self, centralSocket):
+        # Mỗi phiên một chuỗi heartbeat; chuỗi của phiên đã mất dừng lại kể cả khi đã kết nối lại
+        if self.endAllThread or self.central_socket is not centralSocket:
+            return
+        self.send_to_central({"type": "heartbeat", "name": self.name})
+        self.reactor.call_later(self.heartbeatInterval, self.send_heartbeat, centralSocket)
+
+    def check_connections(self):
+        if self.endAllThread:
+            return
+        now = time.monotonic()
+        for conn in list(self.connections.values()):
+            if conn.sock is self.central_socket:
+                continue
+            idle = now - conn.last_seen
+            if idle > self.pingTimeout:
+                self.log_event(f"No data from {conn.address} for {idle:.0f}s, closing connection")
+                self.close_connection(conn)
+            elif idle > self.pingInterval:
+                self.send_frame(conn, {"type": "ping"})
+        self.reactor.call_later(self.pingInterval, self.check_connections)
+
+    def start_thread(self, target, *args):
+        thread = Thread(target=target, args=args)
+        thread.start()
+        self.allThreads[:] = [t for t in self.allThreads if t.is_alive()]
+        self.allThreads.append(thread)
+        return thread
 
     def sendMessage(self, message):
         if message.lower() == "showfriends":
-            friends = self.listFriend.split(";")
             self.log_to_ui("From Server: Online user list:\n", "message")
-            for friend in friends:
-                if friend:
-                    name_port = friend.split(":")
-                    self.log_to_ui(f"\t{name_port[0]} : {name_port[1]}\n", "message")
+            for (name, port), status in self.get_friends():
+                self.log_to_ui(f"\t{name} : {port}\n", "message")
             return
 
         username_part = f"{self.name}"
@@ -860,26 +1194,7 @@ class Peer:
         self.save_history(self.name, message)
         self.log_event(f"Sent message: {message}")
 
-        data = json.dumps({"name": self.name, "type": "chat", "message": message}) + "\n"
-        self.cleanup_sockets()
-        with self.socket_lock:
-            for port, client in list(self.listSocket.items()):
-                try:
-                    client.send(data.encode('utf-8'))
-                except (ConnectionResetError, BrokenPipeError):
-                    self.log_to_ui(f"Connection to port {port} closed\n", "message")
-                    self.log_event(f"Connection to port {port} closed")
-                    client.close()
-                    del self.listSocket[port]
-                    if port in self.ports:
-                        self.ports.remove(port)
-                except Exception as e:
-                    self.log_to_ui(f"Error sending message to port {port}: {str(e)}\n", "message")
-                    self.log_event(f"Error sending message to port {port}: {str(e)}")
-                    client.close()
-                    del self.listSocket[port]
-                    if port in self.ports:
-                        self.ports.remove(port)
+        self.broadcast({"name": self.name, "type": "chat", "message": message})
 
         if "@bot" in message.lower() or "bot:" in message.lower():
             bot_response = self.processBotMessage(message)
@@ -890,7 +1205,7 @@ class Peer:
             self.save_history("Bot", bot_response)
             self.log_event(f"Bot responded: {bot_response}")
 
-    def sendFile(self, filePath):
+    def sendFile(self, filePath, swarm=False, streams=None):
         if not os.path.exists(filePath):
             self.log_to_ui(f"File {filePath} does not exist\n", "message")
             self.log_event(f"File {filePath} does not exist")
@@ -898,69 +1213,159 @@ class Peer:
         filename = os.path.basename(filePath)
         self.log_to_ui(f"You : Sending {filename} to your friend\n", "message")
         self.log_event(f"Preparing to send file: {filename}")
-        data = json.dumps({"name": self.name, "type": "file", "filename": filename}) + "\n"
+        manifest = self.get_manifest(filePath)
+        # File đã nén sẵn (entropy cao) thì không đề nghị nén, gửi thẳng bằng sendfile
+        codecs = available() if looks_compressible(filePath) else []
+        if not codecs:
+            self.log_event(f"{filename} looks already compressed, sending it as is")
+        transfer = next(self.transfer_ids)
+        offer = {"name": self.name, "type": "file", "transfer": transfer, "filename": filename,
+                 "manifest": manifest.to_dict(), "streams": streams or self.fileStreams, "codecs": codecs}
 
-        self.cleanup_sockets()
+        # Chỉ giữ socket_lock lúc lấy danh sách peer, chat vẫn chạy trong khi truyền file
         with self.socket_lock:
-            for port, client in list(self.listSocket.items()):
+            peers = list(self.listSocket.items())
+        peers = [(port, self.connections.get(client)) for port, client in peers]
+        peers = [(port, conn) for port, conn in peers if conn is not None]
+        share = None
+        if swarm and len(peers) > 1:
+            # Chế độ swarm: mỗi peer chỉ nhận từ mình phần piece của nó, phần còn lại lấy từ nhau
+            share = Swarm(manifest, filename, filePath, [port for port, _ in peers], self.port, self.port,
+                          codecs=codecs)
+            share.links.update((str(port), conn) for port, conn in peers)
+            self.swarms[manifest.key()] = share
+            offer["swarm"] = share.info()
+        data = encode_frame(offer)
+        # Chờ file_port theo số hiệu lần gửi: phản hồi của lần gửi khác (hoặc tới muộn) không bị nhận nhầm
+        for _, conn in peers:
+            conn.replies[transfer] = Queue()
+        offered = []
+        for port, conn in peers:
+            if self.send_frame(conn, data):
+                offered.append((port, conn))
+            else:
+                conn.replies.pop(transfer, None)
+        # Mỗi kết nối của một peer là một đích riêng (port, k) nhận một stripe của các chunk còn thiếu
+        targets = {}
+        needed = {}
+        chosen = {}
+        stored = set()
+        for port, conn in offered:
+            file_sockets, response = self.open_file_sockets(port, conn, filename, transfer)
+            if response.get("have"):
+                self.log_event(f"Port {port} already has {filename}, nothing to send")
+                stored.add(port)
+                continue
+            if not file_sockets:
+                continue
+            wanted = range_indexes(response.get("missing", []))
+            if share is not None:
+                wanted = sorted(set(wanted).intersection(share.share(port)))
+            elif len(wanted) < len(manifest):
+                self.log_event(f"Port {port} already has {len(manifest) - len(wanted)} chunks of {filename}")
+            for k, (file_socket, indexes) in enumerate(zip(file_sockets, stripe(wanted, len(file_sockets)))):
+                targets[(port, k)] = file_socket
+                needed[(port, k)] = indexes
+                chosen[(port, k)] = response.get("codec")
+        if not targets:
+            if stored:
+                self.log_to_ui(f"Your friends already have {filename}\n", "message")
+            return
+
+        fanout = FanOutSender(filePath, targets, self.buffer_pool, manifest, needed, codecs=chosen)
+        self.transfers[filename] = fanout
+        try:
+            fanout.run()
+        finally:
+            self.transfers.pop(filename, None)
+            for file_socket in targets.values():
                 try:
-                    client.send(data.encode('utf-8'))
-                    client.settimeout(5)
-                    response = client.recv(1024).decode("utf-8")
-                    file_port = json.loads(response).get("port")
-                    if not file_port:
-                        self.log_to_ui(f"Peer at port {port} did not provide file port\n", "message")
-                        self.log_event(f"Peer at port {port} did not provide file port")
-                        continue
-                    file_socket = socket.socket()
-                    file_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-                    file_socket.connect((self.address, file_port))
-                    file_socket.recv(1024)
-                    with open(filePath, 'rb') as f:
-                        while True:
-                            chunk = f.read(4096)
-                            if not chunk:
-                                break
-                            file_socket.send(chunk)
                     file_socket.shutdown(socket.SHUT_WR)
-                    self.log_event(f"Successfully sent file: {filename} to port {port}")
-                    file_socket.close()
-                except socket.timeout:
-                    self.log_to_ui(f"Peer at port {port} did not respond to file transfer\n", "message")
-                    self.log_event(f"Peer at port {port} did not respond to file transfer")
-                except (ConnectionResetError, BrokenPipeError):
-                    self.log_to_ui(f"Connection to port {port} closed during file transfer\n", "message")
-                    self.log_event(f"Connection to port {port} closed during file transfer")
-                    client.close()
-                    del self.listSocket[port]
-                    if port in self.ports:
-                        self.ports.remove(port)
-                except Exception as e:
-                    self.log_to_ui(f"Error sending {filename} to port {port}: {str(e)}\n", "message")
-                    self.log_event(f"Error sending file {filename} to port {port}: {str(e)}")
-                    client.close()
-                    del self.listSocket[port]
-                    if port in self.ports:
-                        self.ports.remove(port)
+                except OSError:
+                    pass
+                file_socket.close()
+        sent = {}
+        wire = {}
+        errors = {}
+        for (port, k), count in fanout.progress.items():
+            sent[port] = sent.get(port, 0) + count
+            wire[port] = wire.get(port, 0) + fanout.wire[(port, k)]
+            if (port, k) in fanout.errors:
+                errors[port] = fanout.errors[(port, k)]
+        for port, count in sent.items():
+            if port in errors:
+                self.log_to_ui(f"Connection to port {port} closed during file transfer\n", "message")
+                self.log_event(f"Error sending file {filename} to port {port} after {count} bytes: {str(errors[port])}")
+            else:
+                self.log_event(f"Successfully sent file: {filename} to port {port} ({count} bytes, "
+                               f"{wire[port]} on the wire with {chosen.get((port, 0)) or 'no compression'})")
+        self.log_event(f"Sent {filename} to {len(sent)} peers over {len(targets)} streams in {fanout.elapsed:.2f}s, "
+                       f"aggregate {fanout.throughput() / 1e6:.1f} MB/s")
+        if share is not None:
+            share.gone.update(str(port) for port in errors)
+            share.gone.update(str(port) for port, _ in offered if port not in sent and port not in stored)
+            for port in share.peers():
+                self.serve_swarm(share, port)
+
+    def open_file_sockets(self, port, conn, filename, transfer):
+        file_sockets = []
+        try:
+            # Reactor đọc phản hồi file_port và chuyển vào hàng đợi của lần gửi này
+            try:
+                response = conn.replies[transfer].get(timeout=5)
+            except Empty:
+                raise socket.timeout()
+            finally:
+                conn.replies.pop(transfer, None)
+            file_port = response.get("port")
+            if response.get("have"):
+                return [], response
+            if not file_port:
+                self.log_to_ui(f"Peer at port {port} did not provide file port\n", "message")
+                self.log_event(f"Peer at port {port} did not provide file port")
+                return [], {}
+            for _ in range(response.get("streams", 1)):
+                file_socket = socket.socket()
+                file_sockets.append(file_socket)
+                file_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                file_socket.settimeout(30)
+                file_socket.connect((self.address, file_port))
+                file_socket.recv(3)
+            return file_sockets, response
+        except socket.timeout:
+            self.log_to_ui(f"Peer at port {port} did not respond to file transfer\n", "message")
+            self.log_event(f"Peer at port {port} did not respond to file transfer")
+        except Exception as e:
+            self.log_to_ui(f"Error sending {filename} to port {port}: {str(e)}\n", "message")
+            self.log_event(f"Error sending file {filename} to port {port}: {str(e)}")
+            self.reactor.call_soon(self.close_connection, conn)
+        for file_socket in file_sockets:
+            file_socket.close()
+        return [], {}
+
+    def get_manifest(self, filePath):
+        stat = os.stat(filePath)
+        key = (os.path.abspath(filePath), stat.st_size, stat.st_mtime_ns)
+        manifest = self.manifests.get(key)
+        if manifest is None:
+            self.log_event(f"Computing chunk hashes for {filePath}")
+            manifest = self.manifests[key] = Manifest.build(filePath)
+        return manifest
+
+    def get_transfer_progress(self):
+        # [(filename, port, số byte đã gửi)] cho các file đang gửi, cộng dồn mọi kết nối tới cùng peer
+        progress = {}
+        for filename, fanout in list(self.transfers.items()):
+            for (port, k), sent in list(fanout.progress.items()):
+                progress[(filename, port)] = progress.get((filename, port), 0) + sent
+        return [(filename, port, sent) for (filename, port), sent in progress.items()]
 
     def setUpSendMessage(self, address, port):
-        with self.socket_lock:
-            if port in self.listSocket:
-                client = self.listSocket[port]
-                try:
-                    client.send(b"")
-                    self.log_event(f"Existing connection to port {port} is still active, sending connect request")
-                    connect_request = json.dumps({"type": "connect", "name": self.name}) + "\n"
-                    client.send(connect_request.encode('utf-8'))
-                    self.log_event(f"Sent connect request to port {port}: {connect_request}")
-                    self.notify_video_port(port)
-                    return
-                except:
-                    self.log_event(f"Existing connection to port {port} is closed, removing")
-                    client.close()
-                    del self.listSocket[port]
-                    if port in self.ports:
-                        self.ports.remove(port)
+        # Kết nối đã đóng được reactor gỡ khỏi listSocket, nên còn trong đó nghĩa là còn sống
+        if self.send_to_port(port, {"type": "connect", "name": self.name, "codecs": ["zlib"]}):
+            self.log_event(f"Existing connection to port {port} is still active, sent connect request")
+            self.notify_video_port(port)
+            return
 
         clientSocket = socket.socket()
         clientSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
@@ -968,38 +1373,26 @@ class Peer:
         max_retries = 3
         for attempt in range(max_retries):
             try:
+                clientSocket.connect((address, int(port)))
+                conn = self.add_connection(clientSocket, (address, port), port)
                 with self.socket_lock:
-                    clientSocket.connect((address, int(port)))
                     self.listSocket[port] = clientSocket
                     if port not in self.ports:
                         self.ports.append(port)
                 self.log_event(f"Connected to peer at port {port}")
-                connect_request = json.dumps({"type": "connect", "name": self.name}) + "\n"
-                clientSocket.send(connect_request.encode('utf-8'))
-                self.log_event(f"Sent connect request to port {port}: {connect_request}")
-                fetch_request = json.dumps({"type": "fetch", "name": self.name}) + "\n"
-                clientSocket.send(fetch_request.encode('utf-8'))
-                self.log_event(f"Sent fetch request to port {port}: {fetch_request}")
+                self.send_frame(conn, {"type": "connect", "name": self.name, "codecs": ["zlib"]})
+                self.log_event(f"Sent connect request to port {port}")
+                self.send_frame(conn, {"type": "fetch", "name": self.name})
+                self.log_event(f"Sent fetch request to port {port}")
                 self.notify_video_port(port)
                 return
             except socket.error as e:
                 if e.errno == 10056:
                     self.log_event(f"Socket to port {port} already connected, reusing")
-                    with self.socket_lock:
-                        if port in self.listSocket:
-                            client = self.listSocket[port]
-                            try:
-                                client.send(b"")
-                                connect_request = json.dumps({"type": "connect", "name": self.name}) + "\n"
-                                client.send(connect_request.encode('utf-8'))
-                                self.log_event(f"Sent connect request to port {port}: {connect_request}")
-                                self.notify_video_port(port)
-                                return
-                            except:
-                                client.close()
-                                del self.listSocket[port]
-                                if port in self.ports:
-                                    self.ports.remove(port)
+                    if self.send_to_port(port, {"type": "connect", "name": self.name, "codecs": ["zlib"]}):
+                        self.log_event(f"Sent connect request to port {port}")
+                        self.notify_video_port(port)
+                        return
                     clientSocket.close()
                     continue
                 self.log_to_ui(f"Attempt {attempt + 1}/{max_retries} failed to connect to port {port}: {str(e)}\n", "message")
@@ -1016,21 +1409,24 @@ class Peer:
         clientSocket.close()
 
     def startServer(self):
-        binder = Thread(target=self.registerPort, args=(self.address, self.port))
-        self.allThreads.append(binder)
-        binder.start()
+        self.start_thread(self.registerPort, self.address, self.port)
 
     def startClient(self, port):
-        sender = Thread(target=self.setUpSendMessage, args=(self.address, port))
-        self.allThreads.append(sender)
-        sender.start()
+        self.start_thread(self.setUpSendMessage, self.address, port)
 
     def endSystem(self):
         self.log_event("Peer shutting down.")
+        if not self.send_to_central({"name": self.name, "port": str(self.port), "status": "offline"}):
+            self.log_event("Error notifying offline status")
         self.endAllThread = True
-        self.receiving_video = False
-        if self.cap:
-            self.cap.release()
+        # Dừng sau khi reactor đã gửi hết các message đang chờ, kể cả thông báo offline
+        self.reactor.call_soon(self.reactor.stop)
+        self.stop_watching()
+        self.video_grid.close()
+        if self.broadcaster:
+            self.broadcaster.stop()
+        if self.udp_video:
+            self.udp_video.close()
         if self.video_socket:
             try:
                 self.video_socket.close()
@@ -1051,3 +1447,4 @@ class Peer:
             except:
                 pass
         self.allThreads.clear()
+        self.log_writer.flush()
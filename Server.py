@@ -1,81 +1,364 @@
 import socket
-import json
+import argparse
+import heapq
+import itertools
+import selectors
+import time
+from framing import encode_frame, FrameDecoder, FrameError
 
 PORT = 8000
 address = socket.gethostname()
-user_list = []  # List of dicts with keys: name, port, status
+presence_seq = 0  # tăng mỗi khi có thay đổi trạng thái, peer dùng để phát hiện mất delta
+sel = selectors.DefaultSelector()
 
-def sendListUser():
-    global user_list
-    data_list = [f"{u['name']}:{u['port']}:{u['status']}" for u in user_list]
+
+class UserRegistry:
+    def __init__(self):
+        self.users = {}  # (name, port) -> dict with keys: name, port, status
+        self.by_name = {}  # name -> {port: user}
+        self.online = set()  # (name, port) của các user đang online
+
+    def __len__(self):
+        return len(self.users)
+
+    def get(self, name, port):
+        return self.users.get((name, port))
+
+    def update_status(self, name, port, status):
+        key = (name, port)
+        user = self.users.get(key)
+        if user is None:
+            user = {"name": name, "port": port, "status": status}
+            self.users[key] = user
+            self.by_name.setdefault(name, {})[port] = user
+        elif user["status"] == status:
+            return False
+        else:
+            user["status"] = status
+        if status == "online":
+            self.online.add(key)
+        else:
+            self.online.discard(key)
+        return True
+
+    def online_by_name(self, name):
+        return [user for user in self.by_name.get(name, {}).values() if user["status"] == "online"]
+
+    def all_users(self):
+        return self.users.values()
+
+
+registry = UserRegistry()
+
+STATS_INTERVAL = 10  # giây giữa hai lần in thống kê
+BROADCAST_INTERVAL = 0.1  # gộp các thay đổi trạng thái, gửi tối đa một lần mỗi khoảng này
+MAX_SESSION_BUFFER = 1024 * 1024  # peer chậm vượt quá mức này sẽ nhận snapshot thay vì delta
+HEARTBEAT_TTL = 15  # phiên không gửi gì trong khoảng này bị coi là đã chết
+stats = {"accepted": 0, "handled": 0, "latencies": [], "since": time.monotonic()}
+
+
+class Connection:
+    def __init__(self, sock, addr):
+        self.sock = sock
+        self.addr = addr
+        self.decoder = FrameDecoder(size=4096)
+        self.outbuf = bytearray()
+        self.started = None  # thời điểm nhận byte đầu tiên của message đang đọc
+        self.user = None  # (name, port) sau khi peer đăng ký qua phiên này
+        self.needs_snapshot = False
+        self.expires_at = None
+
+
+sessions = {}  # (name, port) -> Connection của phiên đang mở
+
+
+def close_connection(conn):
+    try:
+        sel.unregister(conn.sock)
+    except (KeyError, ValueError):
+        pass
+    try:
+        conn.sock.close()
+    except OSError:
+        pass
+    if conn.user and sessions.get(conn.user) is conn:
+        del sessions[conn.user]
+        print(f"Session closed for {conn.user[0]}:{conn.user[1]}")
+        if update_user_status(conn.user[0], conn.user[1], "offline"):
+            broadcast_presence(conn.user[0], conn.user[1], "offline")
+
+
+def send_to(conn, payload):
+    # Ghi vào buffer của phiên; vòng lặp sự kiện sẽ gửi khi socket sẵn sàng
+    if not conn.outbuf:
+        try:
+            sel.modify(conn.sock, selectors.EVENT_READ | selectors.EVENT_WRITE, conn)
+        except (KeyError, ValueError):
+            return
+    conn.outbuf += payload
+
+
+def send_snapshot(conn):
+    # Danh sách đầy đủ chỉ gửi khi peer mới kết nối hoặc yêu cầu resync
+    data_list = [f"{u['name']}:{u['port']}:{u['status']}" for u in registry.all_users()]
     data = {
         "name": "HCMUT",
         "type": "central",
+        "seq": presence_seq,
         "listFriend": ";".join(data_list) + ";"
     }
-    json_data = json.dumps(data)
-    print(json_data)
-    for u in user_list:
-        if u["status"] == "online":
-            try:
-                clientSocket = socket.socket()
-                clientSocket.connect((address, int(u["port"])))
-                clientSocket.send(json_data.encode('utf8'))
-                clientSocket.close()
-                print("Send success to", u["name"])
-            except:
-                print(f"Failed to send to {u['name']}:{u['port']}")
+    send_to(conn, encode_frame(data))
 
-def update_user_status(name, port, status):
-    global user_list
-    for user in user_list:
-        if user["name"] == name and user["port"] == port:
-            user["status"] = status
+
+class BroadcastScheduler:
+    def __init__(self, interval):
+        self.interval = interval
+        self.pending = {}  # (name, port) -> status mới nhất chưa gửi
+        self.last_flush = 0.0
+
+    def mark_dirty(self, name, port, status):
+        self.pending[(name, port)] = status
+
+    def timeout(self, now):
+        if not self.pending:
+            return None
+        return max(0.0, self.last_flush + self.interval - now)
+
+    def flush(self, now):
+        global presence_seq
+        if not self.pending or now < self.last_flush + self.interval:
             return
-    user_list.append({"name": name, "port": port, "status": status})
+        presence_seq += 1
+        data = {
+            "name": "HCMUT",
+            "type": "presence",
+            "seq": presence_seq,
+            "changes": [{"name": name, "port": port, "status": status}
+                        for (name, port), status in self.pending.items()]
+        }
+        self.pending = {}
+        self.last_flush = now
+        print(data)
+        # Mã hoá một lần, mỗi phiên chỉ nối vào buffer riêng nên peer chậm không làm trễ peer khác
+        payload = encode_frame(data)
+        for conn in list(sessions.values()):
+            if conn.needs_snapshot:
+                continue
+            if len(conn.outbuf) > MAX_SESSION_BUFFER:
+                conn.needs_snapshot = True
+                print(f"Session {conn.user[0]}:{conn.user[1]} is lagging, will resync when drained")
+                continue
+            send_to(conn, payload)
+
+
+scheduler = BroadcastScheduler(BROADCAST_INTERVAL)
+
+
+def broadcast_presence(name, port, status):
+    scheduler.mark_dirty(name, port, status)
+
+
+class ExpiryHeap:
+    # Mỗi phiên chỉ có một mục trong heap; khi heartbeat gia hạn, mục cũ được đẩy lại lúc lấy ra
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.heap = []
+        self.counter = itertools.count()
+
+    def touch(self, conn, now):
+        first = conn.expires_at is None
+        conn.expires_at = now + self.ttl
+        if first:
+            heapq.heappush(self.heap, (conn.expires_at, next(self.counter), conn))
+
+    def timeout(self, now):
+        if not self.heap:
+            return None
+        return max(0.0, self.heap[0][0] - now)
+
+    def expired(self, now):
+        while self.heap and self.heap[0][0] <= now:
+            _, _, conn = heapq.heappop(self.heap)
+            if conn.user is None or sessions.get(conn.user) is not conn:
+                continue
+            if conn.expires_at > now:
+                heapq.heappush(self.heap, (conn.expires_at, next(self.counter), conn))
+                continue
+            yield conn
+
+
+expiry = ExpiryHeap(HEARTBEAT_TTL)
+
+
+def sweep_expired(now):
+    for conn in list(expiry.expired(now)):
+        print(f"Session {conn.user[0]}:{conn.user[1]} missed heartbeats, marking offline")
+        close_connection(conn)
+
+
+def update_user_status(name, port, status):
+    return registry.update_status(name, port, status)
+
 
 def handle_webrtc_signal(data):
     # Forward WebRTC signaling data to the target peer
     target_name = data.get("target_name")
     signal_data = data.get("signal_data")
-    for user in user_list:
-        if user["name"] == target_name and user["status"] == "online":
-            try:
-                clientSocket = socket.socket()
-                clientSocket.connect((address, int(user["port"])))
-                signal_message = json.dumps({
-                    "type": "webrtc_signal",
-                    "name": data["sender_name"],
-                    "data": signal_data
-                })
-                clientSocket.send(signal_message.encode('utf-8'))
-                clientSocket.close()
-                print(f"Forwarded WebRTC signal to {target_name}")
-            except Exception as e:
-                print(f"Failed to forward WebRTC signal to {target_name}: {e}")
-
-# Server setup
-serverSocket = socket.socket()
-serverSocket.bind((address, PORT))
-serverSocket.listen()
-print("Central Server is running...")
-
-while True:
-    sendListUser()
-    conn, addr = serverSocket.accept()
-    if conn:
-        print("Have a user connected")
+    signal_message = encode_frame({
+        "type": "webrtc_signal",
+        "name": data["sender_name"],
+        "data": signal_data
+    })
+    for user in registry.online_by_name(target_name):
+        conn = sessions.get((user["name"], user["port"]))
+        if conn:
+            send_to(conn, signal_message)
+            print(f"Forwarded WebRTC signal to {target_name}")
+
+
+def handle_message(conn, jsonData):
+    if conn.user is not None:
+        expiry.touch(conn, time.monotonic())
+    if jsonData.get("type") == "heartbeat":
+        return
+    if jsonData.get("type") == "webrtc_signal":
+        handle_webrtc_signal(jsonData)
+    elif jsonData.get("type") == "resync":
+        send_snapshot(conn)
+    else:
+        name = jsonData.get("name")
+        port = jsonData.get("port")
+        status = jsonData.get("status", "online")
+        new_session = status == "online" and conn.user is None
+        if new_session:
+            # Giữ kết nối này làm phiên lâu dài với peer
+            old = sessions.get((name, port))
+            if old is not None and old is not conn:
+                old.user = None
+                close_connection(old)
+            conn.user = (name, port)
+            sessions[conn.user] = conn
+            expiry.touch(conn, time.monotonic())
+        if update_user_status(name, port, status):
+            broadcast_presence(name, port, status)
+        if new_session:
+            send_snapshot(conn)
+
+
+def process_frames(conn):
+    for jsonData in conn.decoder.frames():
         try:
-            data = conn.recv(1024).decode('utf-8')
-            jsonData = json.loads(data)
-            if jsonData.get("type") == "webrtc_signal":
-                handle_webrtc_signal(jsonData)
-            else:
-                name = jsonData.get("name")
-                port = jsonData.get("port")
-                status = jsonData.get("status", "online")
-                update_user_status(name, port, status)
+            handle_message(conn, jsonData)
         except Exception as e:
             print(f"Error processing user data: {e}")
-        finally:
-            conn.close()
+        stats["handled"] += 1
+        stats["latencies"].append(time.monotonic() - conn.started)
+        conn.started = time.monotonic() if conn.decoder.pending() else None
+
+
+def accept(serverSocket):
+    while True:
+        try:
+            sock, addr = serverSocket.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError as e:
+            print(f"Error accepting connection: {e}")
+            return
+        print("Have a user connected")
+        sock.setblocking(False)
+        stats["accepted"] += 1
+        sel.register(sock, selectors.EVENT_READ, Connection(sock, addr))
+
+
+def flush(conn):
+    try:
+        sent = conn.sock.send(conn.outbuf)
+    except (BlockingIOError, InterruptedError):
+        return
+    except OSError as e:
+        print(f"Failed to send to {conn.addr}: {e}")
+        close_connection(conn)
+        return
+    del conn.outbuf[:sent]
+    if not conn.outbuf:
+        if conn.needs_snapshot:
+            conn.needs_snapshot = False
+            send_snapshot(conn)
+            return
+        sel.modify(conn.sock, selectors.EVENT_READ, conn)
+
+
+def service(conn, mask):
+    if mask & selectors.EVENT_WRITE:
+        flush(conn)
+    if not mask & selectors.EVENT_READ or conn.sock.fileno() == -1:
+        return
+    try:
+        received = conn.decoder.recv_from(conn.sock, 4096)
+    except (BlockingIOError, InterruptedError):
+        return
+    except (FrameError, OSError) as e:
+        print(f"Connection error from {conn.addr}: {e}")
+        received = 0
+    if not received:
+        close_connection(conn)
+        return
+    if conn.started is None:
+        conn.started = time.monotonic()
+    try:
+        process_frames(conn)
+    except FrameError as e:
+        print(f"Protocol error from {conn.addr}: {e}")
+        close_connection(conn)
+
+
+def report_stats():
+    now = time.monotonic()
+    elapsed = now - stats["since"]
+    if elapsed < STATS_INTERVAL:
+        return
+    if not stats["accepted"] and not stats["handled"]:
+        stats["since"] = now
+        return
+    latencies = sorted(stats["latencies"])
+    p99 = latencies[int(0.99 * (len(latencies) - 1))] * 1000 if latencies else 0.0
+    print(f"[stats] accepted {stats['accepted'] / elapsed:.1f} conn/s, "
+          f"handled {stats['handled']} messages, p99 latency {p99:.2f} ms, "
+          f"{len(sel.get_map()) - 1} open connections")
+    stats.update(accepted=0, handled=0, latencies=[], since=now)
+
+
+def serve_forever():
+    serverSocket = socket.socket()
+    serverSocket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    serverSocket.bind((address, PORT))
+    serverSocket.listen(1024)
+    serverSocket.setblocking(False)
+    sel.register(serverSocket, selectors.EVENT_READ, None)
+    print("Central Server is running...")
+
+    while True:
+        now = time.monotonic()
+        timeouts = [t for t in (scheduler.timeout(now), expiry.timeout(now), 1) if t is not None]
+        for key, mask in sel.select(timeout=min(timeouts)):
+            if key.data is None:
+                accept(key.fileobj)
+            else:
+                service(key.data, mask)
+        now = time.monotonic()
+        sweep_expired(now)
+        scheduler.flush(now)
+        report_stats()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Central registry server")
+    parser.add_argument("--broadcast-interval", type=float, default=BROADCAST_INTERVAL,
+                        help="seconds to coalesce presence changes before broadcasting")
+    parser.add_argument("--heartbeat-ttl", type=float, default=HEARTBEAT_TTL,
+                        help="seconds without a heartbeat before a peer is marked offline")
+    args = parser.parse_args()
+    scheduler.interval = args.broadcast_interval
+    expiry.ttl = args.heartbeat_ttl
+    serve_forever()
@@ -2,18 +2,12 @@ import tkinter as tk
 from tkinter.ttk import Style, Button
 from P2P import Peer
 from threading import Thread
-from PIL import ImageTk, Image
-import copy
-import socket
-import json
-import cv2
 
 peer = None
 flag = True
-friendList = None
 friends = []
+friendRows = {}  # (name, port) -> (label trạng thái, nút kết nối)
 video_label = None
-cap = None
 is_streaming_locally = False
 
 class MainWindow:
@@ -102,35 +96,46 @@ class MainWindow:
         self.text.configure(state='disable')
 
     def updateFriendList(self):
-        global peer, friendList, friends
+        global peer, friends
         if peer is None:
             self.log_to_ui("Error: Peer not initialized\n", "error")
             return
 
-        for widget in self.root.winfo_children():
-            if isinstance(widget, Button) and widget.cget('text') not in ['Log in', '➤', 'Browser', 'Channel Online', 'Start Stream', 'Stop Stream']:
-                widget.destroy()
-            if isinstance(widget, tk.Label) and widget.cget('text') == '●':
-                widget.destroy()
-
-        if not hasattr(peer, 'listFriend') or not peer.listFriend:
+        friendList = peer.get_friends()
+        if not friendList:
             self.log_to_ui("No friends online\n", "message")
             return
 
-        friendList = peer.listFriend.split(';')
-        friends.clear()
-        if friendList and friendList[0]:
-            for i, friend_str in enumerate(friendList):
-                if not friend_str:
-                    continue
-                friend = friend_str.split(":")
-                if len(friend) >= 2:
-                    friends.append(copy.deepcopy(friend))
-                    is_online = len(friend) >= 3 and friend[2].lower() == "online"
-                    status_color = "#43B581" if is_online else "gray"
-
-                    tk.Label(self.root, text="●", fg=status_color, bg="#2C2F33", font=("Arial", 14)).place(x=15, y=(i + 1) * 35 + 100)
-                    Button(self.root, text=friends[i][0], command=lambda b=friends[i][1]: self.RunClient(b), width=15, style='Friend.TButton').place(x=30, y=(i + 1) * 35 + 100)
+        # Chỉ tạo widget cho bạn mới và đổi màu cho bạn đổi trạng thái
+        current = set()
+        for (name, port), status in friendList:
+            key = (name, port)
+            current.add(key)
+            status_color = "#43B581" if status.lower() == "online" else "gray"
+            if key in friendRows:
+                label, button = friendRows[key]
+                if label.cget('fg') != status_color:
+                    label.configure(fg=status_color)
+                continue
+            y = (len(friendRows) + 1) * 35 + 100
+            label = tk.Label(self.root, text="●", fg=status_color, bg="#2C2F33", font=("Arial", 14))
+            label.place(x=15, y=y)
+            button = Button(self.root, text=name, command=lambda b=port: self.RunClient(b), width=15, style='Friend.TButton')
+            button.place(x=30, y=y)
+            friendRows[key] = (label, button)
+            friends.append([name, port])
+
+        # Sau resync có thể có người không còn trong danh sách
+        removed = [key for key in friendRows if key not in current]
+        if removed:
+            for key in removed:
+                for widget in friendRows.pop(key):
+                    widget.destroy()
+            friends[:] = [friend for friend in friends if tuple(friend) in friendRows]
+            for i, key in enumerate(friendRows):
+                y = (i + 1) * 35 + 100
+                friendRows[key][0].place(x=15, y=y)
+                friendRows[key][1].place(x=30, y=y)
 
     def RunClient(self, port):
         global flag, peer
@@ -157,7 +162,7 @@ class MainWindow:
                 print(f"Fail sending message: {str(e)}")
 
     def StartVideoStream(self):
-        global peer, cap, is_streaming_locally
+        global peer, is_streaming_locally
         if peer is None:
             self.log_to_ui("Error: Peer not initialized\n", "error")
             print("Peer not initialized.")
@@ -172,62 +177,31 @@ class MainWindow:
             print(f"Error starting video stream: {str(e)}")
             return
 
-        # Chỉ chạy local stream nếu không nhận video từ peer khác
-        if not peer.receiving_video and not is_streaming_locally:
+        # Chỉ chạy local stream nếu không nhận video từ peer khác; frame lấy từ luồng webcam của peer,
+        # không mở thêm VideoCapture thứ hai
+        if not peer.receiving_video and not is_streaming_locally and peer.broadcaster is not None:
             is_streaming_locally = True
-            cap = cv2.VideoCapture(0)
-            if not cap.isOpened():
-                self.log_to_ui("Error: Could not open video stream\n", "error")
-                print("Error: Could not open video stream.")
-                is_streaming_locally = False
-                return
+            broadcaster = peer.broadcaster
+            shown = 0
 
             def update_frame():
-                global cap, is_streaming_locally
-                if not is_streaming_locally or peer.receiving_video or not cap or not cap.isOpened():
-                    if cap:
-                        cap.release()
-                        cap = None
-                    video_label.configure(image='')
+                global is_streaming_locally
+                nonlocal shown
+                if not is_streaming_locally or peer.receiving_video or not broadcaster.running:
+                    peer.video_view.clear()
+                    is_streaming_locally = False
                     return
 
-                ret, frame = cap.read()
-                if ret:
-                    # Resize frame để khớp với video_label
-                    height, width = frame.shape[:2]
-                    target_width, target_height = 615, 420
-                    target_ratio = target_width / target_height
-                    frame_ratio = width / height
-                    if frame_ratio > target_ratio:
-                        new_height = target_height
-                        new_width = int(new_height * frame_ratio)
-                    else:
-                        new_width = target_width
-                        new_height = int(new_width / frame_ratio)
-                    frame = cv2.resize(frame, (new_width, new_height), interpolation=cv2.INTER_AREA)
-                    x_offset = (new_width - target_width) // 2
-                    y_offset = (new_height - target_height) // 2
-                    frame = frame[y_offset:y_offset + target_height, x_offset:x_offset + target_width]
-
-                    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                    img = Image.fromarray(frame)
-                    img_tk = ImageTk.PhotoImage(img)
-                    video_label.img_tk = img_tk
-                    video_label.configure(image=img_tk)
-                    video_label.after(33, update_frame)  # 30 FPS
-                else:
-                    
-                
-                    if cap:
-                        cap.release()
-                        cap = None
-                    video_label.configure(image='')
-                    is_streaming_locally = False
+                # Frame đã được resize khớp video_label trong broadcaster; không chờ trên luồng Tk
+                shown, frame = broadcaster.latest(shown, timeout=0)
+                if frame is not None:
+                    peer.video_view.show(frame, bgr=True)
+                video_label.after(33, update_frame)  # 30 FPS
 
             video_label.after(0, update_frame)
 
     def StopVideoStream(self):
-        global peer, cap, is_streaming_locally
+        global peer, is_streaming_locally
         if peer is None:
             self.log_to_ui("Error: Peer not initialized\n", "error")
             print("Peer not initialized.")
@@ -241,28 +215,13 @@ class MainWindow:
             self.log_to_ui(f"Error stopping video stream: {str(e)}\n", "error")
             print(f"Error stopping video stream: {str(e)}")
 
-        if cap:
-            cap.release()
-            cap = None
-        video_label.configure(image='')
+        peer.video_view.clear()
 
     def on_closing(self):
-        global peer, flag, cap
+        global peer, flag
         flag = False
-        if cap:
-            cap.release()
-            cap = None
         if peer:
             peer.endSystem()
-            try:
-                offline_socket = socket.socket()
-                offline_socket.connect((peer.address, peer.centralServerPort))
-                data = json.dumps({"name": peer.name, "port": str(peer.port), "status": "offline"})
-                offline_socket.send(data.encode('utf-8'))
-                offline_socket.close()
-            except Exception as e:
-                self.log_to_ui(f"Error notifying offline status: {str(e)}\n", "error")
-                print(f"Error notifying offline status: {e}")
         self.root.destroy()
 
 class LoginWindow:
@@ -0,0 +1,22 @@
+# Cách cắt/resize frame cũ của ứng dụng, trước FramePipeline; các benchmark video dùng làm mốc so sánh.
+import cv2
+
+
+def resize_frame(frame, target_width, target_height):
+    # Phóng to vừa khung rồi cắt phần thừa ở giữa, giữ nguyên tỉ lệ ảnh
+    height, width = frame.shape[:2]
+    target_ratio = target_width / target_height
+    frame_ratio = width / height
+
+    if frame_ratio > target_ratio:
+        new_height = target_height
+        new_width = int(new_height * frame_ratio)
+    else:
+        new_width = target_width
+        new_height = int(new_width / frame_ratio)
+
+    frame = cv2.resize(frame, (new_width, new_height), interpolation=cv2.INTER_AREA)
+
+    x_offset = (new_width - target_width) // 2
+    y_offset = (new_height - target_height) // 2
+    return frame[y_offset:y_offset + target_height, x_offset:x_offset + target_width]
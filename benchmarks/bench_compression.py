@@ -0,0 +1,105 @@
+# Thời gian và số byte trên đường truyền cho từng codec khi gửi file log (nén tốt) và file ngẫu nhiên (đã nén),
+# qua giao thức chunk trên loopback; --rate giới hạn băng thông để thấy lợi ích trên mạng chậm.
+# Chạy: python benchmarks/bench_compression.py [--size 64] [--rate 0]   (MB, MB/s; 0 = không giới hạn)
+import argparse
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+from threading import Thread
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from compression import available, looks_compressible
+from transfer import BufferPool, ChunkProgress, FanOutSender, Manifest, receive_chunks
+
+MB = 1024 * 1024
+
+
+class PacedSocket:
+    def __init__(self, sock, rate):
+        self.sock = sock
+        self.rate = rate
+        self.start = None
+        self.sent = 0
+
+    def sendall(self, data):
+        if self.start is None:
+            self.start = time.perf_counter()
+        self.sock.sendall(data)
+        self.sent += len(data)
+        delay = self.sent / self.rate - (time.perf_counter() - self.start)
+        if delay > 0:
+            time.sleep(delay)
+
+    def sendfile(self, f, offset, count):
+        f.seek(offset)
+        self.sendall(f.read(count))
+        return count
+
+
+def make_log(path, size):
+    with open(path, "w") as f:
+        i = 0
+        while f.tell() < size:
+            f.write(f"[2026-10-18 12:{i % 60:02d}:{i * 7 % 60:02d}] [peer{i % 7}] Received chat from user{i % 13}: "
+                    f"message {random.randint(0, 99999)}\n")
+            i += 1
+
+
+def run(src, dst, manifest, codec, rate):
+    pool = BufferPool()
+    progress = ChunkProgress(dst + ".progress", manifest)
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+    fd = os.open(dst, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+    os.ftruncate(fd, manifest.size)
+
+    def receive():
+        conn, _ = server.accept()
+        receive_chunks(conn, fd, progress, pool, codec=codec)
+        conn.close()
+
+    thread = Thread(target=receive)
+    thread.start()
+    start = time.perf_counter()
+    client = socket.create_connection(server.getsockname())
+    sock = PacedSocket(client, rate) if rate else client
+    fanout = FanOutSender(src, {0: sock}, pool, manifest, {0: range(len(manifest))}, codecs={0: codec})
+    fanout.run()
+    client.shutdown(socket.SHUT_WR)
+    thread.join()
+    elapsed = time.perf_counter() - start
+    client.close()
+    server.close()
+    os.close(fd)
+    if not progress.complete():
+        raise RuntimeError("Transfer incomplete")
+    return elapsed, fanout.wire[0]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=64, help="file size in MB")
+    parser.add_argument("--rate", type=float, default=0, help="link bandwidth in MB/s, 0 for unlimited")
+    args = parser.parse_args()
+    print(f"{'file':>6} | {'codec':>5} | {'seconds':>8} | {'wire MB':>8} | {'ratio':>6}")
+    with tempfile.TemporaryDirectory() as tmp:
+        files = {"log": os.path.join(tmp, "app.log"), "random": os.path.join(tmp, "random.bin")}
+        make_log(files["log"], args.size * MB)
+        with open(files["random"], "wb") as f:
+            f.write(os.urandom(args.size * MB))
+        for label, path in files.items():
+            manifest = Manifest.build(path)
+            print(f"{label:>6}: entropy check says {'compress' if looks_compressible(path) else 'skip'}")
+            for codec in [None] + available():
+                elapsed, wire = run(path, os.path.join(tmp, "dst.bin"), manifest, codec, args.rate * MB)
+                print(f"{label:>6} | {codec or 'none':>5} | {elapsed:>8.3f} | {wire / MB:>8.2f} | "
+                      f"{manifest.size / wire:>6.2f}")
+
+
+if __name__ == "__main__":
+    main()
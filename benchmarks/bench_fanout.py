@@ -0,0 +1,97 @@
+# Gửi một file cho nhiều peer qua loopback: lần lượt từng peer (cách cũ) so với FanOutSender.
+# Mỗi peer nhận với băng thông giới hạn (--rate) để giống mạng thật thay vì loopback không giới hạn.
+# Chạy: python benchmarks/bench_fanout.py [--size 100] [--peers 1,4,10] [--rate 50]   (MB, MB/s)
+import argparse
+import os
+import socket
+import sys
+import tempfile
+import time
+from threading import Thread
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from transfer import BufferPool, FanOutSender, Manifest
+
+MB = 1024 * 1024
+
+
+def drain(conn, rate):
+    buf = bytearray(64 * 1024)
+    start = None
+    received = 0
+    while True:
+        n = conn.recv_into(buf)
+        if not n:
+            break
+        if start is None:
+            start = time.perf_counter()
+        received += n
+        delay = received / rate - (time.perf_counter() - start)
+        if delay > 0:
+            time.sleep(delay)
+    conn.close()
+
+
+def open_peers(count, rate):
+    # Mỗi "peer" là một socket nhận và bỏ dữ liệu trên một thread riêng
+    sockets, threads = {}, []
+    for i in range(count):
+        server = socket.socket()
+        server.bind(("127.0.0.1", 0))
+        server.listen(1)
+        client = socket.create_connection(server.getsockname())
+        conn, _ = server.accept()
+        server.close()
+        thread = Thread(target=drain, args=(conn, rate))
+        thread.start()
+        sockets[i] = client
+        threads.append(thread)
+    return sockets, threads
+
+
+def close_peers(sockets, threads):
+    for sock in sockets.values():
+        sock.shutdown(socket.SHUT_WR)
+        sock.close()
+    for thread in threads:
+        thread.join()
+
+
+def sequential(path, manifest, sockets):
+    needed = range(len(manifest))
+    for key, sock in sockets.items():
+        FanOutSender(path, {key: sock}, BufferPool(), manifest, {key: needed}).run()
+
+
+def fanout(path, manifest, sockets):
+    needed = range(len(manifest))
+    FanOutSender(path, sockets, BufferPool(), manifest, {key: needed for key in sockets}).run()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=100, help="file size in MB")
+    parser.add_argument("--peers", default="1,4,10", help="comma separated peer counts")
+    parser.add_argument("--rate", type=float, default=50, help="per-peer receive bandwidth in MB/s")
+    args = parser.parse_args()
+    print(f"{'peers':>6} | {'impl':>10} | {'seconds':>8} | {'aggregate MB/s':>14}")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "src.bin")
+        block = os.urandom(MB)
+        with open(path, "wb") as f:
+            for _ in range(args.size):
+                f.write(block)
+        manifest = Manifest.build(path)
+        for count in (int(p) for p in args.peers.split(",")):
+            for label, fn in (("sequential", sequential), ("fan-out", fanout)):
+                sockets, threads = open_peers(count, args.rate * MB)
+                start = time.perf_counter()
+                fn(path, manifest, sockets)
+                elapsed = time.perf_counter() - start
+                close_peers(sockets, threads)
+                print(f"{count:>6} | {label:>10} | {elapsed:>8.3f} | {args.size * count / elapsed:>14.1f}")
+
+
+if __name__ == "__main__":
+    main()
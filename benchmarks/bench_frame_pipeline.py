@@ -0,0 +1,66 @@
+# Thời gian và bộ nhớ cấp phát cho mỗi frame khi cắt/resize/đổi màu: resize_frame + cvtColor như trước so với
+# FramePipeline ghi vào buffer có sẵn. Đường gửi: frame webcam -> 615x420 BGR; đường nhận: JPEG -> 615x420 RGB.
+# Bộ nhớ là mức tăng đỉnh trong một frame theo tracemalloc (numpy báo các mảng cấp phát cho tracemalloc).
+# Chạy: python benchmarks/bench_frame_pipeline.py [--frames 300]
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from baseline import resize_frame
+from video import FRAME_HEIGHT, FRAME_WIDTH, FramePipeline
+
+
+def camera_frame(width, height):
+    rng = np.random.default_rng(4)
+    frame = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    return cv2.GaussianBlur(frame, (9, 9), 3)
+
+
+def measure(fn, frames):
+    fn()
+    start = time.perf_counter()
+    for _ in range(frames):
+        fn()
+    elapsed = (time.perf_counter() - start) / frames
+    tracemalloc.start()
+    peaks = []
+    for _ in range(20):
+        base = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        fn()
+        peaks.append(tracemalloc.get_traced_memory()[1] - base)
+    tracemalloc.stop()
+    return elapsed, max(peaks)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=300, help="frames per case")
+    args = parser.parse_args()
+    cv2.setNumThreads(1)
+    print(f"{'input':>9} | {'path':>7} | {'mode':>8} | {'ms/frame':>8} | {'KB allocated':>12}")
+    for width, height in ((640, 480), (1280, 720)):
+        frame = camera_frame(width, height)
+        jpeg = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])[1]
+        send, receive = FramePipeline(), FramePipeline(rgb=True)
+        cases = [
+            ("send", "old", lambda: resize_frame(frame, FRAME_WIDTH, FRAME_HEIGHT)),
+            ("send", "pipeline", lambda: send.process(frame, send.buffer())),
+            ("receive", "old", lambda: cv2.cvtColor(resize_frame(cv2.imdecode(jpeg, cv2.IMREAD_COLOR), FRAME_WIDTH,
+                                                                 FRAME_HEIGHT), cv2.COLOR_BGR2RGB)),
+            ("receive", "pipeline", lambda: receive.process(cv2.imdecode(jpeg, cv2.IMREAD_COLOR), receive.buffer())),
+        ]
+        for path, mode, fn in cases:
+            elapsed, allocated = measure(fn, args.frames)
+            print(f"{f'{width}x{height}':>9} | {path:>7} | {mode:>8} | {elapsed * 1000:>8.2f} | {allocated / 1024:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
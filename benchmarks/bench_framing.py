@@ -0,0 +1,71 @@
+# So sánh parser cũ (str + raw_decode + đếm ngoặc) với FrameDecoder khi nhận từng khối 2 KB.
+# Chạy: python benchmarks/bench_framing.py
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from framing import encode_frame, FrameDecoder
+
+CHUNK = 2048
+CASES = [("chat 100 B", 100, 5000), ("chat 4 KB", 4096, 1000), ("message 256 KB", 256 * 1024, 20),
+         ("message 1 MB", 1024 * 1024, 5)]
+
+
+def legacy_parse(chunks):
+    # Cách recv_input_stream làm trước đây
+    buffer = ""
+    count = 0
+    for data in chunks:
+        buffer += data.decode("utf-8")
+        while buffer:
+            try:
+                _, index = json.JSONDecoder().raw_decode(buffer)
+                buffer = buffer[index:].lstrip()
+                count += 1
+            except json.JSONDecodeError:
+                if buffer.count("{") > buffer.count("}"):
+                    break
+                buffer = buffer[buffer.find("{"):] if "{" in buffer else ""
+                continue
+    return count
+
+
+def framed_parse(chunks):
+    decoder = FrameDecoder()
+    count = 0
+    for data in chunks:
+        decoder.feed(data)
+        for _ in decoder.frames():
+            count += 1
+    return count
+
+
+def split(blob):
+    return [blob[i:i + CHUNK] for i in range(0, len(blob), CHUNK)]
+
+
+def measure(parse, chunks, expected):
+    start = time.perf_counter()
+    count = parse(chunks)
+    elapsed = time.perf_counter() - start
+    assert count == expected, (count, expected)
+    return elapsed
+
+
+def main():
+    print(f"{'case':>16} | {'messages':>8} | {'legacy MB/s':>12} | {'framed MB/s':>12}")
+    for label, size, count in CASES:
+        messages = [{"name": "bench", "type": "chat", "message": "x" * size} for _ in range(count)]
+        legacy = split("".join(json.dumps(m) + "\n" for m in messages).encode("utf-8"))
+        framed = split(b"".join(encode_frame(m) for m in messages))
+        mb = sum(len(c) for c in framed) / 1e6
+        legacy_time = measure(legacy_parse, legacy, count)
+        framed_time = measure(framed_parse, framed, count)
+        print(f"{label:>16} | {count:>8} | {mb / legacy_time:>12.1f} | {mb / framed_time:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# Chi phí mỗi lần log_event trên luồng gọi: cách cũ (print + exists/getsize + mở, ghi, đóng log.txt mỗi dòng)
+# so với LogWriter (đưa vào hàng đợi, luồng nền ghi theo lô), và dòng DEBUG bị bỏ theo mức log. Đo cả thời gian
+# tới khi mọi dòng đã nằm trong file. stdout được chuyển sang /dev/null để không đo tốc độ của terminal.
+# Chạy: python benchmarks/bench_log.py [--events 20000] [--threads 1,4]
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from logwriter import DEBUG, INFO, LogWriter
+
+
+def old_log_event(name, port, message):
+    log_line = f"[{name}:{port}] {message}"
+    print(log_line)
+    log_file = "log.txt"
+    if os.path.exists(log_file) and os.path.getsize(log_file) > 10 * 1024 * 1024:
+        pass
+    with open("log.txt", "a", encoding="utf-8") as log_file:
+        log_file.write(log_line + '\n')
+
+
+class NewPeer:
+    logLevel = INFO
+
+    def __init__(self):
+        self.name, self.port = "alice", 9101
+        self.log_writer = LogWriter("log.txt")
+
+    def log_event(self, message, level=INFO):
+        if level < self.logLevel:
+            return
+        self.log_writer.write(f"[{self.name}:{self.port}] {message}")
+
+
+def file_size():
+    return os.path.getsize("log.txt") if os.path.exists("log.txt") else 0
+
+
+def run(threads, events, call):
+    per_thread = events // threads
+    times = []
+
+    def worker(k):
+        start = time.perf_counter()
+        for i in range(per_thread):
+            call(k, i)
+        times.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    workers = [threading.Thread(target=worker, args=(k,)) for k in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    return sum(times) / (per_thread * threads), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--events", type=int, default=20000, help="log events per case")
+    parser.add_argument("--threads", default="1,4", help="comma separated numbers of logging threads")
+    args = parser.parse_args()
+    os.chdir(tempfile.mkdtemp())
+    stdout, sys.stdout = sys.stdout, open(os.devnull, "w")
+    rows = []
+    for threads in (int(v) for v in args.threads.split(",")):
+        if os.path.exists("log.txt"):
+            os.remove("log.txt")
+        per_event, total = run(threads, args.events,
+                               lambda k, i: old_log_event("alice", 9101, f"Video frame {i} sent to {k}"))
+        rows.append((threads, "open/append", per_event, total, file_size()))
+
+        os.remove("log.txt")
+        peer = NewPeer()
+        start = time.perf_counter()
+        per_event, _ = run(threads, args.events, lambda k, i: peer.log_event(f"Video frame {i} sent to {k}"))
+        peer.log_writer.close()
+        rows.append((threads, "log writer", per_event, time.perf_counter() - start, file_size()))
+
+        os.remove("log.txt")
+        peer = NewPeer()
+        start = time.perf_counter()
+        per_event, _ = run(threads, args.events, lambda k, i: peer.log_event(f"Video frame {i} sent to {k}", DEBUG)
+                           if __debug__ and peer.logLevel <= DEBUG else None)
+        peer.log_writer.close()
+        rows.append((threads, "debug off", per_event, time.perf_counter() - start, file_size()))
+    sys.stdout.close()
+    sys.stdout = stdout
+    print(f"{'threads':>7} | {'mode':>11} | {'us/event':>8} | {'s until written':>15} | {'file bytes':>10}")
+    for threads, label, per_event, total, size in rows:
+        print(f"{threads:>7} | {label:>11} | {per_event * 1e6:>8.2f} | {total:>15.3f} | {size:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+# Đo chi phí mỗi message của registry ở central server khi số user tăng từ 100 đến 100k.
+# Chạy: python benchmarks/bench_registry.py
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from Server import UserRegistry
+
+SIZES = [100, 1000, 10000, 100000]
+OPS = 20000
+
+
+class ListRegistry:
+    # Cách làm cũ: quét toàn bộ list of dicts cho mỗi message
+    def __init__(self):
+        self.user_list = []
+
+    def update_status(self, name, port, status):
+        for user in self.user_list:
+            if user["name"] == name and user["port"] == port:
+                user["status"] = status
+                return
+        self.user_list.append({"name": name, "port": port, "status": status})
+
+    def online_by_name(self, name):
+        return [u for u in self.user_list if u["name"] == name and u["status"] == "online"]
+
+
+def per_op(fn, ops):
+    start = time.perf_counter()
+    for i in range(ops):
+        fn(i)
+    return (time.perf_counter() - start) / ops * 1e6
+
+
+def bench(registry, size, ops):
+    for i in range(size):
+        registry.update_status(f"user{i}", str(10000 + i), "online")
+    flip = per_op(lambda i: registry.update_status(f"user{i * 7919 % size}", str(10000 + i * 7919 % size),
+                                                     "offline" if i % 2 else "online"), ops)
+    route = per_op(lambda i: registry.online_by_name(f"user{i * 7919 % size}"), ops)
+    register = per_op(lambda i: registry.update_status(f"new{size}_{i}", str(i), "online"), ops)
+    return flip, route, register
+
+
+def main():
+    print(f"{'users':>8} | {'impl':>8} | {'status flip':>12} | {'signal route':>12} | {'register':>12}  (us/message)")
+    for size in SIZES:
+        for label, registry, ops in (("indexed", UserRegistry(), OPS),
+                                     ("list", ListRegistry(), max(20, min(size, OPS * 100 // size)))):
+            flip, route, register = bench(registry, size, ops)
+            print(f"{size:>8} | {label:>8} | {flip:>12.2f} | {route:>12.2f} | {register:>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
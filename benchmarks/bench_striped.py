@@ -0,0 +1,152 @@
+# Truyền một file qua K kết nối song song (K=1,2,4,8) qua proxy cục bộ giả lập đường truyền có độ trễ:
+# mỗi hướng trễ --delay ms và mỗi kết nối chỉ được có --window KB đang bay, như cửa sổ TCP trên mạng thật.
+# Chạy: python benchmarks/bench_striped.py [--size 64] [--delay 25] [--window 256] [--streams 1,2,4,8]
+import argparse
+import heapq
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from threading import Thread
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from transfer import BufferPool, ChunkProgress, FanOutSender, Manifest, preallocate, receive_chunks, stripe
+
+MB = 1024 * 1024
+
+
+class DelayPipe:
+    # Chuyển dữ liệu từ src sang dst sau delay giây, dừng đọc khi đã có window byte chưa giao
+    def __init__(self, src, dst, delay, window):
+        self.src = src
+        self.dst = dst
+        self.delay = delay
+        self.window = window
+        self.queue = []
+        self.counter = 0
+        self.inflight = 0
+        self.cond = threading.Condition()
+        Thread(target=self.read, daemon=True).start()
+        Thread(target=self.write, daemon=True).start()
+
+    def read(self):
+        while True:
+            with self.cond:
+                while self.inflight >= self.window:
+                    self.cond.wait()
+            try:
+                data = self.src.recv(64 * 1024)
+            except OSError:
+                data = b""
+            with self.cond:
+                self.counter += 1
+                heapq.heappush(self.queue, (time.perf_counter() + self.delay, self.counter, data))
+                self.inflight += len(data)
+                self.cond.notify_all()
+            if not data:
+                return
+
+    def write(self):
+        while True:
+            with self.cond:
+                while not self.queue:
+                    self.cond.wait()
+                due, _, data = self.queue[0]
+            wait = due - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            with self.cond:
+                heapq.heappop(self.queue)
+                self.inflight -= len(data)
+                self.cond.notify_all()
+            try:
+                if not data:
+                    self.dst.shutdown(socket.SHUT_WR)
+                    return
+                self.dst.sendall(data)
+            except OSError:
+                return
+
+
+def delay_proxy(target, delay, window):
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(16)
+
+    def serve():
+        while True:
+            client, _ = listener.accept()
+            upstream = socket.create_connection(target)
+            DelayPipe(client, upstream, delay, window)
+            DelayPipe(upstream, client, delay, window)
+
+    Thread(target=serve, daemon=True).start()
+    return listener.getsockname()
+
+
+def transfer(src, dst, manifest, streams, delay, window):
+    # Bên nhận giống Peer.handleReceiveFile: nhận K kết nối, mỗi kết nối pwrite vào file đã cấp phát trước
+    pool = BufferPool()
+    progress = ChunkProgress(dst + ".progress", manifest)
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(streams)
+    proxy = delay_proxy(server.getsockname(), delay, window)
+    fd = os.open(dst, os.O_RDWR | os.O_CREAT, 0o644)
+    preallocate(fd, manifest.size)
+
+    def receive():
+        conn, _ = server.accept()
+        conn.sendall(b"ACK")
+        receive_chunks(conn, fd, progress, pool)
+        conn.close()
+
+    receivers = [Thread(target=receive) for _ in range(streams)]
+    for thread in receivers:
+        thread.start()
+    start = time.perf_counter()
+    sockets = []
+    for _ in range(streams):
+        sock = socket.create_connection(proxy)
+        sock.recv(3)
+        sockets.append(sock)
+    parts = stripe(range(len(manifest)), streams)
+    FanOutSender(src, dict(enumerate(sockets)), pool, manifest, dict(enumerate(parts))).run()
+    for sock in sockets:
+        sock.shutdown(socket.SHUT_WR)
+    for thread in receivers:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    for sock in sockets:
+        sock.close()
+    os.close(fd)
+    server.close()
+    if not progress.complete():
+        raise RuntimeError("Transfer incomplete")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=64, help="file size in MB")
+    parser.add_argument("--delay", type=float, default=25, help="one-way delay in ms")
+    parser.add_argument("--window", type=int, default=256, help="bytes in flight per connection, in KB")
+    parser.add_argument("--streams", default="1,2,4,8", help="comma separated stream counts")
+    args = parser.parse_args()
+    print(f"{'streams':>7} | {'seconds':>8} | {'MB/s':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, "src.bin")
+        with open(src, "wb") as f:
+            f.write(os.urandom(args.size * MB))
+        manifest = Manifest.build(src)
+        for streams in (int(k) for k in args.streams.split(",")):
+            dst = os.path.join(tmp, f"dst{streams}.bin")
+            elapsed = transfer(src, dst, manifest, streams, args.delay / 1000, args.window * 1024)
+            print(f"{streams:>7} | {elapsed:>8.2f} | {args.size / elapsed:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
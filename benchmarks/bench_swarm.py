@@ -0,0 +1,153 @@
+# Thời gian phân phát một file tới N peer khi mỗi máy có uplink giới hạn (--rate): bên gốc gửi cả file cho
+# từng peer, so với swarm (bên gốc đẩy mỗi peer một phần, các peer gửi phần của mình cho nhau).
+# Chạy: python benchmarks/bench_swarm.py [--size 40] [--peers 2,4,8] [--rate 50]   (MB, MB/s)
+import argparse
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+from threading import Thread
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from transfer import BufferPool, ChunkProgress, FanOutSender, Manifest, Swarm, receive_chunks
+
+MB = 1024 * 1024
+
+
+class Uplink:
+    # Token bucket dùng chung cho mọi luồng gửi đi của một máy
+    def __init__(self, rate):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.next_free = time.perf_counter()
+
+    def wait(self, nbytes):
+        with self.lock:
+            now = time.perf_counter()
+            self.next_free = max(self.next_free, now) + nbytes / self.rate
+            delay = self.next_free - now
+        time.sleep(delay)
+
+
+class PacedSocket:
+    def __init__(self, sock, uplink):
+        self.sock = sock
+        self.uplink = uplink
+
+    def sendall(self, data):
+        view = memoryview(data)
+        for start in range(0, len(view), 64 * 1024):
+            piece = view[start:start + 64 * 1024]
+            self.uplink.wait(len(piece))
+            self.sock.sendall(piece)
+
+    def sendfile(self, f, offset, count):
+        f.seek(offset)
+        self.sendall(f.read(count))
+        return count
+
+
+class Node:
+    def __init__(self, name, tmp, manifest, rate):
+        self.path = os.path.join(tmp, name + ".part")
+        self.uplink = Uplink(rate)
+        self.pool = BufferPool()
+        self.progress = ChunkProgress(self.path + ".progress", manifest)
+        self.done = threading.Event()
+        self.threads = []
+        with open(self.path, "wb") as f:
+            f.truncate(manifest.size)
+
+    def stream_to(self, other):
+        # Mở một kết nối tới other, trả về socket gửi đã qua uplink của mình
+        server = socket.socket()
+        server.bind(("127.0.0.1", 0))
+        server.listen(1)
+        client = socket.create_connection(server.getsockname())
+        conn, _ = server.accept()
+        server.close()
+        thread = Thread(target=other.receive, args=(conn,))
+        thread.start()
+        other.threads.append(thread)
+        return PacedSocket(client, self.uplink), client
+
+    def receive(self, conn):
+        fd = os.open(self.path, os.O_RDWR)
+        try:
+            receive_chunks(conn, fd, self.progress, self.pool)
+        finally:
+            os.close(fd)
+            conn.close()
+        if self.progress.complete():
+            self.done.set()
+
+
+def send(source_path, manifest, sender, targets, needed):
+    sockets, raw = {}, []
+    for key, node in targets.items():
+        paced, client = sender.stream_to(node)
+        sockets[key] = paced
+        raw.append(client)
+    FanOutSender(source_path, sockets, sender.pool, manifest, needed).run()
+    for client in raw:
+        client.shutdown(socket.SHUT_WR)
+        client.close()
+
+
+def direct(src, manifest, tmp, count, rate):
+    seeder = Node("seeder", tmp, manifest, rate)
+    nodes = {i: Node(f"direct{i}", tmp, manifest, rate) for i in range(count)}
+    send(src, manifest, seeder, nodes, {i: range(len(manifest)) for i in nodes})
+    return nodes
+
+
+def swarm(src, manifest, tmp, count, rate):
+    seeder = Node("seeder", tmp, manifest, rate)
+    nodes = {i: Node(f"swarm{i}", tmp, manifest, rate) for i in range(count)}
+    plan = Swarm(manifest, "src.bin", src, list(nodes), "seeder", "seeder")
+
+    def member(i):
+        # Như Peer: nhận xong phần của mình từ bên gốc thì phát phần đó cho các thành viên khác
+        for thread in list(nodes[i].threads):
+            thread.join()
+        others = {j: nodes[j] for j in nodes if j != i}
+        send(nodes[i].path, manifest, nodes[i], others, {j: plan.share(i) for j in others})
+
+    send(src, manifest, seeder, nodes, {i: plan.share(i) for i in nodes})
+    members = [Thread(target=member, args=(i,)) for i in nodes]
+    for thread in members:
+        thread.start()
+    for thread in members:
+        thread.join()
+    return nodes
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=40, help="file size in MB")
+    parser.add_argument("--peers", default="2,4,8", help="comma separated peer counts")
+    parser.add_argument("--rate", type=float, default=50, help="uplink of every node in MB/s")
+    args = parser.parse_args()
+    print(f"{'peers':>6} | {'mode':>7} | {'seconds':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, "src.bin")
+        with open(src, "wb") as f:
+            f.write(os.urandom(args.size * MB))
+        manifest = Manifest.build(src)
+        for count in (int(p) for p in args.peers.split(",")):
+            for label, fn in (("direct", direct), ("swarm", swarm)):
+                start = time.perf_counter()
+                nodes = fn(src, manifest, tmp, count, args.rate * MB)
+                for node in nodes.values():
+                    for thread in node.threads:
+                        thread.join()
+                    if not node.done.is_set():
+                        raise RuntimeError("A peer did not receive the whole file")
+                print(f"{count:>6} | {label:>7} | {time.perf_counter() - start:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
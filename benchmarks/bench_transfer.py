@@ -0,0 +1,127 @@
+# Đo thông lượng truyền file qua loopback: cách cũ (read/send 4 KB, select + recv 4 KB), giao thức chunk
+# (sendfile + recv_into + pwritev, có kiểm tra hash), và thời gian nhận tiếp một file đã nhận được 90%.
+# Chạy: python benchmarks/bench_transfer.py [--sizes 1,100,2048]   (đơn vị MB)
+import argparse
+import os
+import select
+import socket
+import sys
+import tempfile
+import time
+from threading import Thread
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from transfer import BufferPool, ChunkProgress, FanOutSender, Manifest, receive_chunks
+
+MB = 1024 * 1024
+
+
+def legacy_send(sock, path):
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(4096)
+            if not chunk:
+                break
+            sock.sendall(chunk)
+
+
+def legacy_receive(sock, path):
+    sock.setblocking(False)
+    with open(path, "wb") as f:
+        while True:
+            readable, _, _ = select.select([sock], [], [], 5)
+            if not readable:
+                continue
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            f.write(chunk)
+
+
+def chunked(pool, manifests, resume_from=0.0):
+    # Bên nhận giữ bitmap giữa hai lần gọi giống file .progress thật; resume_from đánh dấu sẵn một phần.
+    # Manifest được hash trước và dùng lại như Peer.get_manifest, thời gian hash in riêng.
+    state = {}
+
+    def send(sock, path):
+        manifest = manifests[path]
+        progress = ChunkProgress(path + ".progress", manifest)
+        for index in range(int(len(manifest) * resume_from)):
+            progress.mark(index)
+        state["progress"] = progress
+        needed = {0: [i for i in range(len(manifest)) if not progress.has(i)]}
+        FanOutSender(path, {0: sock}, pool, manifest, needed).run()
+
+    def receive(sock, path):
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            while "progress" not in state:
+                time.sleep(0.001)
+            os.ftruncate(fd, state["progress"].manifest.size)
+            receive_chunks(sock, fd, state.pop("progress"), pool)
+        finally:
+            os.close(fd)
+
+    return send, receive
+
+
+def make_file(path, size):
+    block = os.urandom(MB)
+    with open(path, "wb") as f:
+        for _ in range(size // MB):
+            f.write(block)
+
+
+def run(sender, receiver, src, dst):
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+
+    def serve():
+        conn, _ = server.accept()
+        receiver(conn, dst)
+        conn.close()
+
+    thread = Thread(target=serve)
+    thread.start()
+    client = socket.create_connection(server.getsockname())
+    start = time.perf_counter()
+    sender(client, src)
+    client.shutdown(socket.SHUT_WR)
+    thread.join()
+    elapsed = time.perf_counter() - start
+    client.close()
+    server.close()
+    if os.path.getsize(dst) != os.path.getsize(src):
+        raise RuntimeError(f"Size mismatch: {os.path.getsize(dst)} != {os.path.getsize(src)}")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1,100,2048", help="comma separated file sizes in MB")
+    args = parser.parse_args()
+    pool = BufferPool()
+    manifests = {}
+    impls = [("legacy", legacy_send, legacy_receive),
+             ("chunked", *chunked(pool, manifests)),
+             ("resume 90%", *chunked(pool, manifests, resume_from=0.9))]
+    print(f"{'size':>8} | {'impl':>10} | {'seconds':>8} | {'MB/s':>8}")
+    with tempfile.TemporaryDirectory() as tmp:
+        src = os.path.join(tmp, "src.bin")
+        dst = os.path.join(tmp, "dst.bin")
+        for size_mb in (int(s) for s in args.sizes.split(",")):
+            make_file(src, size_mb * MB)
+            start = time.perf_counter()
+            manifests[src] = Manifest.build(src)
+            elapsed = time.perf_counter() - start
+            print(f"{size_mb:>6}MB | {'hashing':>10} | {elapsed:>8.3f} | {size_mb / elapsed:>8.1f}")
+            for label, sender, receiver in impls:
+                elapsed = run(sender, receiver, src, dst)
+                print(f"{size_mb:>6}MB | {label:>10} | {elapsed:>8.3f} | {size_mb / elapsed:>8.1f}")
+                os.remove(dst)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# Phát video qua proxy cục bộ giới hạn băng thông (--rates, MB/s) và có độ trễ (--delay ms): mức cố định
+# (JPEG 80, đủ kích thước, 30 fps như trước) so với QualityController. Đo fps tới được bên nhận, độ trễ
+# khứ hồi của frame (gửi -> bên nhận giải mã xong -> ack) và mức chất lượng cuối cùng.
+# Chạy: python benchmarks/bench_video_adaptive.py [--rates 0.5,2,20] [--delay 20] [--seconds 8]
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+from queue import Queue
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from video import FrameReceiver, QualityController, VideoBroadcaster
+
+
+class FakeCapture:
+    # Webcam giả 640x480 có nhiễu, đủ chi tiết để JPEG không quá nhỏ
+    def __init__(self):
+        rng = np.random.default_rng(3)
+        base = np.linspace(0, 255, 640, dtype=np.uint8)[None, :, None].repeat(480, 0).repeat(3, 2)
+        self.frames = [cv2.add(base, rng.integers(0, 40, base.shape, dtype=np.uint8)) for _ in range(8)]
+        self.index = 0
+        self.opened = True
+
+    def isOpened(self):
+        return self.opened
+
+    def read(self):
+        self.index += 1
+        return True, self.frames[self.index % len(self.frames)].copy()
+
+    def release(self):
+        self.opened = False
+
+
+def pipe(src, dst, rate, delay):
+    # Chiều gửi video bị giới hạn rate byte/s; mỗi đoạn dữ liệu tới đích sau delay giây, như trên đường truyền
+    queue = Queue()
+
+    def deliver():
+        while True:
+            due, data = queue.get()
+            wait = due - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                if not data:
+                    dst.shutdown(socket.SHUT_WR)
+                    return
+                dst.sendall(data)
+            except OSError:
+                return
+
+    threading.Thread(target=deliver, daemon=True).start()
+    while True:
+        try:
+            data = src.recv(16 * 1024)
+        except OSError:
+            data = b""
+        if data and rate:
+            time.sleep(len(data) / rate)
+        queue.put((time.monotonic() + delay, data))
+        if not data:
+            return
+
+
+def throttled_link(rate, delay):
+    # Trả về (socket phía bên gửi, socket phía bên nhận) nối qua proxy
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(2)
+    sender_side = socket.create_connection(listener.getsockname())
+    proxy_in, _ = listener.accept()
+    proxy_out = socket.create_connection(listener.getsockname())
+    receiver_side, _ = listener.accept()
+    listener.close()
+    threading.Thread(target=pipe, args=(proxy_in, proxy_out, rate, delay), daemon=True).start()
+    threading.Thread(target=pipe, args=(proxy_out, proxy_in, 0, delay), daemon=True).start()
+    return sender_side, receiver_side
+
+
+def run(rate, delay, seconds, controller):
+    sender_side, receiver_side = throttled_link(rate, delay)
+    receiver = FrameReceiver(receiver_side, on_event=lambda message: None)
+    threading.Thread(target=receiver.run, daemon=True).start()
+    broadcaster = VideoBroadcaster(FakeCapture(), on_event=lambda message: None, controller=controller)
+    viewer = broadcaster.subscribe(sender_side, "proxy")
+    broadcaster.start()
+    time.sleep(seconds / 2)
+    # Nửa sau mới đo, sau khi bộ điều chỉnh đã có thời gian ổn định
+    start_frames, rtts = receiver.decoded, []
+    end = time.monotonic() + seconds / 2
+    while time.monotonic() < end:
+        time.sleep(0.1)
+        if viewer.rtt is not None:
+            rtts.append(viewer.rtt)
+    fps = (receiver.decoded - start_frames) / (seconds / 2)
+    broadcaster.stop()
+    receiver.close()
+    rtts.sort()
+    return fps, rtts[len(rtts) // 2] if rtts else 0, rtts[-1] if rtts else 0, controller.setting()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rates", default="0.5,2,20", help="comma separated link rates in MB/s")
+    parser.add_argument("--delay", type=float, default=20, help="one-way delay in ms")
+    parser.add_argument("--seconds", type=float, default=8, help="run time of each case")
+    args = parser.parse_args()
+    print(f"{'MB/s':>5} | {'mode':>8} | {'fps':>5} | {'rtt ms p50':>10} | {'rtt ms max':>10} | final (quality, scale, fps)")
+    for rate in (float(r) for r in args.rates.split(",")):
+        for label in ("fixed", "adaptive"):
+            if label == "fixed":
+                controller = QualityController(min_quality=80, max_quality=80, min_scale=1.0, min_fps=30,
+                                               on_event=lambda message: None)
+            else:
+                controller = QualityController(on_event=lambda message: None)
+            fps, p50, worst, setting = run(rate * 1024 * 1024, args.delay / 1000, args.seconds, controller)
+            print(f"{rate:>5} | {label:>8} | {fps:>5.1f} | {p50 * 1000:>10.0f} | {worst * 1000:>10.0f} | {setting}")
+
+
+if __name__ == "__main__":
+    main()
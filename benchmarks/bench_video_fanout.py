@@ -0,0 +1,127 @@
+# CPU cho việc đọc + resize + nén JPEG khi phát video tới N người xem qua loopback: mỗi người xem một vòng
+# đọc/nén riêng (như send_video_stream cũ) so với VideoBroadcaster đọc và nén mỗi frame một lần.
+# Chạy: python benchmarks/bench_video_fanout.py [--viewers 1,2,4,8] [--seconds 3]
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from baseline import resize_frame
+from video import FRAME_HEIGHT, FRAME_INTERVAL, FRAME_WIDTH, JPEG_QUALITY, VideoBroadcaster
+
+
+class FakeCapture:
+    # Webcam giả 640x480: vài frame có nhiễu dựng sẵn, đọc xoay vòng
+    def __init__(self):
+        rng = np.random.default_rng(1)
+        base = np.linspace(0, 255, 640, dtype=np.uint8)[None, :, None].repeat(480, 0).repeat(3, 2)
+        self.frames = [cv2.add(base, rng.integers(0, 24, base.shape, dtype=np.uint8)) for _ in range(8)]
+        self.index = 0
+        self.opened = True
+
+    def isOpened(self):
+        return self.opened
+
+    def read(self):
+        self.index += 1
+        return True, self.frames[self.index % len(self.frames)].copy()
+
+    def release(self):
+        self.opened = False
+
+
+def reader(sock, counts, key):
+    header = bytearray(4)
+    while True:
+        try:
+            if sock.recv_into(header, 4, socket.MSG_WAITALL) < 4:
+                return
+            remaining = int.from_bytes(header, "big")
+            while remaining:
+                chunk = sock.recv(min(remaining, 1 << 16))
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+        except OSError:
+            return
+        counts[key] += 1
+
+
+def connect_viewers(count):
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(count)
+    counts = {i: 0 for i in range(count)}
+    senders = []
+    for i in range(count):
+        client = socket.create_connection(server.getsockname())
+        conn, addr = server.accept()
+        threading.Thread(target=reader, args=(client, counts, i), daemon=True).start()
+        senders.append((conn, addr))
+    server.close()
+    return senders, counts
+
+
+def per_viewer(count, seconds):
+    senders, counts = connect_viewers(count)
+    stop = threading.Event()
+
+    def loop(conn):
+        cap = FakeCapture()
+        while not stop.is_set():
+            ret, frame = cap.read()
+            frame = resize_frame(frame, FRAME_WIDTH, FRAME_HEIGHT)
+            _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+            data = buffer.tobytes()
+            conn.sendall(len(data).to_bytes(4, byteorder='big') + data)
+            time.sleep(FRAME_INTERVAL)
+
+    threads = [threading.Thread(target=loop, args=(conn,)) for conn, _ in senders]
+    cpu = time.process_time()
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    cpu = time.process_time() - cpu
+    for conn, _ in senders:
+        conn.close()
+    return cpu, sum(counts.values())
+
+
+def broadcaster(count, seconds):
+    senders, counts = connect_viewers(count)
+    fanout = VideoBroadcaster(FakeCapture(), on_event=lambda message: None)
+    for conn, addr in senders:
+        fanout.subscribe(conn, addr)
+    cpu = time.process_time()
+    fanout.start()
+    time.sleep(seconds)
+    fanout.stop()
+    cpu = time.process_time() - cpu
+    return cpu, sum(counts.values())
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--viewers", default="1,2,4,8", help="comma separated viewer counts")
+    parser.add_argument("--seconds", type=float, default=3, help="run time of each case")
+    args = parser.parse_args()
+    cv2.setNumThreads(1)
+    print(f"{'viewers':>7} | {'mode':>11} | {'cpu s':>6} | {'frames':>6} | {'ms cpu/frame':>12}")
+    for count in (int(v) for v in args.viewers.split(",")):
+        for label, fn in (("per viewer", per_viewer), ("broadcaster", broadcaster)):
+            cpu, frames = fn(count, args.seconds)
+            print(f"{count:>7} | {label:>11} | {cpu:>6.2f} | {frames:>6} | {cpu * 1000 / max(frames, 1):>12.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+# CPU dùng để nhận N luồng video cùng lúc, mỗi luồng --fps frame JPEG 615x420/s: mỗi luồng tự giải mã mọi frame
+# ở đủ kích thước trên luồng nhận (như FrameReceiver khi chỉ xem một người) so với VideoGrid giải mã trên pool
+# chung theo ngân sách --budget frame/s và ghép vào lưới 615x420. Đo số lõi CPU dùng, số frame/s được giải mã
+# và được vẽ của mỗi luồng, và thời gian luồng giao diện ghép lưới.
+# Chạy: python benchmarks/bench_video_grid.py [--streams 1,3,6] [--fps 30] [--budget 90] [--seconds 4]
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from video import FRAME_HEIGHT, FRAME_WIDTH, FrameReceiver, VideoGrid
+
+
+def make_frames():
+    rng = np.random.default_rng(8)
+    frames = []
+    for _ in range(8):
+        frame = cv2.GaussianBlur(rng.integers(0, 255, (FRAME_HEIGHT, FRAME_WIDTH, 3), dtype=np.uint8), (0, 0), 3)
+        data = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes()
+        frames.append(len(data).to_bytes(4, byteorder='big') + data)
+    return frames
+
+
+def start_senders(count, fps, seconds):
+    frames = make_frames()
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(count)
+
+    def run(conn):
+        end = time.perf_counter() + seconds
+        index = 0
+        while time.perf_counter() < end:
+            index += 1
+            try:
+                conn.sendall(frames[index % len(frames)])
+            except OSError:
+                break
+            time.sleep(1 / fps)
+        conn.close()
+
+    def accept():
+        for _ in range(count):
+            conn, _ = server.accept()
+            threading.Thread(target=run, args=(conn,), daemon=True).start()
+        server.close()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return [socket.create_connection(server.getsockname()) for _ in range(count)]
+
+
+def measure(receivers, tick, seconds, ui_fps=30):
+    cpu, wall = time.process_time(), time.perf_counter()
+    busy = []
+    end = wall + seconds
+    while time.perf_counter() < end:
+        start = time.perf_counter()
+        tick()
+        busy.append(time.perf_counter() - start)
+        time.sleep(max(0.0, 1 / ui_fps - busy[-1]))
+    cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+    decoded = sum(receiver.received for receiver in receivers) / len(receivers) / wall
+    return cpu / wall, decoded, sum(busy) / len(busy)
+
+
+def per_stream(count, args):
+    receivers = [FrameReceiver(sock, on_event=lambda message: None) for sock in start_senders(count, args.fps,
+                                                                                             args.seconds + 1)]
+    for receiver in receivers:
+        threading.Thread(target=receiver.run, daemon=True).start()
+    shown = [0]
+
+    def tick():
+        for receiver in receivers:
+            if receiver.take() is not None:
+                shown[0] += 1
+
+    result = measure(receivers, tick, args.seconds)
+    for receiver in receivers:
+        receiver.close()
+    return result + (shown[0] / count / args.seconds,)
+
+
+def grid(count, args):
+    videos = VideoGrid(budget=args.budget, workers=args.workers)
+    receivers = []
+    for k, sock in enumerate(start_senders(count, args.fps, args.seconds + 1)):
+        receiver = FrameReceiver(sock, on_event=lambda message: None, executor=videos.executor)
+        videos.add(f"peer{k}", receiver)
+        receivers.append(receiver)
+        threading.Thread(target=receiver.run, daemon=True).start()
+    shown = [0]
+
+    def tick():
+        if videos.take() is not None:
+            shown[0] += 1
+
+    result = measure(receivers, tick, args.seconds)
+    videos.close()
+    return result + (shown[0] / args.seconds,)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--streams", default="1,3,6", help="comma separated numbers of incoming streams")
+    parser.add_argument("--fps", type=float, default=30, help="frames per second from each sender")
+    parser.add_argument("--budget", type=float, default=90, help="decodes per second shared by all streams")
+    parser.add_argument("--workers", type=int, default=2, help="decode threads of the grid")
+    parser.add_argument("--seconds", type=float, default=4, help="run time of each case")
+    args = parser.parse_args()
+    cv2.setNumThreads(1)
+    print(f"{'streams':>7} | {'mode':>10} | {'cores':>5} | {'decoded fps':>11} | {'shown fps':>9} | {'ui ms/tick':>10}")
+    for count in (int(v) for v in args.streams.split(",")):
+        for label, fn in (("per stream", per_stream), ("grid", grid)):
+            cores, decoded, busy, shown = fn(count, args)
+            print(f"{count:>7} | {label:>10} | {cores:>5.2f} | {decoded:>11.1f} | {shown:>9.1f} | {busy * 1000:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+# Bên nhận video: thời gian luồng giao diện bị chiếm mỗi lần vẽ và độ trễ của frame được hiển thị, khi luồng
+# giao diện tự recv + giải mã từng frame (như receive_frame cũ) so với FrameReceiver giải mã ở luồng nền và
+# luồng giao diện chỉ lấy frame mới nhất. Bên gửi phát --fps frame/s, giao diện vẽ --ui-fps lần/s.
+# Chạy: python benchmarks/bench_video_receive.py [--fps 60] [--ui-fps 30] [--seconds 4]
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from baseline import resize_frame
+from video import FRAME_HEIGHT, FRAME_WIDTH, FrameReceiver
+
+
+def make_frames():
+    rng = np.random.default_rng(2)
+    base = np.linspace(0, 255, 640, dtype=np.uint8)[None, :, None].repeat(480, 0).repeat(3, 2)
+    frames = []
+    for _ in range(8):
+        _, buffer = cv2.imencode('.jpg', cv2.add(base, rng.integers(0, 24, base.shape, dtype=np.uint8)),
+                                 [cv2.IMWRITE_JPEG_QUALITY, 80])
+        data = buffer.tobytes()
+        frames.append(len(data).to_bytes(4, byteorder='big') + data)
+    return frames
+
+
+def start_sender(fps, seconds, sent):
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(1)
+    frames = make_frames()
+
+    def run():
+        conn, _ = server.accept()
+        end = time.perf_counter() + seconds
+        while time.perf_counter() < end:
+            sent.append(time.perf_counter())
+            try:
+                conn.sendall(frames[len(sent) % len(frames)])
+            except OSError:
+                break
+            time.sleep(1 / fps)
+        conn.close()
+        server.close()
+
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    return server.getsockname(), thread
+
+
+def ui_loop(ui_fps, seconds, tick):
+    busy, ages = [], []
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        start = time.perf_counter()
+        age = tick()
+        busy.append(time.perf_counter() - start)
+        if age is not None:
+            ages.append(age)
+        time.sleep(max(0.0, 1 / ui_fps - busy[-1]))
+    return busy, ages
+
+
+def old_path(args):
+    sent = []
+    address, sender = start_sender(args.fps, args.seconds, sent)
+    sock = socket.create_connection(address)
+    shown = [0]
+
+    def tick():
+        size = int.from_bytes(sock.recv(4, socket.MSG_WAITALL), byteorder='big')
+        data = b""
+        while len(data) < size:
+            data += sock.recv(size - len(data))
+        frame = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        frame = cv2.cvtColor(resize_frame(frame, FRAME_WIDTH, FRAME_HEIGHT), cv2.COLOR_BGR2RGB)
+        Image.fromarray(frame)
+        shown[0] += 1
+        return time.perf_counter() - sent[shown[0] - 1]
+
+    result = ui_loop(args.ui_fps, args.seconds, tick)
+    sock.close()
+    return result
+
+
+def new_path(args):
+    sent = []
+    address, sender = start_sender(args.fps, args.seconds, sent)
+    receiver = FrameReceiver(socket.create_connection(address), on_event=lambda message: None)
+    threading.Thread(target=receiver.run, daemon=True).start()
+
+    def tick():
+        frame = receiver.take()
+        if frame is None:
+            return None
+        Image.fromarray(frame)
+        return time.perf_counter() - sent[receiver.received - 1]
+
+    result = ui_loop(args.ui_fps, args.seconds, tick)
+    receiver.close()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--fps", type=float, default=60, help="frames per second from the sender")
+    parser.add_argument("--ui-fps", type=float, default=30, help="display refresh rate")
+    parser.add_argument("--seconds", type=float, default=4, help="run time of each case")
+    args = parser.parse_args()
+    cv2.setNumThreads(1)
+    print(f"{'mode':>14} | {'ui ms/tick':>10} | {'max ui ms':>9} | {'shown':>5} | {'age ms p50':>10} | {'age ms max':>10}")
+    for label, fn in (("ui thread", old_path), ("frame receiver", new_path)):
+        busy, ages = fn(args)
+        ages.sort()
+        print(f"{label:>14} | {sum(busy) / len(busy) * 1000:>10.2f} | {max(busy) * 1000:>9.2f} | {len(ages):>5} | "
+              f"{ages[len(ages) // 2] * 1000:>10.1f} | {ages[-1] * 1000:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+# Số byte gửi đi mỗi frame và chất lượng ảnh bên xem ghép lại (PSNR so với frame gốc) khi mọi frame là JPEG đầy
+# đủ (như trước) so với TileEncoder chỉ gửi các ô thay đổi. Cảnh giả 615x420 có nhiễu webcam: "static" chỉ có
+# nhiễu, "talking" có một vùng cỡ khuôn mặt chuyển động, "panning" cả khung hình trôi ngang.
+# Chạy: python benchmarks/bench_video_tiles.py [--frames 150] [--quality 80]
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from video import FRAME_HEIGHT, FRAME_INTERVAL, FRAME_WIDTH, FrameReceiver, TileEncoder
+
+
+def make_scene(kind, frames):
+    rng = np.random.default_rng(6)
+    background = cv2.GaussianBlur(rng.integers(0, 255, (FRAME_HEIGHT, FRAME_WIDTH * 2, 3), dtype=np.uint8),
+                                  (0, 0), 6)
+    background = cv2.normalize(background, None, 0, 255, cv2.NORM_MINMAX)
+    for i in range(frames):
+        offset = 3 * i if kind == "panning" else 0
+        frame = background[:, offset:offset + FRAME_WIDTH].copy()
+        if kind == "talking":
+            x = FRAME_WIDTH // 2 + int(20 * np.sin(i / 7))
+            y = FRAME_HEIGHT // 2 + int(8 * np.sin(i / 3))
+            cv2.ellipse(frame, (x, y), (70, 95), 0, 0, 360, (90, 140, 200), -1)
+            cv2.ellipse(frame, (x, y + 45), (30, 8 + 6 * (i % 4)), 0, 0, 360, (40, 40, 120), -1)
+        noise = rng.normal(0, 2, frame.shape)
+        yield np.clip(frame + noise, 0, 255).astype(np.uint8)
+
+
+def psnr(a, b):
+    mse = np.mean((a.astype(np.float32) - b.astype(np.float32)) ** 2)
+    return 99.0 if mse == 0 else 10 * np.log10(255 ** 2 / mse)
+
+
+def run(kind, frames, quality, tiles):
+    receiver = FrameReceiver(None, on_event=print)
+    encoder = TileEncoder() if tiles else None
+    sent = encode_time = 0
+    scores = []
+    for i, frame in enumerate(make_scene(kind, frames)):
+        start = time.perf_counter()
+        if encoder is None:
+            payload = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].data
+        else:
+            payload = encoder.encode(frame, quality, i * FRAME_INTERVAL)
+        encode_time += time.perf_counter() - start
+        if payload is not None:
+            sent += len(payload) + 4
+            receiver.publish(memoryview(payload))
+        scores.append(psnr(receiver.canvas, frame))
+    stats = f"{encoder.keyframes} key, {encoder.deltas} delta, {encoder.skipped} skipped" if encoder else ""
+    return sent / frames, encode_time / frames, sum(scores) / len(scores), min(scores), stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", type=int, default=150, help="frames per scene")
+    parser.add_argument("--quality", type=int, default=80, help="JPEG quality")
+    args = parser.parse_args()
+    cv2.setNumThreads(1)
+    print(f"{'scene':>8} | {'mode':>5} | {'KB/frame':>8} | {'encode ms':>9} | {'PSNR avg':>8} | {'PSNR min':>8} | frames")
+    for kind in ("static", "talking", "panning"):
+        for label in ("jpeg", "tiles"):
+            size, elapsed, average, worst, stats = run(kind, args.frames, args.quality, label == "tiles")
+            print(f"{kind:>8} | {label:>5} | {size / 1024:>8.1f} | {elapsed * 1000:>9.2f} | {average:>8.2f} | "
+                  f"{worst:>8.2f} | {stats}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+# Độ trễ glass-to-glass (lúc frame được đẩy cho người xem -> lúc bên nhận giải mã xong) qua đường truyền cục bộ
+# có mất gói (--loss) và độ trễ (--delay ms): TCP (Viewer + FrameReceiver) so với UDP (UdpViewer +
+# UdpFrameReceiver). Relay UDP bỏ ngẫu nhiên từng gói; với TCP, đoạn nào có một gói cỡ FRAGMENT_PAYLOAD bị
+# "mất" phải chờ thêm --rto ms rồi mới tới, kéo theo mọi đoạn sau nó như khi TCP gửi lại.
+# Chạy: python benchmarks/bench_video_udp.py [--loss 0,0.01,0.05] [--delay 20] [--fps 30] [--seconds 6]
+import argparse
+import os
+import random
+import select
+import socket
+import sys
+import threading
+import time
+from queue import Queue
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from video import FRAGMENT_PAYLOAD, FrameReceiver, UdpFrameReceiver, UdpVideoServer, Viewer
+
+
+def make_frames():
+    # JPEG 615x420 như bên phát gửi; số thứ tự frame được nối sau JPEG để bên nhận biết frame nào tới
+    rng = np.random.default_rng(5)
+    base = np.linspace(0, 255, 615, dtype=np.uint8)[None, :, None].repeat(420, 0).repeat(3, 2)
+    frames = []
+    for _ in range(8):
+        frame = cv2.GaussianBlur(cv2.add(base, rng.integers(0, 64, base.shape, dtype=np.uint8)), (7, 7), 2)
+        _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 80])
+        frames.append(buffer.tobytes())
+    return frames
+
+
+class Recorder:
+    # Ghi lại lúc từng frame được giải mã, theo số thứ tự nối sau JPEG
+    def __init__(self, receiver):
+        self.decoded = {}
+        publish = receiver.publish
+
+        def record(data):
+            publish(data)
+            self.decoded[int.from_bytes(bytes(data[-4:]), "big")] = time.perf_counter()
+
+        receiver.publish = record
+
+
+def delayed(send):
+    # Gói đưa vào hàng đợi tới đích đúng lúc due, thứ tự giữ nguyên
+    queue = Queue()
+
+    def deliver():
+        while True:
+            due, data = queue.get()
+            if data is None:
+                return
+            wait = due - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                send(data)
+            except OSError:
+                return
+
+    threading.Thread(target=deliver, daemon=True).start()
+    return queue
+
+
+def tcp_pipe(src, dst, loss, delay, rto, rng):
+    queue = delayed(dst.sendall)
+    due = 0.0
+    while True:
+        try:
+            data = src.recv(64 * 1024)
+        except OSError:
+            data = b""
+        if not data:
+            queue.put((0, None))
+            return
+        arrive = time.perf_counter() + delay
+        # Đoạn đọc được gồm nhiều gói cỡ FRAGMENT_PAYLOAD, mất một gói là cả đoạn phải chờ gửi lại
+        if rng.random() < 1 - (1 - loss) ** -(-len(data) // FRAGMENT_PAYLOAD):
+            arrive += rto
+        # Đoạn sau không thể tới trước đoạn đang chờ gửi lại
+        due = max(due, arrive)
+        queue.put((due, data))
+
+
+def tcp_link(loss, delay, rto):
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(2)
+    sender_side = socket.create_connection(listener.getsockname())
+    proxy_in, _ = listener.accept()
+    proxy_out = socket.create_connection(listener.getsockname())
+    receiver_side, _ = listener.accept()
+    listener.close()
+    rng = random.Random(7)
+    threading.Thread(target=tcp_pipe, args=(proxy_in, proxy_out, loss, delay, rto, rng), daemon=True).start()
+    threading.Thread(target=tcp_pipe, args=(proxy_out, proxy_in, 0, delay, rto, rng), daemon=True).start()
+    return sender_side, receiver_side
+
+
+def udp_relay(server_address, loss, delay, running):
+    # Bên nhận connect tới relay; relay chuyển gói hai chiều và bỏ gói theo xác suất loss
+    relay = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    relay.bind(("127.0.0.1", 0))
+    rng = random.Random(7)
+    viewer = []
+    queues = {}
+
+    def run():
+        while running.is_set():
+            if not select.select([relay], [], [], 0.2)[0]:
+                continue
+            data, address = relay.recvfrom(65536)
+            if address == server_address:
+                if not viewer or rng.random() < loss:
+                    continue
+                target = viewer[0]
+            else:
+                if not viewer:
+                    viewer.append(address)
+                target = server_address
+            if target not in queues:
+                queues[target] = delayed(lambda packet, target=target: relay.sendto(packet, target))
+            queues[target].put((time.perf_counter() + delay, data))
+        for queue in queues.values():
+            queue.put((0, None))
+        relay.close()
+
+    threading.Thread(target=run, daemon=True).start()
+    return relay.getsockname()
+
+
+def stream(push, recorder, fps, seconds):
+    frames = make_frames()
+    pushed = {}
+    end = time.perf_counter() + seconds
+    index = 0
+    while time.perf_counter() < end:
+        index += 1
+        data = frames[index % len(frames)] + index.to_bytes(4, "big")
+        pushed[index] = time.perf_counter()
+        push(len(data).to_bytes(4, byteorder='big') + data)
+        time.sleep(1 / fps)
+    time.sleep(1.0)
+    latencies = sorted(recorder.decoded[i] - pushed[i] for i in recorder.decoded if i in pushed)
+    return index, latencies
+
+
+def run_tcp(args, loss):
+    sender_side, receiver_side = tcp_link(loss, args.delay / 1000, args.rto / 1000)
+    receiver = FrameReceiver(receiver_side, on_event=lambda message: None)
+    recorder = Recorder(receiver)
+    threading.Thread(target=receiver.run, daemon=True).start()
+    viewer = Viewer(sender_side, "proxy", lambda viewer, error: None)
+    result = stream(viewer.push, recorder, args.fps, args.seconds)
+    viewer.close()
+    receiver.close()
+    return result
+
+
+class Fanout:
+    # Thay cho VideoBroadcaster: UdpVideoServer chỉ cần add_viewer/unsubscribe
+    def __init__(self):
+        self.viewers = []
+
+    def add_viewer(self, viewer):
+        self.viewers.append(viewer)
+        return viewer
+
+    def unsubscribe(self, viewer, error=None):
+        if viewer in self.viewers:
+            self.viewers.remove(viewer)
+
+    def push(self, data):
+        for viewer in list(self.viewers):
+            viewer.push(data)
+
+
+def run_udp(args, loss):
+    running = threading.Event()
+    running.set()
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server_socket.bind(("127.0.0.1", 0))
+    fanout = Fanout()
+    server = UdpVideoServer(server_socket, fanout, on_event=lambda message: None)
+    client = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    client.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1024 * 1024)
+    client.connect(udp_relay(server_socket.getsockname(), loss, args.delay / 1000, running))
+    receiver = UdpFrameReceiver(client, on_event=lambda message: None)
+    recorder = Recorder(receiver)
+    threading.Thread(target=receiver.run, daemon=True).start()
+    while not fanout.viewers:
+        time.sleep(0.01)
+    result = stream(fanout.push, recorder, args.fps, args.seconds)
+    receiver.close()
+    server.close()
+    running.clear()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--loss", default="0,0.01,0.05", help="comma separated packet loss probabilities")
+    parser.add_argument("--delay", type=float, default=20, help="one-way delay in ms")
+    parser.add_argument("--rto", type=float, default=200, help="extra delay of a lost TCP segment in ms")
+    parser.add_argument("--fps", type=float, default=30, help="frames per second from the sender")
+    parser.add_argument("--seconds", type=float, default=6, help="run time of each case")
+    args = parser.parse_args()
+    cv2.setNumThreads(1)
+    print(f"{'loss':>5} | {'mode':>4} | {'shown':>5} | {'lost':>5} | {'ms p50':>7} | {'ms p95':>7} | {'ms max':>7}")
+    for loss in (float(v) for v in args.loss.split(",")):
+        for label, fn in (("tcp", run_tcp), ("udp", run_udp)):
+            sent, latencies = fn(args, loss)
+            if not latencies:
+                print(f"{loss:>5} | {label:>4} | {0:>5} | {sent:>5} |")
+                continue
+            p50 = latencies[len(latencies) // 2]
+            p95 = latencies[int(len(latencies) * 0.95)]
+            print(f"{loss:>5} | {label:>4} | {len(latencies):>5} | {sent - len(latencies):>5} | {p50 * 1000:>7.1f} | "
+                  f"{p95 * 1000:>7.1f} | {latencies[-1] * 1000:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+import math
+import os
+import zlib
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+try:
+    import lz4.frame
+except ImportError:
+    lz4 = None
+
+ENTROPY_LIMIT = 7.5  # bit/byte; trên mức này coi như dữ liệu đã nén (zip, jpg, mp4...) và gửi nguyên
+SAMPLE_SIZE = 64 * 1024  # mỗi mẫu lấy ở đầu, giữa và cuối file
+
+
+def _codecs():
+    # Thứ tự ưu tiên khi hai bên cùng hỗ trợ
+    codecs = {}
+    if zstandard is not None:
+        codecs["zstd"] = (zstandard.ZstdCompressor(level=3).compress, zstandard.ZstdDecompressor().decompress)
+    if lz4 is not None:
+        codecs["lz4"] = (lz4.frame.compress, lz4.frame.decompress)
+    codecs["zlib"] = (lambda data: zlib.compress(data, 6), zlib.decompress)
+    return codecs
+
+
+CODECS = _codecs()
+
+
+def available():
+    return list(CODECS)
+
+
+def negotiate(offered):
+    # Bên nhận chọn codec đầu tiên mà cả hai cùng có, theo thứ tự ưu tiên của mình
+    for name in CODECS:
+        if name in offered:
+            return name
+    return None
+
+
+def compress(codec, data):
+    return CODECS[codec][0](data)
+
+
+def decompress(codec, data):
+    return CODECS[codec][1](data)
+
+
+def entropy(data):
+    if not data:
+        return 0.0
+    total = len(data)
+    return -sum(count / total * math.log2(count / total)
+                for count in (data.count(bytes((b,))) for b in range(256)) if count)
+
+
+def looks_compressible(path):
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        for offset in sorted({0, max(0, size // 2 - SAMPLE_SIZE // 2), max(0, size - SAMPLE_SIZE)}):
+            f.seek(offset)
+            if entropy(f.read(SAMPLE_SIZE)) < ENTROPY_LIMIT:
+                return True
+    return False
@@ -0,0 +1,100 @@
+import json
+import struct
+import zlib
+
+# Mỗi frame: 4 byte độ dài (big-endian) + payload JSON UTF-8
+HEADER = struct.Struct(">I")
+MAX_FRAME = 16 * 1024 * 1024
+COMPRESSED = 0x80000000  # bit cao của độ dài: payload đã nén zlib
+COMPRESS_MIN = 1024  # frame nhỏ hơn mức này nén không đáng
+
+
+class FrameError(ValueError):
+    pass
+
+
+def encode_frame(message, compress=False):
+    payload = json.dumps(message, separators=(",", ":")).encode("utf-8")
+    if compress and len(payload) >= COMPRESS_MIN:
+        packed = zlib.compress(payload)
+        if len(packed) < len(payload):
+            return HEADER.pack(len(packed) | COMPRESSED) + packed
+    return HEADER.pack(len(payload)) + payload
+
+
+class FrameDecoder:
+    # Buffer dùng lại giữa các lần recv; mỗi byte chỉ được copy và parse một lần
+
+    def __init__(self, size=65536, max_frame=MAX_FRAME, on_error=None):
+        self.buf = bytearray(size)
+        self.view = memoryview(self.buf)
+        self.start = 0
+        self.end = 0
+        self.max_frame = max_frame
+        self.on_error = on_error
+
+    def pending(self):
+        return self.end - self.start
+
+    def _reserve(self, need):
+        if len(self.buf) - self.end >= need:
+            return
+        # Dồn phần chưa parse về đầu buffer, chỉ nới rộng khi một frame lớn hơn buffer
+        remaining = self.end - self.start
+        if remaining + need > len(self.buf):
+            size = len(self.buf)
+            while size < remaining + need:
+                size *= 2
+            buf = bytearray(size)
+            buf[:remaining] = self.view[self.start:self.end]
+            self.view.release()
+            self.buf = buf
+            self.view = memoryview(self.buf)
+        else:
+            self.view[:remaining] = self.view[self.start:self.end]
+        self.start = 0
+        self.end = remaining
+
+    def recv_from(self, sock, nbytes=65536):
+        need = nbytes
+        if self.pending() >= HEADER.size:
+            length = HEADER.unpack_from(self.buf, self.start)[0] & ~COMPRESSED
+            if length > self.max_frame:
+                raise FrameError(f"Frame of {length} bytes exceeds limit of {self.max_frame}")
+            need = max(need, HEADER.size + length - self.pending())
+        self._reserve(need)
+        n = sock.recv_into(self.view[self.end:])
+        self.end += n
+        return n
+
+    def feed(self, data):
+        self._reserve(len(data))
+        self.view[self.end:self.end + len(data)] = data
+        self.end += len(data)
+
+    def frames(self):
+        while self.end - self.start >= HEADER.size:
+            length = HEADER.unpack_from(self.buf, self.start)[0]
+            compressed = length & COMPRESSED
+            length &= ~COMPRESSED
+            if length > self.max_frame:
+                raise FrameError(f"Frame of {length} bytes exceeds limit of {self.max_frame}")
+            begin = self.start + HEADER.size
+            if self.end - begin < length:
+                break
+            self.start = begin + length
+            try:
+                payload = self.view[begin:self.start].tobytes()
+                if compressed:
+                    inflater = zlib.decompressobj()
+                    payload = inflater.decompress(payload, self.max_frame)
+                    if inflater.unconsumed_tail:
+                        raise ValueError(f"decompressed frame exceeds limit of {self.max_frame}")
+                message = json.loads(payload)
+            except (ValueError, zlib.error) as e:
+                if self.on_error:
+                    self.on_error(f"Dropping malformed frame of {length} bytes: {str(e)}")
+                continue
+            yield message
+        if self.start == self.end:
+            self.start = self.end = 0
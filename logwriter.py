@@ -0,0 +1,156 @@
+import atexit
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+LOG_QUEUE = 50000  # số dòng chờ ghi tối đa; đầy thì bỏ dòng cũ nhất
+FLUSH_INTERVAL = 0.2  # giây giữa hai lần luồng nền gom và ghi một lô
+MAX_LOG_SIZE = 10 * 1024 * 1024
+
+
+class LogWriter:
+    # Luồng gọi chỉ thêm dòng vào hàng đợi vòng; một luồng nền gom cả lô, in ra và ghi file bằng một lần write.
+    # Kích thước file được cộng dồn trong bộ nhớ nên không phải stat file mỗi dòng để biết lúc xoay vòng.
+    def __init__(self, path="log.txt", max_size=MAX_LOG_SIZE, echo=True, limit=LOG_QUEUE,
+                 interval=FLUSH_INTERVAL):
+        self.path = path
+        self.max_size = max_size
+        self.echo = echo
+        self.interval = interval
+        self.lines = deque(maxlen=limit)
+        self.high = limit // 4  # hàng đợi dài quá mức này thì đánh thức luồng nền sớm
+        self.dropped = 0
+        self.wake = threading.Event()
+        self.lock = threading.Lock()  # chỉ một lần flush tại một thời điểm
+        self.file = None
+        self.size = 0
+        self.limit = max_size  # kích thước file sẽ thử xoay vòng
+        self.pending = b""  # phần đã gom nhưng chưa ghi được vào file
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, line):
+        lines = self.lines
+        if len(lines) >= self.high:
+            if len(lines) == lines.maxlen:
+                self.dropped += 1
+            if not self.wake.is_set():
+                self.wake.set()
+        lines.append(line)
+
+    def run(self):
+        while self.running:
+            self.wake.wait(self.interval)
+            self.wake.clear()
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            batch = []
+            lines = self.lines
+            while lines:
+                batch.append(lines.popleft())
+            if self.dropped:
+                batch.append(f"[log] {self.dropped} lines dropped, writer could not keep up")
+                self.dropped = 0
+            if not batch and not self.pending:
+                return
+            if batch:
+                text = "\n".join(batch) + "\n"
+                if self.echo:
+                    try:
+                        sys.stdout.write(text)
+                        sys.stdout.flush()
+                    except (OSError, ValueError):
+                        pass
+                self.pending += text.encode("utf-8")
+            try:
+                if self.file is None:
+                    self.open()
+                elif not self.current():
+                    # Peer khác trên cùng máy đã xoay vòng file, ghi tiếp vào file mới chứ không vào bản lưu
+                    self.file.close()
+                    self.file = None
+                    self.open()
+                if self.size + len(self.pending) > self.limit:
+                    self.rotate()
+                self.file.write(self.pending)
+                self.file.flush()
+                self.size += len(self.pending)
+                self.pending = b""
+            except Exception as e:
+                print(f"Failed to write to log: {str(e)}")
+                if self.file is not None:
+                    try:
+                        self.file.close()
+                    except OSError:
+                        pass
+                    self.file = None
+                # Giữ lại lô chưa ghi để lần sau ghi tiếp, chỉ bỏ phần cũ nhất khi quá max_size
+                if len(self.pending) > self.max_size:
+                    self.pending = self.pending[self.pending.find(b"\n", len(self.pending) - self.max_size) + 1:]
+
+    def open(self):
+        self.file = open(self.path, "ab")
+        self.size = os.fstat(self.file.fileno()).st_size
+        self.limit = self.max_size
+
+    def current(self):
+        # Một lần stat mỗi lô, không phải mỗi dòng
+        try:
+            return os.path.samestat(os.stat(self.path), os.fstat(self.file.fileno()))
+        except OSError:
+            return False
+
+    def rotate(self):
+        # Peer khác có thể cũng đang ghi file này nên xem kích thước thật trước khi xoay vòng
+        self.size = os.fstat(self.file.fileno()).st_size
+        if self.size <= self.max_size:
+            return
+        self.file.close()
+        self.file = None
+        try:
+            os.rename(self.path, f"log_{time.strftime('%Y%m%d_%H%M%S')}.txt")
+            rotated = True
+        except OSError as e:
+            # Windows không cho đổi tên khi tiến trình khác còn mở file: ghi tiếp vào file cũ, thử lại sau
+            # thêm max_size byte
+            print(f"Failed to rotate log: {str(e)}")
+            rotated = False
+        self.open()
+        if rotated:
+            self.file.write(b"Log rotated.\n")
+            self.size += len(b"Log rotated.\n")
+        else:
+            self.limit = self.size + self.max_size
+
+    def close(self):
+        self.running = False
+        self.wake.set()
+        self.flush()
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+writers = {}  # đường dẫn -> LogWriter, mọi peer trong một tiến trình ghi chung một luồng nền cho mỗi file
+writers_lock = threading.Lock()
+
+
+def open_log(path="log.txt", max_size=MAX_LOG_SIZE):
+    with writers_lock:
+        writer = writers.get(path)
+        if writer is None:
+            writer = writers[path] = LogWriter(path, max_size)
+        return writer
+
+
+@atexit.register
+def close_logs():
+    for writer in list(writers.values()):
+        writer.close()
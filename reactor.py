@@ -0,0 +1,137 @@
+import heapq
+import itertools
+import selectors
+import socket
+import time
+from collections import deque
+from threading import get_ident
+
+
+class Reactor:
+    # Vòng lặp selectors chạy trên một thread duy nhất; thread khác giao việc qua call_soon
+
+    def __init__(self, on_error=None):
+        self.on_error = on_error
+        self.selector = selectors.DefaultSelector()
+        self.ready = deque()
+        self.timers = []
+        self.counter = itertools.count()
+        self.running = False
+        self.thread_id = None
+        self._wake_r, self._wake_w = socket.socketpair()
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+        self.selector.register(self._wake_r, selectors.EVENT_READ, None)
+
+    def in_loop(self):
+        return self.thread_id == get_ident()
+
+    def call_soon(self, callback, *args):
+        self.ready.append((callback, args))
+        if not self.in_loop():
+            self.wakeup()
+
+    def call_later(self, delay, callback, *args):
+        if not self.in_loop():
+            self.call_soon(self.call_later, delay, callback, *args)
+            return
+        heapq.heappush(self.timers, (time.monotonic() + delay, next(self.counter), callback, args))
+
+    def wakeup(self):
+        try:
+            self._wake_w.send(b"\0")
+        except (BlockingIOError, OSError):
+            pass
+
+    def add_reader(self, sock, callback):
+        self._set(sock, 0, callback)
+
+    def remove_reader(self, sock):
+        self._set(sock, 0, None)
+
+    def add_writer(self, sock, callback):
+        self._set(sock, 1, callback)
+
+    def remove_writer(self, sock):
+        self._set(sock, 1, None)
+
+    def _set(self, sock, index, callback):
+        if not self.in_loop():
+            self.call_soon(self._set, sock, index, callback)
+            return
+        try:
+            key = self.selector.get_key(sock)
+            callbacks = list(key.data)
+        except (KeyError, ValueError):
+            key = None
+            callbacks = [None, None]
+        callbacks[index] = callback
+        events = (selectors.EVENT_READ if callbacks[0] else 0) | (selectors.EVENT_WRITE if callbacks[1] else 0)
+        try:
+            if key is None:
+                if events:
+                    self.selector.register(sock, events, callbacks)
+            elif events:
+                self.selector.modify(sock, events, callbacks)
+            else:
+                self.selector.unregister(sock)
+        except (KeyError, ValueError, OSError):
+            pass
+
+    def registered(self):
+        return [key.fileobj for key in self.selector.get_map().values() if key.data is not None]
+
+    def stop(self):
+        self.running = False
+        self.wakeup()
+
+    def _timeout(self, max_wait):
+        if self.ready:
+            return 0
+        if self.timers:
+            return max(0.0, min(max_wait, self.timers[0][0] - time.monotonic()))
+        return max_wait
+
+    def run(self, max_wait=1.0):
+        self.thread_id = get_ident()
+        self.running = True
+        while self.running:
+            for key, mask in self.selector.select(self._timeout(max_wait)):
+                if key.data is None:
+                    try:
+                        while self._wake_r.recv(4096):
+                            pass
+                    except (BlockingIOError, OSError):
+                        pass
+                    continue
+                reader, writer = key.data
+                if mask & selectors.EVENT_WRITE and writer:
+                    self._dispatch(writer, (key.fileobj,))
+                if mask & selectors.EVENT_READ and reader and key.fileobj.fileno() != -1:
+                    self._dispatch(reader, (key.fileobj,))
+            now = time.monotonic()
+            while self.timers and self.timers[0][0] <= now:
+                _, _, callback, args = heapq.heappop(self.timers)
+                self.ready.append((callback, args))
+            for _ in range(len(self.ready)):
+                callback, args = self.ready.popleft()
+                self._dispatch(callback, args)
+        self.thread_id = None
+
+    def _dispatch(self, callback, args):
+        try:
+            callback(*args)
+        except Exception as e:
+            if self.on_error:
+                self.on_error(f"Error in reactor callback {getattr(callback, '__name__', callback)}: {str(e)}")
+
+    def close(self):
+        for sock in self.registered():
+            try:
+                self.selector.unregister(sock)
+                sock.close()
+            except (KeyError, ValueError, OSError):
+                pass
+        self.selector.close()
+        self._wake_r.close()
+        self._wake_w.close()
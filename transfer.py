@@ -0,0 +1,577 @@
+import hashlib
+import json
+import os
+import shutil
+import socket
+import stat
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from queue import Queue
+from compression import compress, decompress
+
+CHUNK_SIZE = 1024 * 1024  # kích thước mỗi chunk và mỗi buffer nhận
+WRITE_BATCH = 4  # số chunk liền nhau gom lại cho một lần pwritev
+POOL_SIZE = 16  # số buffer tối đa giữ lại để dùng cho lần nhận sau
+FANOUT_WINDOW = 8  # số chunk đọc trước tối đa khi gửi một file cho nhiều peer
+SAVE_EVERY = 64  # ghi lại bitmap tiến độ sau mỗi chừng này chunk
+MAX_STREAMS = 8  # số kết nối song song tối đa cho một file
+FILE_ACCEPT_TIMEOUT = 30  # giây bên nhận chờ bên gửi kết nối vào cổng file_port
+# Mỗi chunk trên socket truyền file: 4 byte chỉ số chunk + 4 byte độ dài, rồi tới dữ liệu
+CHUNK_HEADER = struct.Struct(">II")
+
+
+class BufferPool:
+    # Buffer chỉ cấp phát khi cần, trả về pool sau mỗi lần nhận nên các file sau không phải cấp phát lại
+    def __init__(self, size=CHUNK_SIZE, limit=POOL_SIZE):
+        self.size = size
+        self.limit = limit
+        self.free = []
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            if self.free:
+                return self.free.pop()
+        return bytearray(self.size)
+
+    def release(self, buf):
+        with self.lock:
+            if len(self.free) < self.limit:
+                self.free.append(buf)
+
+
+class Manifest:
+    def __init__(self, size, chunk_size, hashes):
+        self.size = size
+        self.chunk_size = chunk_size
+        self.hashes = hashes  # sha256 hex của từng chunk
+
+    @classmethod
+    def build(cls, path, chunk_size=CHUNK_SIZE):
+        hashes = []
+        buf = bytearray(chunk_size)
+        view = memoryview(buf)
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            while True:
+                n = f.readinto(buf)
+                if not n:
+                    break
+                hashes.append(hashlib.sha256(view[:n]).hexdigest())
+        return cls(size, chunk_size, hashes)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(int(data["size"]), int(data["chunk_size"]), list(data["hashes"]))
+
+    def to_dict(self):
+        return {"size": self.size, "chunk_size": self.chunk_size, "hashes": self.hashes}
+
+    def key(self):
+        # Định danh nội dung, dùng để biết bitmap cũ có thuộc cùng file không
+        return hashlib.sha256(f"{self.size}:{self.chunk_size}:{''.join(self.hashes)}".encode()).hexdigest()
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def chunk_length(self, index):
+        return min(self.chunk_size, self.size - index * self.chunk_size)
+
+    def verify(self, index, data):
+        return hashlib.sha256(data).hexdigest() == self.hashes[index]
+
+    def bad_chunks(self, path):
+        # Chỉ số các chunk trong file không khớp hash của manifest
+        try:
+            hashes = Manifest.build(path, self.chunk_size).hashes
+        except OSError:
+            return list(range(len(self)))
+        return [index for index, digest in enumerate(self.hashes) if index >= len(hashes) or hashes[index] != digest]
+
+
+class ChunkProgress:
+    # Bitmap các chunk đã nhận đúng, lưu ở file sidecar để nhận tiếp sau khi mất kết nối
+    def __init__(self, path, manifest):
+        self.path = path
+        self.manifest = manifest
+        self.bits = bytearray((len(manifest) + 7) // 8)
+        self.done = 0
+        self.unsaved = 0
+        self.lock = threading.Lock()  # nhiều luồng nhận (swarm) có thể ghi cùng một bitmap
+
+    @classmethod
+    def load(cls, path, manifest):
+        progress = cls(path, manifest)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            bits = bytearray.fromhex(data["bitmap"])
+            if data["manifest"] == manifest.key() and len(bits) == len(progress.bits):
+                progress.bits = bits
+                progress.done = sum(progress.has(i) for i in range(len(manifest)))
+        except (OSError, ValueError, KeyError):
+            pass
+        return progress
+
+    @classmethod
+    def full(cls, path, manifest):
+        # Tiến độ của file đã có sẵn trọn vẹn (lấy từ store), để tham gia swarm như một nguồn đủ piece
+        progress = cls(path, manifest)
+        for index in range(len(manifest)):
+            set_bit(progress.bits, index)
+        progress.done = len(manifest)
+        return progress
+
+    def has(self, index):
+        return has_bit(self.bits, index)
+
+    def mark(self, index):
+        with self.lock:
+            if not self.has(index):
+                set_bit(self.bits, index)
+                self.done += 1
+                self.unsaved += 1
+
+    def unmark(self, index):
+        with self.lock:
+            if self.has(index):
+                self.bits[index >> 3] &= ~(1 << (index & 7))
+                self.done -= 1
+                self.unsaved += 1
+
+    def complete(self):
+        return self.done == len(self.manifest)
+
+    def missing_ranges(self):
+        # [[đầu, cuối)] các đoạn chunk còn thiếu, gửi lại cho bên gửi trong phản hồi file_port
+        ranges = []
+        for index in range(len(self.manifest)):
+            if self.has(index):
+                continue
+            if ranges and ranges[-1][1] == index:
+                ranges[-1][1] = index + 1
+            else:
+                ranges.append([index, index + 1])
+        return ranges
+
+    def save(self):
+        with self.lock:
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"manifest": self.manifest.key(), "bitmap": self.bits.hex()}, f)
+            os.replace(tmp, self.path)
+            self.unsaved = 0
+
+    def remove(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class ContentStore:
+    # Mỗi nội dung chỉ lưu một lần, theo Manifest.key(), trong <user>/.store; tên file là hardlink tới đó. Người
+    # dùng sửa file thì sửa luôn bản trong store, nên has() so dấu size/mtime/inode và băm lại khi dấu đã đổi
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def has(self, manifest):
+        key = manifest.key()
+        path = self.path(key)
+        try:
+            st = os.stat(path)
+            if st.st_size != manifest.size:
+                return False
+            with open(path + ".stat", "r", encoding="utf-8") as f:
+                if f.read() == self.stamp(st):
+                    return True
+        except OSError:
+            if not os.path.exists(path):
+                return False
+        # File trong store đã bị đổi từ lúc lưu (hoặc chưa có dấu): băm lại trước khi báo bên gửi là đã có
+        if Manifest.build(path, manifest.chunk_size).key() != key:
+            return False
+        self.mark(path)
+        return True
+
+    def add(self, src, manifest):
+        # Chuyển file vừa nhận đủ vào store; nếu cùng nội dung đã có nguyên vẹn thì giữ bản cũ, bỏ bản mới
+        path = self.path(manifest.key())
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if self.has(manifest):
+            os.remove(src)
+            return path
+        if os.path.exists(path):
+            # Bản cũ bị sửa; Windows không cho thay file chỉ đọc
+            os.chmod(path, stat.S_IREAD | stat.S_IWRITE)
+        os.replace(src, path)
+        self.mark(path)
+        return path
+
+    def link(self, key, dest):
+        # Đặt tên file trỏ tới nội dung trong store, thay nguyên tử file cùng tên nếu có
+        path = self.path(key)
+        if os.path.exists(dest) and os.path.samefile(path, dest):
+            return
+        tmp = dest + ".link"
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        try:
+            os.link(path, tmp)
+        except OSError:
+            # Hệ thống file không hỗ trợ hardlink thì chép ra
+            shutil.copyfile(path, tmp)
+        os.replace(tmp, dest)
+
+    def mark(self, path):
+        with open(path + ".stat", "w", encoding="utf-8") as f:
+            f.write(self.stamp(os.stat(path)))
+
+    @staticmethod
+    def stamp(st):
+        return f"{st.st_size}:{st.st_mtime_ns}:{st.st_ino}"
+
+
+def has_bit(bits, index):
+    return bool(bits[index >> 3] & (1 << (index & 7)))
+
+
+def set_bit(bits, index):
+    bits[index >> 3] |= 1 << (index & 7)
+
+
+def range_indexes(ranges):
+    return [index for start, end in ranges for index in range(start, end)]
+
+
+class Swarm:
+    # Mỗi piece có đúng một thành viên chịu trách nhiệm phát lại cho các thành viên khác (piece i thuộc
+    # members[i % N]); bên gốc chỉ đẩy cho mỗi thành viên phần của nó, và tự gửi những piece mà chủ đã rời đi
+    def __init__(self, manifest, filename, path, members, seeder, me, progress=None, codecs=()):
+        self.manifest = manifest
+        self.filename = filename
+        self.path = path  # file để đọc piece khi phục vụ peer khác (.part khi chưa nhận xong)
+        self.members = [str(port) for port in members]
+        self.seeder = str(seeder)
+        self.me = str(me)
+        self.progress = progress  # None với bên gốc, vốn có đủ mọi piece
+        self.codecs = list(codecs)  # codec bên gốc đề nghị, rỗng nếu file đã nén sẵn
+        self.haves = {}  # port -> bitmap các piece thành viên đó đang có
+        self.links = {}  # port -> PeerConnection dùng để gửi have/offer cho thành viên đó
+        self.serving = set()  # các port mình đang gửi piece tới
+        self.gone = set()  # thành viên đã mất kết nối, phần của họ do bên gốc gửi
+        self.lock = threading.Lock()
+
+    def info(self):
+        return {"members": self.members, "seeder": self.seeder, "from": self.me}
+
+    def owner(self, index):
+        return self.members[index % len(self.members)]
+
+    def share(self, port):
+        port = str(port)
+        return [index for index in range(len(self.manifest)) if self.owner(index) == port]
+
+    def peers(self):
+        return [port for port in self.members + [self.seeder] if port != self.me]
+
+    def update_have(self, port, bits):
+        # Bitmap chỉ tăng; gộp lại để have đến muộn không xoá các piece mình vừa gửi xong
+        with self.lock:
+            old = self.haves.get(str(port))
+            if old is not None and len(old) == len(bits):
+                bits = bytearray(a | b for a, b in zip(old, bits))
+            self.haves[str(port)] = bits
+
+    def claim(self, port):
+        # Các piece mình có, port còn thiếu, và mình là người phải gửi; đánh dấu đang gửi để không gửi trùng
+        port = str(port)
+        with self.lock:
+            bits = self.haves.get(port)
+            if bits is None or port in self.serving or port in self.gone:
+                return []
+            indexes = []
+            for index in range(len(self.manifest)):
+                if has_bit(bits, index):
+                    continue
+                if self.progress is None:
+                    if self.owner(index) not in self.gone:
+                        continue
+                elif self.owner(index) != self.me or not self.progress.has(index):
+                    continue
+                indexes.append(index)
+            if indexes:
+                self.serving.add(port)
+            return indexes
+
+    def release(self, port, delivered, failed=False):
+        port = str(port)
+        with self.lock:
+            self.serving.discard(port)
+            if failed:
+                self.gone.add(port)
+            bits = self.haves.get(port)
+            if bits is not None:
+                for index in delivered:
+                    set_bit(bits, index)
+
+    def finished(self):
+        with self.lock:
+            if self.progress is not None and not self.progress.complete():
+                return False
+            for port in self.members:
+                if port == self.me or port in self.gone:
+                    continue
+                bits = self.haves.get(port)
+                if bits is None or not all(has_bit(bits, i) for i in range(len(self.manifest))):
+                    return False
+            return True
+
+
+def preallocate(fd, size):
+    # Cấp phát trước toàn bộ file để các luồng pwrite song song không làm file bị phân mảnh
+    if os.fstat(fd).st_size == size:
+        return
+    os.ftruncate(fd, size)
+    if size and hasattr(os, "posix_fallocate"):
+        try:
+            os.posix_fallocate(fd, 0, size)
+        except OSError:
+            pass
+
+
+def stripe(indexes, streams):
+    # Chunk i đi trên kết nối i % K, để mọi kết nối cùng chạy dù gửi chung buffer đọc trước
+    indexes = sorted(indexes)
+    return [indexes[k::streams] for k in range(streams)]
+
+
+def _fill(sock, view, stop):
+    got = 0
+    while got < len(view):
+        try:
+            n = sock.recv_into(view[got:])
+        except socket.timeout:
+            if stop and stop():
+                raise ConnectionAbortedError("Transfer cancelled")
+            continue
+        if not n:
+            break
+        got += n
+    return got
+
+
+# Không có pwrite (Windows) thì phải lseek rồi write; vị trí file dùng chung giữa các luồng nhận nên hai bước này
+# phải nằm trong một khoá, nếu không luồng khác có thể dời vị trí ở giữa và chunk bị ghi sai chỗ
+_seek_lock = threading.Lock()
+
+
+def _pwrite_all(fd, views, offset):
+    if hasattr(os, "pwritev"):
+        while views:
+            written = os.pwritev(fd, views, offset)
+            offset += written
+            while views and written >= len(views[0]):
+                written -= len(views.pop(0))
+            if views and written:
+                views[0] = views[0][written:]
+        return
+    for view in views:
+        while view:
+            if hasattr(os, "pwrite"):
+                written = os.pwrite(fd, view, offset)
+            else:
+                with _seek_lock:
+                    os.lseek(fd, offset, os.SEEK_SET)
+                    written = os.write(fd, view)
+            view = view[written:]
+            offset += written
+
+
+def pack_chunk(codec, data):
+    # Chunk nén không nhỏ hơn thì gửi nguyên; bên nhận phân biệt bằng độ dài trong header
+    if codec is None:
+        return None
+    packed = compress(codec, data)
+    return packed if len(packed) < len(data) else None
+
+
+def receive_chunks(sock, fd, progress, pool, stop=None, on_error=None, codec=None):
+    # Nhận chunk vào buffer của pool bằng recv_into, giải nén nếu cần, kiểm tra hash rồi ghi đúng offset;
+    # các chunk liền nhau được gom lại ghi một lần. Trả về số byte đã ghi.
+    manifest = progress.manifest
+    header = bytearray(CHUNK_HEADER.size)
+    buffers = [pool.acquire() for _ in range(WRITE_BATCH + 1)]
+    views = [memoryview(buf) for buf in buffers]
+    packed = views.pop()  # nhận dữ liệu nén trước khi giải nén vào buffer của batch
+    batch = []  # (chỉ số, view) các chunk liền nhau chưa ghi
+    total = 0
+
+    def flush():
+        nonlocal total
+        if not batch:
+            return
+        _pwrite_all(fd, [view for _, view in batch], batch[0][0] * manifest.chunk_size)
+        for index, view in batch:
+            progress.mark(index)
+            total += len(view)
+        batch.clear()
+        if progress.unsaved >= SAVE_EVERY:
+            progress.save()
+
+    try:
+        while True:
+            if _fill(sock, memoryview(header), stop) < CHUNK_HEADER.size:
+                break
+            index, length = CHUNK_HEADER.unpack(header)
+            if index >= len(manifest) or length > manifest.chunk_length(index) or length > pool.size or \
+                    (codec is None and length != manifest.chunk_length(index)):
+                raise ValueError(f"Invalid chunk header ({index}, {length})")
+            if batch and batch[-1][0] + 1 != index:
+                flush()
+            view = views[len(batch)][:manifest.chunk_length(index)]
+            if length == len(view):
+                if _fill(sock, view, stop) < length:
+                    break
+            else:
+                if _fill(sock, packed[:length], stop) < length:
+                    break
+                try:
+                    data = decompress(codec, packed[:length])
+                except Exception:
+                    data = b""
+                if len(data) != len(view):
+                    if on_error:
+                        on_error(f"Chunk {index} failed to decompress, will be requested again")
+                    continue
+                view[:] = data
+            if not manifest.verify(index, view):
+                if on_error:
+                    on_error(f"Chunk {index} failed checksum, will be requested again")
+                continue
+            batch.append((index, view))
+            if len(batch) == WRITE_BATCH:
+                flush()
+    finally:
+        flush()
+        for buf in buffers:
+            pool.release(buf)
+    return total
+
+
+class FanOutSender:
+    # Đọc file một lần; mỗi chunk được chia sẻ cho mọi đích cần nó và chỉ trả về pool khi đích cuối cùng gửi xong
+    def __init__(self, path, targets, pool, manifest, needed, window=FANOUT_WINDOW, codecs=None):
+        self.path = path
+        self.targets = dict(targets)  # key -> socket đã bắt tay xong
+        self.pool = pool
+        self.manifest = manifest
+        self.needed = {key: set(needed[key]) for key in self.targets}  # key -> chỉ số chunk đích còn thiếu
+        self.slots = threading.Semaphore(window)
+        self.lock = threading.Lock()
+        self.queues = {key: Queue() for key in self.targets}
+        self.codecs = {key: (codecs or {}).get(key) for key in self.targets}  # key -> codec đã thoả thuận
+        self.progress = {key: 0 for key in self.targets}
+        self.wire = {key: 0 for key in self.targets}  # byte thực sự đi trên socket, kể cả header
+        self.errors = {}
+        self.elapsed = 0.0
+
+    def _release(self, chunk):
+        with self.lock:
+            chunk[3] -= 1
+            done = chunk[3] == 0
+        if done:
+            self.pool.release(chunk[0])
+            self.slots.release()
+
+    def _read(self):
+        try:
+            with open(self.path, "rb") as f:
+                for index in sorted(set().union(*self.needed.values())):
+                    keys = [key for key in self.targets if index in self.needed[key]]
+                    self.slots.acquire()
+                    buf = self.pool.acquire()
+                    f.seek(index * self.manifest.chunk_size)
+                    n = f.readinto(memoryview(buf)[:self.manifest.chunk_length(index)])
+                    # Nén một lần cho mỗi codec, mọi đích dùng cùng codec gửi chung bản nén
+                    packed = {codec: pack_chunk(codec, memoryview(buf)[:n])
+                              for codec in {self.codecs[key] for key in keys} if codec}
+                    chunk = [buf, index, n, len(keys), packed]
+                    for key in keys:
+                        self.queues[key].put(chunk)
+        finally:
+            for queue in self.queues.values():
+                queue.put(None)
+
+    def _send(self, key):
+        sock = self.targets[key]
+        queue = self.queues[key]
+        while True:
+            chunk = queue.get()
+            if chunk is None:
+                return
+            try:
+                # Đích đã lỗi vẫn lấy hết chunk ra để không giữ buffer của các đích khác
+                if key not in self.errors:
+                    payload = chunk[4].get(self.codecs[key]) or memoryview(chunk[0])[:chunk[2]]
+                    sock.sendall(CHUNK_HEADER.pack(chunk[1], len(payload)))
+                    sock.sendall(payload)
+                    self.progress[key] += chunk[2]
+                    self.wire[key] += CHUNK_HEADER.size + len(payload)
+            except OSError as e:
+                self.errors[key] = e
+            finally:
+                self._release(chunk)
+
+    def _send_direct(self, key):
+        sock = self.targets[key]
+        codec = self.codecs[key]
+        buf = self.pool.acquire() if codec else None
+        try:
+            with open(self.path, "rb") as f:
+                for index in sorted(self.needed[key]):
+                    length = self.manifest.chunk_length(index)
+                    if codec:
+                        # Có nén thì phải đọc chunk vào bộ nhớ, không dùng sendfile được
+                        f.seek(index * self.manifest.chunk_size)
+                        view = memoryview(buf)[:f.readinto(memoryview(buf)[:length])]
+                        payload = pack_chunk(codec, view) or view
+                        sock.sendall(CHUNK_HEADER.pack(index, len(payload)))
+                        sock.sendall(payload)
+                        self.wire[key] += CHUNK_HEADER.size + len(payload)
+                    else:
+                        sock.sendall(CHUNK_HEADER.pack(index, length))
+                        sent = sock.sendfile(f, index * self.manifest.chunk_size, length)
+                        if sent != length:
+                            raise ConnectionResetError(f"Sent {sent} of {length} bytes of chunk {index}")
+                        self.wire[key] += CHUNK_HEADER.size + sent
+                    self.progress[key] += length
+        except OSError as e:
+            self.errors[key] = e
+        finally:
+            if buf is not None:
+                self.pool.release(buf)
+
+    def run(self):
+        start = time.monotonic()
+        # Không chunk nào phải gửi hai lần (một đích, các stripe của cùng một file, phần của từng thành viên
+        # swarm) thì mỗi đích gửi thẳng bằng sendfile, không cần buffer đọc trước dùng chung
+        disjoint = sum(map(len, self.needed.values())) == len(set().union(*self.needed.values()))
+        with ThreadPoolExecutor(max_workers=len(self.targets) + 1) as executor:
+            if disjoint:
+                futures = [executor.submit(self._send_direct, key) for key in self.targets]
+            else:
+                futures = [executor.submit(self._send, key) for key in self.targets]
+                futures.append(executor.submit(self._read))
+            for future in futures:
+                future.result()
+        self.elapsed = time.monotonic() - start
+        return self.progress
+
+    def throughput(self):
+        return sum(self.progress.values()) / max(self.elapsed, 1e-6)
@@ -0,0 +1,927 @@
+import select
+import socket
+import struct
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+from PIL import Image, ImageTk
+
+FRAME_WIDTH, FRAME_HEIGHT = 615, 420  # kích thước video_label
+JPEG_QUALITY = 80
+FRAME_INTERVAL = 0.03  # khoảng nghỉ giữa hai lần đọc webcam
+VIEWER_QUEUE = 2  # số frame chờ gửi tối đa cho mỗi người xem, đầy thì bỏ frame cũ nhất
+RECEIVE_BUFFER = 256 * 1024  # buffer nhận frame ban đầu, tự lớn lên khi gặp frame to hơn
+# Bên nhận gửi lại 4 byte số frame đã giải mã xong; bên gửi so với số frame đã gửi và thời điểm gửi
+MAX_INFLIGHT = 3  # số frame đã gửi mà chưa được báo giải mã xong, vượt mức này coi như nghẽn
+RTT_SLACK = 0.15  # RTT vượt RTT nhỏ nhất từng đo chừng này giây nghĩa là đang có hàng đợi trên đường truyền
+ADAPT_INTERVAL = 0.5  # giây giữa hai lần đánh giá mức chất lượng
+ADAPT_HOLD = 1.0  # sau khi hạ mức, chờ chừng này giây cho hàng đợi cũ xả hết rồi mới đánh giá lại
+# Chế độ UDP: mỗi gói là FRAGMENT_HEADER + một mảnh JPEG; bên xem gửi gói chào kèm số frame đã nhận/mất
+FRAGMENT_HEADER = struct.Struct(">IHHd")  # frame id, chỉ số mảnh, số mảnh, thời điểm gửi
+FRAGMENT_PAYLOAD = 1200  # vừa một gói trên hầu hết đường truyền, không bị IP phân mảnh
+REPORT = struct.Struct(">4sII")  # b"HELO"/b"BYE!", số frame đã giải mã, số frame bị mất
+JITTER_DELAY = 0.1  # frame thiếu mảnh được giữ chừng này giây để chờ mảnh đến muộn, rồi bỏ chứ không xin gửi lại
+REPORT_INTERVAL = 0.5
+VIEWER_TIMEOUT = 5.0  # không nghe thấy bên kia chừng này giây thì coi như đã rời đi
+# Chế độ gửi theo ô: khung hình chia thành các ô TILE_SIZE px, chỉ ô thay đổi được ghép lại và nén thành một JPEG
+TILE_HEADER = struct.Struct(">4sHHHH")  # b"TILE", rộng, cao, cỡ ô, số ô; tiếp theo là chỉ số các ô rồi JPEG
+TILE_SIZE = 32  # bội của 16 để ranh giới ô trùng với khối JPEG, ô này không lem sang ô kia
+PIXEL_THRESHOLD = 24  # mức chênh lệch một giá trị màu lớn hơn nhiễu webcam
+TILE_CHANGED = 12  # số giá trị màu chênh quá PIXEL_THRESHOLD để coi là ô đã đổi
+KEYFRAME_INTERVAL = 2.0  # giây giữa hai frame đầy đủ, xoá dần sai lệch nhỏ tích luỹ dưới ngưỡng
+KEYFRAME_RATIO = 0.6  # đổi quá tỉ lệ ô này thì gửi luôn frame đầy đủ
+MOSAIC_COLUMNS = 16  # số ô trên một hàng của ảnh ghép
+# Xem nhiều luồng cùng lúc: giải mã trên một pool chung, mỗi luồng được chia đều DECODE_BUDGET lần giải mã mỗi giây
+DECODE_WORKERS = 2
+DECODE_BUDGET = 90  # tổng số lần giải mã + chuyển ảnh mỗi giây cho mọi luồng, ~một lõi CPU ở 615x420
+PENDING_LIMIT = 8  # số frame chờ giải mã tối đa của một luồng; vượt thì bỏ hết và chờ frame đầy đủ kế tiếp
+# Các mức (chất lượng JPEG, tỉ lệ kích thước, fps) từ tốt nhất tới tiết kiệm nhất; bị kẹp theo sàn và trần
+QUALITY_LADDER = [
+    (90, 1.0, 30), (80, 1.0, 30), (70, 1.0, 30), (60, 1.0, 25), (60, 0.75, 25), (50, 0.75, 20),
+    (50, 0.5, 15), (40, 0.5, 10), (30, 0.5, 5),
+]
+
+
+class FramePipeline:
+    # Cắt giữa + resize (+ đổi BGR sang RGB) ghi thẳng vào buffer cấp phát sẵn. Vùng cắt và kiểu nội suy tính
+    # một lần cho mỗi kích thước đầu vào; cắt trên ảnh gốc trước khi resize nên không tốn công cho phần bị bỏ.
+    def __init__(self, width=FRAME_WIDTH, height=FRAME_HEIGHT, rgb=False, count=3):
+        self.size = (width, height)
+        self.rgb = rgb
+        self.buffers = [np.empty((height, width, 3), dtype=np.uint8) for _ in range(count)]
+        self.geometry = {}  # (cao, rộng) của ảnh vào -> (hàng, cột cần cắt, kiểu nội suy)
+
+    def crop(self, height, width):
+        geometry = self.geometry.get((height, width))
+        if geometry is None:
+            scale = max(self.size[0] / width, self.size[1] / height)
+            crop_width = min(width, round(self.size[0] / scale))
+            crop_height = min(height, round(self.size[1] / scale))
+            x = (width - crop_width) // 2
+            y = (height - crop_height) // 2
+            # INTER_AREA chỉ đáng công khi thu nhỏ nhiều; gần 1:1 thì INTER_LINEAR nhanh hơn vài lần
+            interpolation = cv2.INTER_AREA if scale < 0.5 else cv2.INTER_LINEAR
+            geometry = self.geometry[(height, width)] = (slice(y, y + crop_height), slice(x, x + crop_width),
+                                                        interpolation)
+        return geometry
+
+    def buffer(self, busy=()):
+        # Buffer chưa bị frame nào trong busy (frame bên khác có thể còn đang đọc) chiếm
+        for buf in self.buffers:
+            if not any(buf is frame for frame in busy):
+                return buf
+        buf = np.empty_like(self.buffers[0])
+        self.buffers.append(buf)
+        return buf
+
+    def process(self, frame, out):
+        rows, cols, interpolation = self.crop(*frame.shape[:2])
+        cv2.resize(frame[rows, cols], self.size, dst=out, interpolation=interpolation)
+        if self.rgb:
+            cv2.cvtColor(out, cv2.COLOR_BGR2RGB, dst=out)
+        return out
+
+
+class FrameView:
+    # Vẽ frame lên Label Tk: dùng lại một PhotoImage (paste) và một buffer RGB thay vì tạo mới mỗi frame
+    def __init__(self, label):
+        self.label = label
+        self.photo = None
+        self.rgb = None
+        self.lock = threading.Lock()
+
+    def show(self, frame, bgr=False):
+        with self.lock:
+            if bgr:
+                if self.rgb is None or self.rgb.shape != frame.shape:
+                    self.rgb = np.empty_like(frame)
+                frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=self.rgb)
+            img = Image.fromarray(frame)
+            if self.photo is not None and (self.photo.width(), self.photo.height()) == img.size:
+                self.photo.paste(img)
+                return
+            self.photo = ImageTk.PhotoImage(img)
+            self.label.configure(image=self.photo)
+            self.label.image = self.photo
+
+    def clear(self):
+        with self.lock:
+            self.photo = None
+            self.label.configure(image='')
+
+
+class Viewer:
+    # Một người xem: hàng đợi có giới hạn và luồng ghi riêng, người xem chậm chỉ mất frame của chính mình
+    def __init__(self, sock, address, on_close, limit=VIEWER_QUEUE):
+        self.sock = sock
+        self.address = address
+        self.on_close = on_close
+        self.limit = limit
+        self.frames = deque()
+        self.cond = threading.Condition()
+        self.closed = False
+        self.resync = False  # đã bỏ frame, frame ô bị bỏ cho tới khi broadcaster gửi frame đầy đủ
+        self.sent = 0
+        self.dropped = 0
+        self.acked = 0
+        self.sent_at = deque(maxlen=120)  # (số thứ tự frame, thời điểm gửi) để đo RTT khi nhận ack
+        self.acks = bytearray()
+        self.rtt = None  # RTT trung bình trượt, None nếu bên nhận chưa từng ack
+        self.min_rtt = None
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def inflight(self):
+        return self.sent - self.acked
+
+    def push(self, data):
+        with self.cond:
+            if self.closed:
+                return False
+            if len(self.frames) >= self.limit:
+                self.frames.popleft()
+                self.dropped += 1
+                # Frame ô phía sau frame bị bỏ sẽ vẽ lên ảnh thiếu, bỏ luôn cho tới frame đầy đủ kế tiếp
+                while self.frames and self.frames[0][4:8] == b"TILE":
+                    self.frames.popleft()
+                    self.dropped += 1
+                self.resync = not self.frames
+            if self.resync:
+                if data[4:8] == b"TILE":
+                    self.dropped += 1
+                    return False
+                self.resync = False
+            self.frames.append(data)
+            self.cond.notify()
+        return True
+
+    def run(self):
+        error = None
+        while True:
+            with self.cond:
+                while not self.frames and not self.closed:
+                    self.cond.wait()
+                if self.closed:
+                    break
+                data = self.frames.popleft()
+            try:
+                self.sent_at.append((self.sent, time.monotonic()))
+                self.sock.sendall(data)
+                self.sent += 1
+                self.read_acks()
+            except OSError as e:
+                error = e
+                break
+        self.close()
+        self.on_close(self, error)
+
+    def read_acks(self):
+        # Đọc các ack đã tới mà không chờ; bên nhận đời cũ không ack thì chỉ còn tín hiệu frame bị bỏ
+        while select.select([self.sock], [], [], 0)[0]:
+            data = self.sock.recv(4096)
+            if not data:
+                raise ConnectionResetError("Viewer closed the connection")
+            self.acks += data
+        count = len(self.acks) // 4
+        if not count:
+            return
+        acked = int.from_bytes(self.acks[count * 4 - 4:count * 4], byteorder='big')
+        del self.acks[:count * 4]
+        now = time.monotonic()
+        while self.sent_at and self.sent_at[0][0] < acked:
+            seq, sent_at = self.sent_at.popleft()
+            if seq == acked - 1:
+                sample = now - sent_at
+                self.rtt = sample if self.rtt is None else 0.8 * self.rtt + 0.2 * sample
+                self.min_rtt = sample if self.min_rtt is None else min(self.min_rtt, sample)
+        self.acked = max(self.acked, acked)
+
+    def close(self):
+        with self.cond:
+            if self.closed:
+                return
+            self.closed = True
+            self.cond.notify()
+        # shutdown trước để sendall đang chặn ở luồng ghi thoát ra ngay
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class UdpViewer:
+    # Người xem qua UDP: frame cắt thành các gói mang frame id và chỉ số mảnh, gửi không chờ; socket dùng
+    # chung ở chế độ không chặn, buffer gửi đầy thì bỏ cả frame
+    def __init__(self, sock, address):
+        self.sock = sock
+        self.address = address
+        self.frame_id = 0
+        self.sent = 0
+        self.skipped = 0  # frame không gửi được vì buffer gửi đầy
+        self.lost = 0  # frame bên xem báo không nhận đủ mảnh
+        self.dropped = 0
+        self.rtt = None  # không có ack từng frame, bộ điều chỉnh chỉ dựa vào số frame bị mất
+        self.last_seen = time.monotonic()
+        self.closed = False
+
+    def inflight(self):
+        return 0
+
+    def report(self, lost):
+        self.last_seen = time.monotonic()
+        self.lost = max(self.lost, lost)
+        self.dropped = self.skipped + self.lost
+
+    def push(self, data):
+        if self.closed:
+            return False
+        payload = memoryview(data)[4:]
+        count = max(1, -(-len(payload) // FRAGMENT_PAYLOAD))
+        self.frame_id += 1
+        sent_at = time.time()
+        try:
+            for index in range(count):
+                header = FRAGMENT_HEADER.pack(self.frame_id, index, count, sent_at)
+                self.sock.sendto(header + payload[index * FRAGMENT_PAYLOAD:(index + 1) * FRAGMENT_PAYLOAD],
+                                 self.address)
+        except (BlockingIOError, InterruptedError):
+            self.skipped += 1
+            self.dropped = self.skipped + self.lost
+            return False
+        except OSError:
+            self.closed = True
+            return False
+        self.sent += 1
+        return True
+
+    def close(self):
+        self.closed = True
+
+
+class UdpVideoServer:
+    # Socket UDP cạnh cổng video TCP: bên xem gửi gói chào định kỳ, server thêm họ vào broadcaster và gỡ ra
+    # khi họ chào tạm biệt hoặc quá VIEWER_TIMEOUT không nghe thấy
+    def __init__(self, sock, broadcaster, on_event=print):
+        self.sock = sock
+        self.sock.setblocking(False)
+        self.broadcaster = broadcaster
+        self.on_event = on_event
+        self.viewers = {}  # địa chỉ -> UdpViewer
+        self.running = True
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        while self.running:
+            try:
+                if select.select([self.sock], [], [], REPORT_INTERVAL)[0]:
+                    data, address = self.sock.recvfrom(64)
+                    self.handle(data, address)
+            except (BlockingIOError, InterruptedError):
+                pass
+            except (OSError, ValueError):
+                if not self.running:
+                    break
+                # ICMP port unreachable từ bên xem đã đi cũng hiện ra ở đây trên một số hệ điều hành
+                continue
+            now = time.monotonic()
+            for address, viewer in list(self.viewers.items()):
+                if viewer.closed or now - viewer.last_seen > VIEWER_TIMEOUT:
+                    self.remove(address)
+
+    def handle(self, data, address):
+        if len(data) != REPORT.size:
+            return
+        kind, decoded, lost = REPORT.unpack(data)
+        if kind == b"BYE!":
+            self.remove(address)
+            return
+        viewer = self.viewers.get(address)
+        if viewer is None:
+            viewer = self.viewers[address] = self.broadcaster.add_viewer(UdpViewer(self.sock, address))
+        viewer.report(lost)
+
+    def remove(self, address):
+        viewer = self.viewers.pop(address, None)
+        if viewer is not None:
+            viewer.close()
+            self.broadcaster.unsubscribe(viewer)
+
+    def close(self):
+        self.running = False
+        self.sock.close()
+
+
+class QualityController:
+    # Một lần nén dùng cho mọi người xem, nên mức chất lượng đi theo người xem đang nghẽn nhất:
+    # nghẽn thì lùi hai mức, thông suốt ba lần đánh giá liên tiếp thì tiến một mức
+    def __init__(self, min_quality=30, max_quality=90, min_scale=0.5, min_fps=5, max_fps=30, on_event=print):
+        self.levels = []
+        for quality, scale, fps in QUALITY_LADDER:
+            level = (min(max(quality, min_quality), max_quality), max(scale, min_scale),
+                     min(max(fps, min_fps), max_fps))
+            if level not in self.levels:
+                self.levels.append(level)
+        # Bắt đầu từ mức gần với cấu hình cố định trước đây (JPEG 80, đủ kích thước)
+        self.level = next((i for i, level in enumerate(self.levels) if level[0] <= JPEG_QUALITY), 0)
+        self.on_event = on_event
+        self.clear = 0
+        self.next_check = 0
+        self.hold_until = 0
+        self.dropped = {}  # viewer -> số frame bị bỏ ở lần đánh giá trước
+
+    def setting(self):
+        return self.levels[self.level]
+
+    def update(self, viewers, now):
+        if now < self.next_check:
+            return
+        self.next_check = now + ADAPT_INTERVAL
+        reason = None
+        for viewer in viewers:
+            dropped = viewer.dropped - self.dropped.get(viewer, 0)
+            if dropped:
+                reason = f"{dropped} frames dropped for {viewer.address}"
+            elif viewer.rtt is not None and viewer.inflight() > MAX_INFLIGHT:
+                reason = f"{viewer.inflight()} frames in flight to {viewer.address}"
+            elif viewer.rtt is not None and viewer.rtt > viewer.min_rtt + RTT_SLACK:
+                reason = f"rtt {viewer.rtt * 1000:.0f} ms to {viewer.address}"
+            if reason:
+                break
+        self.dropped = {viewer: viewer.dropped for viewer in viewers}
+        if reason:
+            self.clear = 0
+            if now >= self.hold_until:
+                self.hold_until = now + ADAPT_HOLD
+                self.step(2, reason)
+        elif viewers:
+            self.clear += 1
+            if self.clear >= 3:
+                self.clear = 0
+                self.step(-1, "link is clear")
+
+    def step(self, delta, reason):
+        level = min(max(self.level + delta, 0), len(self.levels) - 1)
+        if level == self.level:
+            return
+        self.level = level
+        quality, scale, fps = self.setting()
+        self.on_event(f"Video quality set to JPEG {quality}, scale {scale}, {fps} fps ({reason})")
+
+
+class TileEncoder:
+    # Giữ ảnh bên xem đang có (frame đầy đủ gần nhất cộng các ô đã gửi sau đó); mỗi frame chỉ gửi các ô khác
+    # ảnh đó, ghép thành một JPEG. Frame đầy đủ là JPEG thường, gửi định kỳ hoặc khi được yêu cầu.
+    def __init__(self, tile=TILE_SIZE, keyframe_interval=KEYFRAME_INTERVAL):
+        self.tile = tile
+        self.keyframe_interval = keyframe_interval
+        self.reference = None
+        self.next_keyframe = 0
+        self.mosaics = {}  # kích thước -> buffer ảnh ghép dùng lại
+        self.keyframes = 0
+        self.deltas = 0
+        self.skipped = 0  # frame không có ô nào đổi, không gửi gì
+
+    def layout(self, shape):
+        height, width = shape[:2]
+        self.rows = np.arange(0, height, self.tile)
+        self.cols = np.arange(0, width, self.tile)
+        self.diff = np.empty(shape, dtype=np.uint8)
+
+    def encode(self, frame, quality, now, keyframe=False):
+        # Trả về dữ liệu cần gửi, hoặc None nếu ảnh bên xem vẫn đúng
+        tile = self.tile
+        changed = None
+        if not keyframe and now < self.next_keyframe and self.reference is not None \
+                and self.reference.shape == frame.shape:
+            diff = cv2.absdiff(frame, self.reference, dst=self.diff)
+            counts = np.add.reduceat(np.add.reduceat(diff > PIXEL_THRESHOLD, self.rows, axis=0, dtype=np.uint32),
+                                     self.cols, axis=1, dtype=np.uint32).sum(axis=2)
+            changed = np.flatnonzero(counts > TILE_CHANGED)
+            if not changed.size:
+                self.skipped += 1
+                return None
+            if changed.size > KEYFRAME_RATIO * counts.size:
+                changed = None
+        if changed is None:
+            ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+            if not ok:
+                return None
+            if self.reference is None or self.reference.shape != frame.shape:
+                self.reference = np.empty_like(frame)
+                self.layout(frame.shape)
+            np.copyto(self.reference, frame)
+            self.next_keyframe = now + self.keyframe_interval
+            self.keyframes += 1
+            return buffer.data
+        columns = len(self.cols)
+        per_row = min(changed.size, MOSAIC_COLUMNS)
+        size = (-(-changed.size // per_row) * tile, per_row * tile)
+        if size not in self.mosaics:
+            self.mosaics[size] = np.zeros(size + (3,), dtype=np.uint8)
+        mosaic = self.mosaics[size]
+        for k, index in enumerate(changed.tolist()):
+            y, x = divmod(index, columns)
+            rows, cols = slice(y * tile, (y + 1) * tile), slice(x * tile, (x + 1) * tile)
+            block = frame[rows, cols]
+            my, mx = divmod(k, per_row)
+            mosaic[my * tile:my * tile + block.shape[0], mx * tile:mx * tile + block.shape[1]] = block
+            self.reference[rows, cols] = block
+        ok, buffer = cv2.imencode('.jpg', mosaic, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if not ok:
+            return None
+        self.deltas += 1
+        height, width = frame.shape[:2]
+        return (TILE_HEADER.pack(b"TILE", width, height, tile, changed.size) + changed.astype(">u2").tobytes()
+                + buffer.tobytes())
+
+
+class VideoBroadcaster:
+    # Một luồng duy nhất đọc webcam; frame được resize một lần, nén JPEG một lần và cùng một bytes đưa vào
+    # hàng đợi của mọi người xem. Frame gốc mới nhất giữ lại cho phần xem trước tại chỗ.
+    def __init__(self, cap, on_event=print, controller=None, interval=FRAME_INTERVAL, encoder=None):
+        self.cap = cap
+        self.on_event = on_event
+        self.controller = controller or QualityController(on_event=on_event)
+        self.encoder = encoder  # TileEncoder để chỉ gửi các ô thay đổi, None thì mọi frame là JPEG đầy đủ
+        self.keyframe = True  # người xem mới hoặc vừa mất frame cần một frame đầy đủ
+        self.lost = 0
+        self.interval = interval
+        self.viewers = []
+        self.lock = threading.Lock()
+        self.cond = threading.Condition()
+        self.frame = None  # frame BGR mới nhất, đã resize
+        self.pipeline = FramePipeline()
+        self.scaled = {}  # kích thước -> buffer cho frame thu nhỏ trước khi nén
+        self.seq = 0
+        self.encoded = 0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        with self.cond:
+            self.cond.notify_all()
+        if self.thread is not None and self.thread is not threading.current_thread():
+            self.thread.join(timeout=1)
+        with self.lock:
+            viewers, self.viewers = self.viewers, []
+        for viewer in viewers:
+            viewer.close()
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+    def subscribe(self, sock, address):
+        return self.add_viewer(Viewer(sock, address, self.unsubscribe))
+
+    def add_viewer(self, viewer):
+        with self.lock:
+            self.viewers.append(viewer)
+            self.keyframe = True
+        self.on_event(f"Video viewer {viewer.address} joined, {len(self.viewers)} watching")
+        return viewer
+
+    def unsubscribe(self, viewer, error=None):
+        with self.lock:
+            if viewer not in self.viewers:
+                return
+            self.viewers.remove(viewer)
+        self.on_event(f"Video viewer {viewer.address} left after {viewer.sent} frames "
+                      f"({viewer.dropped} dropped){f': {error}' if error else ''}")
+
+    def latest(self, seq, timeout=1.0):
+        # Chờ frame mới hơn seq; trả về (seq, frame), frame là None nếu hết thời gian chờ hoặc đã dừng
+        with self.cond:
+            if self.seq == seq and self.running:
+                self.cond.wait(timeout)
+            if self.seq == seq:
+                return seq, None
+            return self.seq, self.frame
+
+    def run(self):
+        next_send = 0
+        while self.running:
+            if self.cap is None or not self.cap.isOpened():
+                self.on_event("Webcam closed in video broadcaster, attempting to reopen")
+                self.cap = cv2.VideoCapture(0)
+                if not self.cap.isOpened():
+                    self.on_event("Failed to reopen webcam")
+                    time.sleep(1)
+                    continue
+            ret, frame = self.cap.read()
+            if not ret:
+                self.on_event("Failed to capture video frame, retrying")
+                self.cap.release()
+                self.cap = None
+                time.sleep(self.interval)
+                continue
+            # Frame đang công bố có thể còn được phần xem trước đọc, ghi vào buffer khác
+            frame = self.pipeline.process(frame, self.pipeline.buffer(busy=(self.frame,)))
+            with self.cond:
+                self.frame = frame
+                self.seq += 1
+                self.cond.notify_all()
+            with self.lock:
+                viewers = list(self.viewers)
+            now = time.monotonic()
+            self.controller.update(viewers, now)
+            quality, scale, fps = self.controller.setting()
+            # Xem trước tại chỗ vẫn đủ fps; chỉ frame gửi đi theo fps của mức chất lượng hiện tại
+            if viewers and now >= next_send:
+                next_send = max(next_send + 1 / fps, now)
+                if scale < 1:
+                    size = (int(FRAME_WIDTH * scale), int(FRAME_HEIGHT * scale))
+                    if size not in self.scaled:
+                        self.scaled[size] = np.empty((size[1], size[0], 3), dtype=np.uint8)
+                    frame = cv2.resize(frame, size, dst=self.scaled[size], interpolation=cv2.INTER_AREA)
+                # Nén một lần cho mọi người xem; thêm người xem chỉ tốn thêm một lần ghi socket
+                if self.encoder is None:
+                    ok, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+                    payload = buffer.data if ok else None
+                else:
+                    # Người xem mất frame thì ảnh của họ đã sai, frame kế tiếp phải đầy đủ
+                    lost = sum(viewer.dropped for viewer in viewers)
+                    with self.lock:
+                        keyframe, self.keyframe = self.keyframe or lost != self.lost, False
+                    self.lost = lost
+                    payload = self.encoder.encode(frame, quality, now, keyframe)
+                if payload is not None:
+                    self.encoded += 1
+                    data = len(payload).to_bytes(4, byteorder='big') + payload
+                    for viewer in viewers:
+                        viewer.push(data)
+            time.sleep(self.interval)
+
+
+class FrameReceiver:
+    # Đọc frame vào buffer dùng lại, giải mã và chuyển sẵn sang RGB ngoài luồng Tk; chỉ giữ frame mới nhất,
+    # frame chưa kịp hiển thị thì bị thay thế chứ không xếp hàng làm tăng độ trễ
+    def __init__(self, sock, on_event=print, width=FRAME_WIDTH, height=FRAME_HEIGHT, executor=None):
+        self.sock = sock
+        self.on_event = on_event
+        self.executor = executor  # pool giải mã dùng chung của VideoGrid, None thì giải mã ngay trên luồng nhận
+        self.queued = deque()  # frame chờ giải mã khi có pool
+        self.busy = False  # đang có tác vụ của luồng này trên pool
+        self.interval = 0  # khoảng tối thiểu giữa hai lần giải mã, VideoGrid đặt theo ngân sách
+        self.next_decode = 0
+        self.waiting = False  # đã bỏ frame ô, các frame ô sau vô nghĩa cho tới frame đầy đủ kế tiếp
+        self.refresh = False  # kích thước ô lưới đổi, cần chuyển lại ảnh đang có
+        self.header = bytearray(4)
+        self.buffer = bytearray(RECEIVE_BUFFER)
+        self.lock = threading.Lock()
+        self.frame = None  # frame RGB mới nhất chưa hiển thị
+        self.taken = None  # frame luồng Tk vừa lấy, có thể còn đang vẽ
+        self.pipeline = FramePipeline(width, height, rgb=True)
+        self.canvas = None  # ảnh BGR đã ghép, các ô của frame tiếp theo được chép đè lên đây
+        self.received = 0
+        self.decoded = 0  # số frame đã xử lý xong, gửi lại cho bên gửi làm ack
+        self.skipped = 0  # frame bị bỏ không giải mã vì vượt ngân sách, cũng tính là đã xử lý
+        self.dropped = 0
+        self.displayed = 0
+        self.closed = False
+        self.error = None  # None nếu bên gửi đóng kết nối bình thường
+
+    def recv_exact(self, view):
+        got = 0
+        while got < len(view):
+            n = self.sock.recv_into(view[got:])
+            if not n:
+                break
+            got += n
+        return got
+
+    def run(self):
+        try:
+            while not self.closed:
+                if self.recv_exact(memoryview(self.header)) < 4:
+                    break
+                size = int.from_bytes(self.header, byteorder='big')
+                if size > len(self.buffer):
+                    self.buffer = bytearray(size)
+                if self.recv_exact(memoryview(self.buffer)[:size]) < size:
+                    self.error = ConnectionResetError("Incomplete video frame received")
+                    break
+                self.handle(memoryview(self.buffer)[:size])
+        except (OSError, ValueError) as e:
+            if not self.closed:
+                self.error = e
+        finally:
+            self.close()
+
+    def handle(self, data):
+        # Có pool: chép frame vào hàng chờ, giải mã theo lô không quá một lần mỗi interval. Frame đầy đủ thay thế
+        # mọi frame chờ trước nó; frame ô thì phải giải mã đủ và đúng thứ tự, sau khi mất frame thì bị bỏ cho tới
+        # frame đầy đủ kế tiếp
+        skip = False
+        with self.lock:
+            if data[:4] != b"TILE":
+                self.skipped += len(self.queued)
+                self.queued.clear()
+                self.waiting = False
+            elif self.waiting or len(self.queued) >= PENDING_LIMIT:
+                self.skipped += len(self.queued) + 1
+                self.queued.clear()
+                self.waiting = True
+                skip = True
+            if not skip and self.executor is not None:
+                self.queued.append(bytes(data))
+        if skip:
+            self.ack()
+        elif self.executor is None:
+            self.publish(data)
+            self.ack()
+        else:
+            self.schedule()
+
+    def lose(self):
+        # Một frame không tới được: ảnh ghép thiếu các ô của nó, chờ frame đầy đủ
+        with self.lock:
+            self.waiting = True
+
+    def schedule(self):
+        now = time.monotonic()
+        with self.lock:
+            if self.busy or self.closed or not (self.queued or self.refresh) or now < self.next_decode:
+                return
+            self.busy = True
+            batch, self.queued = self.queued, deque()
+            self.next_decode = now + self.interval
+        self.executor.submit(self.decode, batch)
+
+    def decode(self, batch):
+        try:
+            for k, data in enumerate(batch):
+                self.publish(data, display=k == len(batch) - 1)
+            if self.refresh:
+                self.refresh = False
+                if not batch and self.canvas is not None:
+                    self.display(self.canvas)
+            self.ack()
+        except Exception as e:
+            self.on_event(f"Error decoding video frame: {str(e)}")
+        finally:
+            with self.lock:
+                self.busy = False
+
+    def publish(self, data, display=True):
+        if data[:4] == b"TILE":
+            frame = self.composite(data)
+            if frame is None:
+                self.decoded += 1
+                return
+        else:
+            frame = self.canvas = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if frame is None:
+            self.on_event("Failed to decode video frame, possibly corrupted data")
+        elif display:
+            self.display(frame)
+        self.decoded += 1
+
+    def display(self, frame):
+        with self.lock:
+            pipeline = self.pipeline
+            out = pipeline.buffer(busy=(self.frame, self.taken))
+        frame = pipeline.process(frame, out)
+        with self.lock:
+            if self.frame is not None:
+                self.dropped += 1
+            self.frame = frame
+            self.received += 1
+
+    def resize(self, width, height):
+        # Gọi khi bố cục lưới đổi: vẽ lại ảnh đang có vào ô mới; frame cũ khác kích thước bị VideoGrid bỏ qua
+        with self.lock:
+            if self.pipeline.size != (width, height):
+                self.pipeline = FramePipeline(width, height, rgb=True)
+            self.refresh = True
+
+    def composite(self, data):
+        _, width, height, tile, count = TILE_HEADER.unpack_from(data)
+        canvas = self.canvas
+        if canvas is None or canvas.shape[:2] != (height, width):
+            return None  # chưa có frame đầy đủ ở kích thước này, chờ frame đầy đủ kế tiếp
+        indexes = np.frombuffer(data, dtype=">u2", count=count, offset=TILE_HEADER.size)
+        mosaic = cv2.imdecode(np.frombuffer(data, dtype=np.uint8, offset=TILE_HEADER.size + 2 * count),
+                              cv2.IMREAD_COLOR)
+        if mosaic is None:
+            self.on_event("Failed to decode video tiles, possibly corrupted data")
+            return None
+        columns = -(-width // tile)
+        per_row = mosaic.shape[1] // tile
+        for k, index in enumerate(indexes.tolist()):
+            y, x = divmod(index, columns)
+            block = canvas[y * tile:(y + 1) * tile, x * tile:(x + 1) * tile]
+            my, mx = divmod(k, per_row)
+            block[...] = mosaic[my * tile:my * tile + block.shape[0], mx * tile:mx * tile + block.shape[1]]
+        return canvas
+
+    def ack(self):
+        # Không bao giờ chờ: bên gửi đời cũ không đọc ack thì bỏ qua khi buffer gửi đã đầy
+        if self.closed:
+            return
+        if select.select([], [self.sock], [], 0)[1]:
+            self.sock.send((self.decoded + self.skipped).to_bytes(4, byteorder='big'))
+
+    def take(self):
+        with self.lock:
+            frame, self.frame = self.frame, None
+            if frame is not None:
+                self.taken = frame
+        if frame is not None:
+            self.displayed += 1
+        return frame
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+class UdpFrameReceiver(FrameReceiver):
+    # Nhận video qua UDP: ghép các mảnh theo frame id trong jitter buffer; frame nào đủ mảnh thì giải mã ngay và
+    # bỏ mọi frame cũ hơn còn dở, frame thiếu mảnh quá JITTER_DELAY cũng bị bỏ. Không bao giờ chờ gửi lại,
+    # nên một gói mất chỉ làm mất một frame chứ không chặn các frame sau như TCP.
+    def __init__(self, sock, on_event=print, width=FRAME_WIDTH, height=FRAME_HEIGHT, executor=None):
+        super().__init__(sock, on_event, width, height, executor)
+        self.packet = bytearray(65536)
+        self.pending = {}  # frame id -> [dữ liệu, số mảnh đã có, cờ từng mảnh, lúc mảnh đầu tới, độ dài]
+        self.frame_id = 0  # frame mới nhất đã giải mã
+        self.sent_at = 0.0  # thời điểm bên gửi gửi frame đó
+        self.lost = 0
+
+    def run(self):
+        # sock đã connect tới cổng UDP của bên phát, nên chỉ nhận gói từ đó
+        self.sock.settimeout(REPORT_INTERVAL)
+        last_packet = next_report = time.monotonic()
+        try:
+            while not self.closed:
+                now = time.monotonic()
+                if now >= next_report:
+                    self.report(b"HELO")
+                    next_report = now + REPORT_INTERVAL
+                try:
+                    n = self.sock.recv_into(self.packet)
+                except socket.timeout:
+                    if time.monotonic() - last_packet > VIEWER_TIMEOUT:
+                        self.error = TimeoutError("No video packets from sender")
+                        break
+                    continue
+                except ConnectionRefusedError:
+                    # Bên phát chưa mở hoặc đã đóng cổng UDP; gói chào sau sẽ thử lại
+                    continue
+                last_packet = time.monotonic()
+                if n >= FRAGMENT_HEADER.size:
+                    self.fragment(n, last_packet)
+        except OSError as e:
+            if not self.closed:
+                self.error = e
+        finally:
+            self.close()
+
+    def fragment(self, n, now):
+        frame_id, index, count, sent_at = FRAGMENT_HEADER.unpack_from(self.packet)
+        if frame_id <= self.frame_id or index >= count:
+            return  # mảnh của frame đã giải mã hoặc đã bỏ
+        for old, entry in list(self.pending.items()):
+            if now - entry[3] > JITTER_DELAY:
+                del self.pending[old]
+        entry = self.pending.get(frame_id)
+        if entry is None:
+            entry = self.pending[frame_id] = [bytearray(count * FRAGMENT_PAYLOAD), 0, bytearray(count), now, 0]
+        data, got, have = entry[0], entry[1], entry[2]
+        if have[index]:
+            return
+        have[index] = 1
+        length = n - FRAGMENT_HEADER.size
+        offset = index * FRAGMENT_PAYLOAD
+        memoryview(data)[offset:offset + length] = memoryview(self.packet)[FRAGMENT_HEADER.size:n]
+        entry[1] = got + 1
+        if index == count - 1:
+            entry[4] = offset + length
+        if entry[1] < count:
+            return
+        for old in [old for old in self.pending if old <= frame_id]:
+            del self.pending[old]
+        gap = frame_id - self.frame_id - 1
+        self.frame_id = frame_id
+        self.sent_at = sent_at
+        if gap > 0:
+            # Báo ngay để bên phát gửi frame đầy đủ, không chờ tới lần báo định kỳ
+            self.lost += gap
+            self.lose()
+            self.report(b"HELO")
+        self.handle(memoryview(data)[:entry[4]])
+
+    def ack(self):
+        pass  # bên phát UDP không chờ ack từng frame, report() gửi định kỳ trong run()
+
+    def report(self, kind):
+        try:
+            self.sock.send(REPORT.pack(kind, self.decoded, self.lost))
+        except OSError:
+            pass
+
+    def close(self):
+        if not self.closed:
+            self.report(b"BYE!")
+        super().close()
+
+
+class VideoGrid:
+    # Xem nhiều người phát cùng lúc: mỗi luồng có FrameReceiver riêng đọc socket, việc giải mã chạy trên một pool
+    # chung và mỗi luồng chỉ được giải mã budget / số luồng lần mỗi giây. Luồng Tk ghép frame mới nhất của từng
+    # luồng vào ô của nó trong một ảnh lưới kích thước width x height.
+    def __init__(self, width=FRAME_WIDTH, height=FRAME_HEIGHT, columns=0, workers=DECODE_WORKERS,
+                 budget=DECODE_BUDGET):
+        self.width = width
+        self.height = height
+        self.columns = columns  # 0 thì tự chọn lưới gần vuông nhất
+        self.budget = budget
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="video-decode")
+        self.lock = threading.Lock()
+        self.streams = {}  # tên người phát -> FrameReceiver, theo thứ tự tham gia
+        self.cells = {}  # tên người phát -> (hàng, cột) điểm góc trên trái của ô
+        self.canvas = np.zeros((height, width, 3), dtype=np.uint8)  # ảnh RGB ghép, chỉ luồng Tk ghi
+        self.relayout = False  # bố cục vừa đổi, xoá ảnh ghép ở lần take() sau
+        self.changed = False
+
+    def add(self, name, receiver):
+        with self.lock:
+            old = self.streams.pop(name, None)
+            self.streams[name] = receiver
+            self.layout()
+        if old is not None and old is not receiver:
+            old.close()
+
+    def remove(self, name, receiver=None):
+        with self.lock:
+            if name not in self.streams or (receiver is not None and self.streams[name] is not receiver):
+                return
+            del self.streams[name]
+            self.layout()
+
+    def close_stream(self, name):
+        with self.lock:
+            receiver = self.streams.get(name)
+        if receiver is not None:
+            receiver.close()
+
+    def layout(self):
+        count = len(self.streams)
+        if not count:
+            self.cells = {}
+            return
+        columns = min(self.columns or int(np.ceil(np.sqrt(count))), count)
+        rows = -(-count // columns)
+        width, height = self.width // columns, self.height // rows
+        self.cells = {}
+        for k, (name, receiver) in enumerate(self.streams.items()):
+            row, column = divmod(k, columns)
+            self.cells[name] = (row * height, column * width, height, width)
+            receiver.resize(width, height)
+            receiver.interval = count / self.budget
+        self.relayout = True
+
+    def take(self):
+        # Luồng Tk: trả về ảnh lưới nếu có ô nào đổi từ lần trước, None nếu không
+        with self.lock:
+            streams = list(self.streams.items())
+            cells = dict(self.cells)
+            if self.relayout:
+                self.relayout = False
+                self.canvas[...] = 0
+                self.changed = True
+        for name, receiver in streams:
+            receiver.schedule()
+            frame = receiver.take()
+            cell = cells.get(name)
+            if frame is None or cell is None or frame.shape[:2] != cell[2:]:
+                continue
+            y, x, height, width = cell
+            self.canvas[y:y + height, x:x + width] = frame
+            self.changed = True
+        if not self.changed or not streams:
+            return None
+        self.changed = False
+        return self.canvas
+
+    def close(self):
+        with self.lock:
+            streams = list(self.streams.values())
+        for receiver in streams:
+            receiver.close()
+        self.executor.shutdown(wait=False)